@@ -1,12 +1,28 @@
 import os
-from flask import Flask
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from app.business.dish import Dish
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    在 jsonify 时直接序列化 Dish，流水线内部不需要提前转成字典
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Dish):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 
 def create_app():
     # 检测是否在Vercel环境中
     is_vercel = os.getenv('VERCEL') == '1'
     
     app = Flask(__name__)
+    app.json = JSONProvider(app)
     
     # 在Vercel环境中配置CORS
     if is_vercel:
@@ -38,4 +54,10 @@ def create_app():
     def health_check():
         return {'status': 'ok', 'environment': 'vercel' if is_vercel else 'local'}
     
+    # Prometheus 格式的运行指标：各阶段/上游调用耗时、收发字节、token用量、解析失败和缓存命中
+    @app.route('/metrics')
+    def metrics():
+        from app.services.metrics import render_metrics
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+    
     return app
\ No newline at end of file
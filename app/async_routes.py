@@ -0,0 +1,102 @@
+import json
+import asyncio
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from app.services.glm41v_service import AsyncGLM41VService
+from app.services.glm45_air_service import AsyncGLM45AirService
+from app.business.menu_recognition import AsyncMenuRecognition
+from app.business.cost_calculator import CostCalculator
+from app.business.health_analysis import AsyncHealthAnalysis
+from app.business.recommendation_engine import AsyncRecommendationEngine
+from app.business.nutrition_summary import AsyncNutritionSummary
+from app.business.fused_analysis import AsyncFusedAnalysis
+from app.business.image_preprocessing import ImagePreprocessor
+from app.services.stage_cache import get_stage_cache
+from app.services.dish_store import get_dish_store
+from app.services.nutrition_kb import get_nutrition_kb
+from app.business.pipeline import AsyncMenuPipeline, error_response
+from app.services.deadline import Deadline
+from app.services.metrics import stage_timer
+from app.business.dish import dish_json_default
+
+
+class DishJSONResponse(JSONResponse):
+    """响应中的 Dish 在这里一次性序列化"""
+
+    def render(self, content):
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(',', ':'), default=dish_json_default
+        ).encode('utf-8')
+
+
+# 异步服务同样延迟初始化：httpx.AsyncClient 需要在事件循环所在的进程内创建
+menu_recognition = None
+cost_calculator = None
+health_analysis = None
+recommendation_engine = None
+nutrition_summary = None
+fused_analysis = None
+pipeline = None
+image_preprocessor = ImagePreprocessor()
+
+def init_services():
+    """延迟初始化异步服务"""
+    global menu_recognition, cost_calculator, health_analysis
+    global recommendation_engine, nutrition_summary, fused_analysis, pipeline
+
+    if menu_recognition is None:
+        try:
+            glm41v_service = AsyncGLM41VService()
+            glm45_air_service = AsyncGLM45AirService()
+            # 与同步路由共享同一个阶段缓存
+            stage_cache = get_stage_cache()
+            menu_recognition = AsyncMenuRecognition(glm41v_service, cache=stage_cache)
+            cost_calculator = CostCalculator()
+            health_analysis = AsyncHealthAnalysis(
+                glm45_air_service, cache=stage_cache, dish_store=get_dish_store(), knowledge_base=get_nutrition_kb()
+            )
+            recommendation_engine = AsyncRecommendationEngine(glm45_air_service, cache=stage_cache)
+            nutrition_summary = AsyncNutritionSummary(glm45_air_service, cache=stage_cache)
+            fused_analysis = AsyncFusedAnalysis(
+                glm45_air_service, health_analysis, recommendation_engine, nutrition_summary, cache=stage_cache
+            )
+            pipeline = AsyncMenuPipeline(
+                menu_recognition, health_analysis, recommendation_engine, nutrition_summary,
+                fused_analysis, cost_calculator
+            )
+        except Exception as e:
+            print(f"Warning: Could not initialize async services: {e}")
+
+async def process_menu(request):
+    """
+    /api/process-menu 的异步实现
+    等待上游 GLM 响应期间不占用线程，单个进程即可同时处理大量请求
+    """
+    with stage_timer('pipeline', 'process_menu_async'):
+        return await _process_menu(request)
+
+async def _process_menu(request):
+    deadline = Deadline.start()
+    try:
+        # 初始化服务
+        init_services()
+
+        # 获取上传的图片
+        form = await request.form()
+        image_file = form.get('image')
+        if image_file is None or isinstance(image_file, str):
+            return JSONResponse({'error': '没有找到图片文件'}, status_code=400)
+
+        # 图片预处理是CPU密集操作，放到线程池中执行以免阻塞事件循环
+        image = await asyncio.to_thread(image_preprocessor.process, await image_file.read())
+        print("图片预处理：", image.info())
+
+        return DishJSONResponse(await pipeline.collect(image, deadline))
+    except Exception as e:
+        status, body, headers = error_response(e)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+# 由 asgi.py 挂载在 Flask 应用之前，其余路径仍交给 Flask 处理
+routes = [
+    Route('/api/process-menu', process_menu, methods=['POST']),
+]
@@ -0,0 +1,148 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+
+class JobQueueFullError(Exception):
+    """后台队列中待处理图片的总字节数已达上限"""
+
+
+class JobTooLargeError(Exception):
+    """单批图片本身就超出待处理字节数上限，重试也不会成功"""
+
+
+class BatchJob:
+    """
+    一批菜单图片的处理任务，记录每张图片的进度和结果
+    """
+
+    def __init__(self, filenames):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.finished_at = None
+        self.items = [
+            {'index': i, 'filename': filename, 'status': 'queued', 'error': None, 'result': None}
+            for i, filename in enumerate(filenames)
+        ]
+        self._lock = threading.Lock()
+
+    def _update(self, index, **fields):
+        with self._lock:
+            self.items[index].update(fields)
+            if all(item['status'] in ('completed', 'failed') for item in self.items):
+                self.finished_at = time.time()
+
+    @property
+    def status(self):
+        with self._lock:
+            return self._status_of(self.items)
+
+    @staticmethod
+    def _status_of(items):
+        statuses = {item['status'] for item in items}
+        if statuses <= {'queued'}:
+            return 'queued'
+        if statuses & {'queued', 'running'}:
+            return 'running'
+        if statuses == {'failed'}:
+            return 'failed'
+        if 'failed' in statuses:
+            return 'partial'
+        return 'completed'
+
+    def progress(self):
+        with self._lock:
+            return self._progress_of(self.items)
+
+    @staticmethod
+    def _progress_of(items):
+        counts = {'total': len(items), 'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+        for item in items:
+            counts[item['status']] += 1
+        return counts
+
+    def to_dict(self, include_results=False):
+        # 状态、进度和各图片条目取自同一时刻，后台线程同时更新时也保持一致
+        with self._lock:
+            items = [
+                {key: value for key, value in item.items() if include_results or key != 'result'}
+                for item in self.items
+            ]
+            finished_at = self.finished_at
+        return {
+            'jobId': self.id,
+            'status': self._status_of(items),
+            'createdAt': self.created_at,
+            'finishedAt': finished_at,
+            'progress': self._progress_of(items),
+            'items': items,
+        }
+
+
+class JobManager:
+    """
+    批量任务管理：图片进入有界的后台线程池，依次执行现有的菜单处理流程
+    """
+
+    def __init__(self, runner, max_workers=None, max_pending_bytes=None, max_jobs=None):
+        # runner(image_bytes) -> 单张图片的处理结果
+        self.runner = runner
+        self.max_pending_bytes = max_pending_bytes or Config.JOB_MAX_PENDING_BYTES
+        self.max_jobs = max_jobs or Config.JOB_MAX_RETAINED
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.JOB_WORKERS,
+            thread_name_prefix='menu-job',
+        )
+        self._jobs = OrderedDict()
+        # 排队和处理中的图片字节数（处理完成后释放）
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+
+    def submit(self, images):
+        """
+        提交一批图片，images 为 [(文件名, 图片字节)]
+        待处理图片的总字节数将超出上限时抛出 JobQueueFullError
+        """
+        size = sum(len(data) for _, data in images)
+        if size > self.max_pending_bytes:
+            raise JobTooLargeError(f"本批图片共 {size} 字节，超出上限 {self.max_pending_bytes} 字节，请分批提交")
+        with self._lock:
+            if self._pending_bytes + size > self.max_pending_bytes:
+                raise JobQueueFullError(f"待处理图片已达上限 {self.max_pending_bytes} 字节，请稍后重试")
+            self._pending_bytes += size
+            job = BatchJob([filename for filename, _ in images])
+            self._jobs[job.id] = job
+            self._evict_finished()
+
+        for index, (_, data) in enumerate(images):
+            self._executor.submit(self._run_item, job, index, data)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run_item(self, job, index, data):
+        job._update(index, status='running')
+        try:
+            result = self.runner(data)
+            job._update(index, status='completed', result=result)
+        except Exception as e:
+            print(f"批量任务 {job.id} 第 {index} 张图片处理失败：", str(e))
+            job._update(index, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._pending_bytes -= len(data)
+
+    def _evict_finished(self):
+        # 调用方需持有 self._lock；只淘汰已完成的最早任务
+        while len(self._jobs) > self.max_jobs:
+            for job_id, job in self._jobs.items():
+                if job.finished_at is not None:
+                    del self._jobs[job_id]
+                    break
+            else:
+                return
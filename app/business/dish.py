@@ -0,0 +1,147 @@
+import math
+from app.business.nutrition_columns import NUTRITION_FIELDS, to_number
+
+# 属性名与响应 JSON 字段名的对应关系（按输出顺序）
+_FIELDS = (
+    ('name', 'name'),
+    ('description', 'description'),
+    ('price', 'price'),
+    ('calories', 'calories'),
+    ('protein', 'protein'),
+    ('carbs', 'carbs'),
+    ('fat', 'fat'),
+    ('original_text', 'originalText'),
+    ('protein_density', 'proteinDensity'),
+    ('protein_value', 'proteinValue'),
+    ('health_score', 'healthScore'),
+    ('health_description', 'healthDescription'),
+)
+_ATTR_BY_KEY = {key: attr for attr, key in _FIELDS}
+# 数值字段在创建时统一转为 float，之后各阶段不再猜测类型
+_NUMERIC_KEYS = frozenset(NUTRITION_FIELDS + ('proteinDensity', 'proteinValue', 'healthScore'))
+
+
+def _number(value):
+    # 大模型输出的数值绝大多数已经是 int/float，跳过 to_number 的类型判断
+    if type(value) is float or type(value) is int:
+        try:
+            value = float(value)
+        except OverflowError:
+            # 超大整数（如 json 中的 1 后跟几百个 0）
+            return None
+    else:
+        value = to_number(value)
+    # NaN 和 inf 都视为缺失：inf 会让评分和总和失去意义，响应 JSON 中也无法表示
+    return value if math.isfinite(value) else None
+
+
+class Dish:
+    """
+    流水线中的一道菜：菜单解析时创建，各阶段只补充字段，只在响应边界序列化一次
+    营养和评分字段缺失时为 None（输出时省略），大模型额外返回的字段保存在 extra 中
+    """
+
+    __slots__ = tuple(attr for attr, _ in _FIELDS) + ('extra',)
+
+    def __init__(self, name, description='', price=0.0):
+        self.name = name
+        self.description = description
+        self.price = price
+        self.calories = None
+        self.protein = None
+        self.carbs = None
+        self.fat = None
+        self.original_text = None
+        self.protein_density = None
+        self.protein_value = None
+        self.health_score = None
+        self.health_description = None
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        由大模型输出或缓存中的字典创建菜品
+        """
+        dish = cls(str(data.get('name', '') or ''), str(data.get('description', '') or ''),
+                   _number(data.get('price')) or 0.0)
+        dish._update(data, skip=('name', 'description', 'price'))
+        return dish
+
+    def _update(self, data, skip=()):
+        for key, value in data.items():
+            if key in skip:
+                continue
+            attr = _ATTR_BY_KEY.get(key)
+            if attr is None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+            elif key in _NUMERIC_KEYS:
+                setattr(self, attr, _number(value))
+            else:
+                setattr(self, attr, value)
+
+    def copy(self):
+        # 逐个赋值比遍历 __slots__ 调用 getattr/setattr 快得多（大菜单每道菜都会复制）
+        dish = Dish.__new__(Dish)
+        dish.name = self.name
+        dish.description = self.description
+        dish.price = self.price
+        dish.calories = self.calories
+        dish.protein = self.protein
+        dish.carbs = self.carbs
+        dish.fat = self.fat
+        dish.original_text = self.original_text
+        dish.protein_density = self.protein_density
+        dish.protein_value = self.protein_value
+        dish.health_score = self.health_score
+        dish.health_description = self.health_description
+        dish.extra = dict(self.extra) if self.extra is not None else None
+        return dish
+
+    def with_nutrition(self, data):
+        """
+        返回合并了营养信息的新菜品；名称、描述、价格和原始文本保留本菜品的，健康描述丢弃
+        """
+        dish = self.copy()
+        dish._update(data, skip=('name', 'description', 'price', 'originalText', 'healthDescription'))
+        return dish
+
+    def has_nutrition(self):
+        return any(getattr(self, field) is not None for field in NUTRITION_FIELDS)
+
+    def to_dict(self, keys=None):
+        """
+        转为响应 JSON 中的字典；keys 指定时只输出这些字段
+        """
+        data = {}
+        for attr, key in _FIELDS:
+            value = getattr(self, attr)
+            if value is not None and (keys is None or key in keys):
+                data[key] = value
+        if self.extra:
+            for key, value in self.extra.items():
+                if keys is None or key in keys:
+                    data.setdefault(key, value)
+        return data
+
+    def __repr__(self):
+        # 业务层会 print 整个菜品列表，只输出关键字段，保持日志简短
+        return f"Dish({self.name!r}, price={self.price}, calories={self.calories}, score={self.health_score})"
+
+
+def dishes_from(items):
+    """
+    将字典列表（大模型输出、阶段缓存）转为菜品列表，忽略非字典条目
+    """
+    return [Dish.from_dict(item) for item in items if isinstance(item, dict)]
+
+
+def dish_json_default(obj):
+    """
+    json.dumps 的 default：只在响应边界把菜品转为字典
+    """
+    if isinstance(obj, Dish):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,193 @@
+import asyncio
+from config import Config
+from app.services.stage_cache import StageCacheMixin
+from app.business.json_extractor import extract_json
+from app.business.dish import dishes_from
+from app.services.deadline import DeadlineExceeded, is_degraded
+from app.services.metrics import timed_stage, PARSE_FAILURES
+
+# 合并分析覆盖的阶段：其中任一阶段超时降级时结果不写缓存
+_FUSED_STAGES = ('nutrition', 'recommendations', 'summary')
+
+
+class FusedAnalysis(StageCacheMixin):
+    """
+    合并分析：一次大模型调用同时返回营养信息、推荐编号和营养总结，
+    再交给健康分析/推荐/营养总结各自的方法拆分回原有的响应结构
+    """
+
+    def __init__(self, glm45_air_service, health_analysis, recommendation_engine, nutrition_summary,
+                 cache=None, mode=None, max_dishes=None):
+        self.glm45_air_service = glm45_air_service
+        self.health_analysis = health_analysis
+        self.recommendation_engine = recommendation_engine
+        self.nutrition_summary = nutrition_summary
+        self.cache = cache
+        # staged: 分阶段调用；fused: 合并为一次调用
+        self.mode = mode or Config.ANALYSIS_MODE
+        self.max_dishes = max_dishes or Config.FUSED_MAX_DISHES
+        if self.mode == 'fused' and recommendation_engine.mode != 'llm':
+            print("ANALYSIS_MODE=fused 需要 RECOMMENDATION_MODE=llm，当前推荐为本地排序，仍使用分阶段调用")
+
+    def applies_to(self, dish_count=None):
+        """
+        是否使用合并分析：只有推荐交给大模型时才能省掉调用；菜品过多时退回分阶段（健康分析可分批并发）
+        dish_count 为 None 表示菜品数尚未知道（流式识别之前）
+        """
+        if self.mode != 'fused' or self.recommendation_engine.mode != 'llm':
+            return False
+        return dish_count is None or 0 < dish_count <= self.max_dishes
+
+    @property
+    def summarize(self):
+        # 营养总结为本地模式时不需要大模型输出总结
+        return self.nutrition_summary.mode == 'llm'
+
+    @timed_stage('fused')
+    def analyze(self, dish_list, deadline=None):
+        """
+        返回 (带营养信息的菜品列表, 推荐菜品, 营养总结)
+        """
+        try:
+            print("开始合并分析，菜品列表：", dish_list)
+
+            cache_key = self._stage_cache_key(dish_list)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return self._from_cache(cached)
+
+            # 营养库已知的菜品直接填入营养值，大模型只补全未知的
+            known, _ = self.health_analysis.lookup_known(dish_list)
+            prefilled = [dish.with_nutrition(known[i]) if i in known else dish for i, dish in enumerate(dish_list)]
+
+            # 调用 GLM-4.5-Air API 进行合并分析
+            try:
+                response = self.glm45_air_service.analyze_menu(prefilled, summarize=self.summarize, deadline=deadline)
+            except DeadlineExceeded as e:
+                # 退回分阶段调用：预算已用完，各阶段直接使用营养库结果和本地兜底
+                print("合并分析超时，退回分阶段调用：", str(e))
+                response = None
+            else:
+                print("API响应：", response)
+
+            data = self._parse_response(response) if response is not None else None
+            if data is None:
+                print("合并分析未得到结果，退回分阶段调用")
+                dish_list_with_nutrition = self.health_analysis.analyze(dish_list, deadline)
+                recommended_dishes = self.recommendation_engine.recommend(dish_list_with_nutrition, deadline)
+                return dish_list_with_nutrition, recommended_dishes, self.nutrition_summary.generate(recommended_dishes, deadline)
+
+            dish_list_with_nutrition, recommended_dishes = self._split(data, dish_list, known)
+            summary_data = self._summary_of(data)
+            if summary_data is None:
+                summary_data = self.nutrition_summary.generate(recommended_dishes, deadline)
+            result = (dish_list_with_nutrition, recommended_dishes, summary_data)
+            if not any(is_degraded(deadline, stage) for stage in _FUSED_STAGES):
+                self._cache_set(cache_key, self._to_cache(result))
+            return result
+        except Exception as e:
+            print("合并分析出错：", str(e))
+            raise Exception(f"合并分析失败: {str(e)}")
+
+    def _stage_cache_key(self, dish_list):
+        service = self.glm45_air_service
+        version = f"{service.FUSED_PROMPT_VERSION}{'+summary' if self.summarize else ''}"
+        return self._cache_key('fused', service.MODEL, version, dish_list)
+
+    def _parse_response(self, response):
+        """
+        解析响应中的 JSON 对象，无法解析时返回 None
+        """
+        # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0].get('message', {}).get('content', '')
+            print("API返回内容：", content)
+
+            data = extract_json(content, expect=dict)
+            if data is None:
+                PARSE_FAILURES.inc(stage='fused')
+            return data
+        print("API响应格式不正确")
+        return None
+
+    def _split(self, data, dish_list, known):
+        """
+        拆分营养信息和推荐编号，新分析出的菜品写回营养库
+        """
+        dish_list_with_nutrition, misses, miss_results = self.health_analysis.merge_by_id(
+            data.get('nutrition'), dish_list, known
+        )
+        self.health_analysis.remember(misses, miss_results)
+        print("健康分析结果：", dish_list_with_nutrition)
+
+        recommended_dishes = self.recommendation_engine.from_ranking(data.get('recommended'), dish_list_with_nutrition)
+        return dish_list_with_nutrition, recommended_dishes
+
+    def _summary_of(self, data):
+        """
+        大模型给出的营养总结；本地模式或总结缺失时返回 None（由营养总结在本地计算）
+        """
+        if not self.summarize:
+            return None
+        summary_data = data.get('summary')
+        if not isinstance(summary_data, dict):
+            PARSE_FAILURES.inc(stage='summary')
+            return None
+        return summary_data
+
+    @staticmethod
+    def _to_cache(result):
+        dish_list_with_nutrition, recommended_dishes, summary_data = result
+        return {'dishList': dish_list_with_nutrition, 'recommendedDishes': recommended_dishes,
+                'nutritionSummary': summary_data}
+
+    @staticmethod
+    def _from_cache(cached):
+        return dishes_from(cached['dishList']), dishes_from(cached['recommendedDishes']), cached['nutritionSummary']
+
+
+class AsyncFusedAnalysis(FusedAnalysis):
+    """
+    FusedAnalysis 的 asyncio 版本，配合 AsyncGLM45AirService 和各 Async 业务类使用
+    """
+
+    @timed_stage('fused')
+    async def analyze(self, dish_list, deadline=None):
+        try:
+            print("开始合并分析，菜品列表：", dish_list)
+
+            cache_key = self._stage_cache_key(dish_list)
+            cached = await self._acache_get(cache_key)
+            if cached is not None:
+                return self._from_cache(cached)
+
+            known, _ = await asyncio.to_thread(self.health_analysis.lookup_known, dish_list)
+            prefilled = [dish.with_nutrition(known[i]) if i in known else dish for i, dish in enumerate(dish_list)]
+
+            try:
+                response = await self.glm45_air_service.analyze_menu(prefilled, summarize=self.summarize, deadline=deadline)
+            except DeadlineExceeded as e:
+                print("合并分析超时，退回分阶段调用：", str(e))
+                response = None
+            else:
+                print("API响应：", response)
+
+            data = self._parse_response(response) if response is not None else None
+            if data is None:
+                print("合并分析未得到结果，退回分阶段调用")
+                dish_list_with_nutrition = await self.health_analysis.analyze(dish_list, deadline)
+                recommended_dishes = await self.recommendation_engine.recommend(dish_list_with_nutrition, deadline)
+                summary_data = await self.nutrition_summary.generate(recommended_dishes, deadline)
+                return dish_list_with_nutrition, recommended_dishes, summary_data
+
+            dish_list_with_nutrition, recommended_dishes = await asyncio.to_thread(self._split, data, dish_list, known)
+            summary_data = self._summary_of(data)
+            if summary_data is None:
+                summary_data = await self.nutrition_summary.generate(recommended_dishes, deadline)
+            result = (dish_list_with_nutrition, recommended_dishes, summary_data)
+            if not any(is_degraded(deadline, stage) for stage in _FUSED_STAGES):
+                await self._acache_set(cache_key, self._to_cache(result))
+            return result
+        except Exception as e:
+            print("合并分析出错：", str(e))
+            raise Exception(f"合并分析失败: {str(e)}")
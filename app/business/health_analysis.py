@@ -1,57 +1,428 @@
 from app.services.glm45_air_service import GLM45AirService
-import re
-import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from app.services.stage_cache import StageCacheMixin
+from app.business.json_extractor import extract_json
+from app.business.dish import dishes_from
+from app.services.prompt_compiler import parse_dish_id
+from app.services.dish_store import DishNutritionStore
+from app.services.deadline import DeadlineExceeded, is_degraded, mark_degraded
+from app.services.metrics import timed_stage, PARSE_FAILURES, CACHE_LOOKUPS
 
-class HealthAnalysis:
-    def __init__(self, glm45_air_service):
+def _name_key(name):
+    return DishNutritionStore.normalize(name)
+
+
+def _match_items(items, dish_list):
+    """
+    将大模型返回的条目与菜品对应：同一下标且名称一致的直接对应，其余按名称查找
+    名称对不上的条目不使用，避免条目缺失或顺序错乱时把相邻菜品的营养信息配给别的菜
+    返回 {菜品下标: 条目}
+    """
+    keys = [_name_key(dish.name) for dish in dish_list]
+    matched = {}
+    used = set()
+    for i, key in enumerate(keys):
+        if i < len(items) and _name_key(items[i].get('name')) == key:
+            matched[i] = items[i]
+            used.add(i)
+    by_name = {}
+    for j, item in enumerate(items):
+        if j not in used:
+            by_name.setdefault(_name_key(item.get('name')), []).append(item)
+    for i, key in enumerate(keys):
+        if i not in matched and by_name.get(key):
+            matched[i] = by_name[key].pop(0)
+    return matched
+
+
+class _BatchBuilder:
+    """
+    增量拆分批次：菜品数达到上限或提示词字符数将超出上限时结束当前批次
+    """
+
+    def __init__(self, batch_size, max_chars):
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.current = []
+        self.current_chars = 0
+
+    def add(self, dish):
+        """
+        加入一道菜，返回因此完成的批次列表
+        """
+        done = []
+        dish_chars = len(dish.name) + len(dish.description) + 2
+        if self.current and self.current_chars + dish_chars > self.max_chars:
+            done.extend(self.flush())
+        self.current.append(dish)
+        self.current_chars += dish_chars
+        if len(self.current) >= self.batch_size:
+            done.extend(self.flush())
+        return done
+
+    def flush(self):
+        if not self.current:
+            return []
+        batch = self.current
+        self.current = []
+        self.current_chars = 0
+        return [batch]
+
+
+class HealthAnalysis(StageCacheMixin):
+    def __init__(self, glm45_air_service, cache=None, dish_store=None, knowledge_base=None,
+                 batch_size=None, batch_max_chars=None, max_concurrency=None):
         self.glm45_air_service = glm45_air_service
+        self.cache = cache
+        self.dish_store = dish_store
+        # 本地营养知识库，常见菜品（含写法略有不同的）直接给出营养信息
+        self.knowledge_base = knowledge_base
+        # 大菜单拆分为多个小批次并发分析，避免单次输出过长被截断
+        self.batch_size = batch_size or Config.HEALTH_BATCH_SIZE
+        self.batch_max_chars = batch_max_chars or Config.HEALTH_BATCH_MAX_CHARS
+        self.max_concurrency = max_concurrency or Config.HEALTH_MAX_CONCURRENCY
 
-    def analyze(self, dish_list):
+    @timed_stage('health')
+    def analyze(self, dish_list, deadline=None):
         """
         分析菜品的营养成分
         """
         try:
             print("开始健康分析，菜品列表：", dish_list)
-            
-            # 调用 GLM-4.5-Air API 进行健康分析
-            response = self.glm45_air_service.analyze_health(dish_list)
-            print("API响应：", response)
-            
-            # 解析响应并返回营养成分数据
-            # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
-            if 'choices' in response and len(response['choices']) > 0:
-                content = response['choices'][0].get('message', {}).get('content', '')
-                print("API返回内容：", content)
-                
-                # 提取JSON部分
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(1)
-                    print("提取到的JSON内容：", json_content)
-                    nutrition_data = json.loads(json_content)
-                    print("解析后的营养数据：", nutrition_data)
-                    
-                    # 将营养信息与原始菜品信息合并
-                    for i, dish in enumerate(nutrition_data):
-                        if i < len(dish_list):
-                            # 保留原始菜品的名称、描述和价格
-                            dish['name'] = dish_list[i].get('name', dish.get('name', ''))
-                            dish['description'] = dish_list[i].get('description', dish.get('description', ''))
-                            dish['price'] = dish_list[i].get('price', dish.get('price', 0))
-                            # 保留原始文本（如果存在）
-                            if 'originalText' in dish_list[i]:
-                                dish['originalText'] = dish_list[i]['originalText']
-                            # 移除可能存在的健康描述字段
-                            dish.pop('healthDescription', None)
-                    
-                    print("最终返回的营养数据：", nutrition_data)
-                    return nutrition_data
+
+            cache_key = self._stage_cache_key(dish_list)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return dishes_from(cached)
+
+            # 先从菜品营养库中批量查找，只把未见过的菜品发给大模型
+            known, misses = self.lookup_known(dish_list)
+            miss_results = []
+            if misses:
+                batches = self._split_batches(misses)
+                if len(batches) == 1:
+                    miss_results = self._analyze_batch(batches[0], deadline)
                 else:
-                    print("未找到JSON格式数据，返回原始菜品列表")
-                    # 如果没有JSON格式，返回原始菜品列表（没有营养信息）
-                    return dish_list
-            print("API响应格式不正确，返回空列表")
-            return []
+                    # 各批次并发调用，按批次顺序拼回
+                    print(f"菜品较多，拆分为 {len(batches)} 个批次并发分析")
+                    with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                        for batch_results in executor.map(functools.partial(self._analyze_batch, deadline=deadline), batches):
+                            miss_results.extend(batch_results)
+
+            nutrition_data = self._assemble(dish_list, known, miss_results)
+            if not is_degraded(deadline, 'nutrition'):
+                self._cache_set(cache_key, nutrition_data)
+            return nutrition_data
         except Exception as e:
             print("健康分析出错：", str(e))
-            raise Exception(f"健康分析失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"健康分析失败: {str(e)}")
+
+    @timed_stage('health')
+    def analyze_stream(self, dishes, deadline=None):
+        """
+        边识别边分析：dishes 为逐道产出菜品的迭代器（如流式菜单识别）
+        每凑满一个（较小的）批次立即提交分析，与菜单识别重叠执行
+        依次产出 ('menu', 菜品列表) 和 ('nutrition', 带营养信息的菜品列表)：
+        菜品列表在识别完成时立即产出，不等待仍在进行的健康分析
+        """
+        dish_list = []
+
+        def collect():
+            for dish in dishes:
+                dish_list.append(dish)
+                yield dish
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # 迭代菜品时的异常（如菜单识别失败）原样抛出
+            futures = [
+                executor.submit(self._analyze_with_store, batch, deadline)
+                for batch in self._iter_batches(collect(), Config.HEALTH_STREAM_BATCH_SIZE)
+            ]
+            try:
+                yield 'menu', dish_list
+            except GeneratorExit:
+                # 调用方不再需要结果（如客户端断开）：尚未开始的批次不再调用大模型
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            try:
+                nutrition_data = []
+                for future in futures:
+                    nutrition_data.extend(future.result())
+            except Exception as e:
+                print("健康分析出错：", str(e))
+                raise Exception(f"健康分析失败: {str(e)}")
+
+        print(f"流式健康分析完成，共 {len(dish_list)} 道菜，{len(futures)} 个批次")
+        if not is_degraded(deadline, 'nutrition'):
+            self._cache_set(self._stage_cache_key(dish_list), nutrition_data)
+        yield 'nutrition', nutrition_data
+
+    def _stage_cache_key(self, dish_list):
+        service = self.glm45_air_service
+        return self._cache_key('health', service.MODEL, service.HEALTH_PROMPT_VERSION, dish_list)
+
+    def _split_batches(self, dish_list):
+        """
+        按菜品数量和提示词字符数将菜品列表拆分为多个批次
+        """
+        return list(self._iter_batches(dish_list))
+
+    def _iter_batches(self, dishes, batch_size=None):
+        """
+        逐个消费菜品并产出批次，dishes 可以是仍在生成中的迭代器
+        """
+        builder = _BatchBuilder(batch_size or self.batch_size, self.batch_max_chars)
+        for dish in dishes:
+            yield from builder.add(dish)
+        yield from builder.flush()
+
+    def _analyze_batch(self, batch, deadline=None):
+        """
+        分析一个批次的菜品，返回与批次按下标对齐的结果
+        """
+        # 调用 GLM-4.5-Air API 进行健康分析
+        try:
+            response = self.glm45_air_service.analyze_health(batch, deadline)
+        except DeadlineExceeded as e:
+            return self._timed_out_batch(batch, deadline, e)
+        print("API响应：", response)
+        return self._finish_batch(response, batch)
+
+    def _analyze_with_store(self, batch, deadline=None):
+        """
+        流式分析中的单个批次：先查营养库，只把未命中的菜品发给大模型
+        """
+        known, misses = self.lookup_known(batch)
+        miss_results = self._analyze_batch(misses, deadline) if misses else []
+        return self._assemble(batch, known, miss_results)
+
+    @staticmethod
+    def _timed_out_batch(batch, deadline, error):
+        """
+        时限内未完成的批次保留原始菜品（没有营养信息），其余批次和营养库命中的结果照常返回
+        """
+        print(f"健康分析超时，{len(batch)} 道菜缺少营养信息：", str(error))
+        mark_degraded(deadline, 'nutrition')
+        return list(batch)
+
+    def _finish_batch(self, response, batch):
+        batch_results, matched = self._merge_response(response, batch)
+        # 只把按名称核对过的结果写入营养库
+        self.remember([batch[i] for i in matched], [batch_results[i] for i in matched])
+        return self._align(batch_results, batch)
+
+    @staticmethod
+    def _align(batch_results, batch):
+        """
+        按下标对齐批次结果：多出的条目丢弃，缺少的条目保留原始菜品（没有营养信息）
+        """
+        return list(batch_results[:len(batch)]) + list(batch[len(batch_results):])
+
+    def lookup_known(self, dish_list):
+        """
+        先查本地营养知识库，再批量查询菜品营养库，返回 (已知菜品 {下标: 营养信息}, 未命中的菜品列表)
+        """
+        component = type(self).__name__
+        known = {}
+        if self.knowledge_base is not None:
+            known = self.knowledge_base.get_many(dish_list)
+            CACHE_LOOKUPS.inc(len(known), cache='knowledge_base', component=component, outcome='hit')
+            CACHE_LOOKUPS.inc(len(dish_list) - len(known), cache='knowledge_base', component=component, outcome='miss')
+
+        if self.dish_store is not None:
+            remaining = [i for i in range(len(dish_list)) if i not in known]
+            found = {}
+            if remaining:
+                try:
+                    found = self.dish_store.get_many(
+                        [dish_list[i] for i in remaining], self.glm45_air_service.HEALTH_PROMPT_VERSION
+                    )
+                except Exception as e:
+                    # 营养库只是加速手段，出错时退回全部交给大模型
+                    print("查询菜品营养库失败：", str(e))
+                    found = {}
+            for j, nutrition in found.items():
+                known[remaining[j]] = nutrition
+            CACHE_LOOKUPS.inc(len(found), cache='dish_store', component=component, outcome='hit')
+            CACHE_LOOKUPS.inc(len(remaining) - len(found), cache='dish_store', component=component, outcome='miss')
+
+        misses = [dish for i, dish in enumerate(dish_list) if i not in known]
+        print(f"营养知识库/菜品营养库命中 {len(known)} 道，需要分析 {len(misses)} 道")
+        return known, misses
+
+    def remember(self, misses, miss_results):
+        """
+        将大模型新分析出的菜品写回营养库
+        """
+        if self.dish_store is None or not miss_results:
+            return
+        try:
+            self.dish_store.put_many(misses, miss_results, self.glm45_air_service.HEALTH_PROMPT_VERSION)
+        except Exception as e:
+            print("写入菜品营养库失败：", str(e))
+
+    def _assemble(self, dish_list, known, miss_results):
+        """
+        按原始顺序合并营养库命中结果与大模型分析结果
+        """
+        nutrition_data = []
+        miss_iter = iter(miss_results)
+        for i, dish in enumerate(dish_list):
+            if i in known:
+                nutrition_data.append(dish.with_nutrition(known[i]))
+            else:
+                # 大模型返回的结果少于请求的菜品时，保留原始菜品（没有营养信息）
+                nutrition_data.append(next(miss_iter, dish))
+        return nutrition_data
+
+    def merge_by_id(self, items, dish_list, known):
+        """
+        合并大模型按编号返回的营养信息（合并分析使用），营养库已知的菜品不会被覆盖
+        返回 (带营养信息的菜品列表, 新分析的菜品, 与之对齐的分析结果)
+        """
+        nutrition_data = [dish.with_nutrition(known[i]) if i in known else dish for i, dish in enumerate(dish_list)]
+        misses = []
+        miss_results = []
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            index = parse_dish_id(item.get('id'), len(dish_list))
+            if index is None or index in known:
+                continue
+            # 编号只用于对齐，不属于菜品字段（否则会出现在响应和营养库中）
+            nutrition = {key: value for key, value in item.items() if key != 'id'}
+            nutrition_data[index] = dish_list[index].with_nutrition(nutrition)
+            misses.append(dish_list[index])
+            miss_results.append(nutrition_data[index])
+        return nutrition_data, misses, miss_results
+
+    def _merge_response(self, response, dish_list):
+        """
+        解析响应并将营养信息与原始菜品信息合并
+        返回 (与菜品按下标对齐的结果, 按名称对上了营养信息的菜品下标)
+        """
+        # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0].get('message', {}).get('content', '')
+            print("API返回内容：", content)
+
+            # 提取并解析JSON部分（被截断的数组会回退到最后一个完整的菜品）
+            nutrition_data = extract_json(content, expect=list)
+            if nutrition_data is None:
+                print("未找到JSON格式数据，返回原始菜品列表")
+                PARSE_FAILURES.inc(stage='health')
+                # 如果没有JSON格式，返回原始菜品列表（没有营养信息）
+                return dish_list, []
+            print("解析后的营养数据：", nutrition_data)
+
+            # 将营养信息与原始菜品按名称合并（保留原始菜品的名称、描述、价格和原始文本，丢弃健康描述）
+            # 没有对应菜品的条目直接丢弃，没有对应条目的菜品保留原样（没有营养信息）
+            items = [item for item in nutrition_data if isinstance(item, dict)]
+            matched = _match_items(items, dish_list)
+            if len(matched) < len(dish_list):
+                print(f"{len(dish_list) - len(matched)} 道菜在返回结果中没有对应的条目")
+            nutrition_data = [
+                dish.with_nutrition(matched[i]) if i in matched else dish for i, dish in enumerate(dish_list)
+            ]
+
+            print("最终返回的营养数据：", nutrition_data)
+            return nutrition_data, sorted(matched)
+        print("API响应格式不正确，返回空列表")
+        return [], []
+
+
+class AsyncHealthAnalysis(HealthAnalysis):
+    """
+    HealthAnalysis 的 asyncio 版本，配合 AsyncGLM45AirService 使用
+    """
+
+    @timed_stage('health')
+    async def analyze(self, dish_list, deadline=None):
+        try:
+            print("开始健康分析，菜品列表：", dish_list)
+
+            cache_key = self._stage_cache_key(dish_list)
+            cached = await self._acache_get(cache_key)
+            if cached is not None:
+                return dishes_from(cached)
+
+            known, misses = await asyncio.to_thread(self.lookup_known, dish_list)
+            miss_results = []
+            if misses:
+                batches = self._split_batches(misses)
+                # 用信号量限制同时进行的上游请求数
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+
+                async def analyze_batch(batch):
+                    try:
+                        async with semaphore:
+                            response = await self.glm45_air_service.analyze_health(batch, deadline)
+                    except DeadlineExceeded as e:
+                        return self._timed_out_batch(batch, deadline, e)
+                    print("API响应：", response)
+                    return await asyncio.to_thread(self._finish_batch, response, batch)
+
+                for batch_results in await asyncio.gather(*(analyze_batch(batch) for batch in batches)):
+                    miss_results.extend(batch_results)
+
+            nutrition_data = self._assemble(dish_list, known, miss_results)
+            if not is_degraded(deadline, 'nutrition'):
+                await self._acache_set(cache_key, nutrition_data)
+            return nutrition_data
+        except Exception as e:
+            print("健康分析出错：", str(e))
+            raise Exception(f"健康分析失败: {str(e)}")
+
+    @timed_stage('health')
+    async def analyze_stream(self, dishes, deadline=None):
+        """
+        analyze_stream 的 asyncio 版本，dishes 为异步迭代器
+        """
+        dish_list = []
+        builder = _BatchBuilder(Config.HEALTH_STREAM_BATCH_SIZE, self.batch_max_chars)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def analyze_batch(batch):
+            known, misses = await asyncio.to_thread(self.lookup_known, batch)
+            miss_results = []
+            if misses:
+                try:
+                    async with semaphore:
+                        response = await self.glm45_air_service.analyze_health(misses, deadline)
+                except DeadlineExceeded as e:
+                    miss_results = self._timed_out_batch(misses, deadline, e)
+                else:
+                    print("API响应：", response)
+                    miss_results = await asyncio.to_thread(self._finish_batch, response, misses)
+            return self._assemble(batch, known, miss_results)
+
+        tasks = []
+        try:
+            async for dish in dishes:
+                dish_list.append(dish)
+                for batch in builder.add(dish):
+                    tasks.append(asyncio.create_task(analyze_batch(batch)))
+            for batch in builder.flush():
+                tasks.append(asyncio.create_task(analyze_batch(batch)))
+
+            yield 'menu', dish_list
+
+            try:
+                nutrition_data = []
+                for batch_results in await asyncio.gather(*tasks):
+                    nutrition_data.extend(batch_results)
+            except Exception as e:
+                print("健康分析出错：", str(e))
+                raise Exception(f"健康分析失败: {str(e)}")
+        finally:
+            # 出错或调用方提前停止迭代时，取消仍在进行的批次（已完成的不受影响）
+            for task in tasks:
+                task.cancel()
+
+        print(f"流式健康分析完成，共 {len(dish_list)} 道菜，{len(tasks)} 个批次")
+        if not is_degraded(deadline, 'nutrition'):
+            await self._acache_set(self._stage_cache_key(dish_list), nutrition_data)
+        yield 'nutrition', nutrition_data
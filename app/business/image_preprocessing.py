@@ -0,0 +1,193 @@
+import io
+import math
+import base64
+import logging
+from config import Config
+from app.services.metrics import timed_stage
+
+# Pillow 不可用时退化为只做格式识别，原图直接上传
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# EXIF 方向标签
+_EXIF_ORIENTATION = 0x0112
+# 需要旋转 90/270 度（宽高互换）的 EXIF 方向值
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# 文件头魔数 -> MIME 类型
+_MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+# Pillow 格式名 -> MIME 类型
+_PIL_FORMATS = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp',
+    'WEBP': 'image/webp',
+}
+
+
+def sniff_mime_type(data):
+    """
+    根据文件头识别图片格式，无法识别时按 JPEG 处理
+    """
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+class PreprocessedImage:
+    """
+    预处理后的图片及处理前后的大小信息
+    """
+
+    def __init__(self, data, mime_type, original_bytes, width=None, height=None, tiles=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.processed_bytes = len(data)
+        self.width = width
+        self.height = height
+        # 超大或多栏菜单切分出的重叠分块（按从上到下、从左到右排列），不需要分块时为空列表
+        self.tiles = tiles or []
+
+    @property
+    def base64(self):
+        return base64.b64encode(self.data).decode('utf-8')
+
+    def info(self):
+        return {
+            'mimeType': self.mime_type,
+            'originalBytes': self.original_bytes,
+            'processedBytes': self.processed_bytes,
+            'width': self.width,
+            'height': self.height,
+            'tiles': len(self.tiles),
+        }
+
+
+class ImagePreprocessor:
+    """
+    上传图片的预处理：识别格式、按 EXIF 纠正方向、缩放到适合识别菜单文字的分辨率并重新编码
+    """
+
+    def __init__(self, max_side=None, quality=None, tiling=None):
+        self.max_side = max_side or Config.IMAGE_MAX_SIDE
+        self.quality = quality or Config.IMAGE_JPEG_QUALITY
+        self.tiling = Config.TILING_ENABLED if tiling is None else tiling
+
+    @timed_stage('preprocess')
+    def process(self, data):
+        original_bytes = len(data)
+        if Image is None or not Config.IMAGE_PREPROCESS_ENABLED:
+            return PreprocessedImage(data, sniff_mime_type(data), original_bytes)
+
+        try:
+            image = Image.open(io.BytesIO(data))
+            source_format = image.format
+            width, height = image.size
+
+            # 手机照片的方向通常只记录在 EXIF 中；分块网格按转正后的宽高计算（读取 EXIF 不会解码像素）
+            orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+            rotated = orientation != 1
+            upright_width, upright_height = (height, width) if orientation in _TRANSPOSED_ORIENTATIONS else (width, height)
+            grid = self._tile_grid(upright_width, upright_height)
+
+            resized = max(width, height) > self.max_side
+            if resized and grid == (1, 1) and source_format == 'JPEG':
+                # JPEG 可在解码时按 1/2、1/4、1/8 缩小，大幅降低解码耗时和内存（须在解码前设置；分块需要完整分辨率）
+                image.draft('RGB', (self.max_side, self.max_side))
+
+            # 只转正一次，分块和整图都使用转正后的图片
+            if rotated:
+                image = ImageOps.exif_transpose(image)
+
+            # 超大图片先在原始分辨率上切分重叠分块，再缩放整图
+            tiles = []
+            if grid != (1, 1):
+                tiles = self._make_tiles(image, grid, original_bytes)
+
+            if resized:
+                image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+            processed = self._encode_jpeg(image)
+            if not rotated and not resized and len(processed) >= original_bytes and source_format in _PIL_FORMATS:
+                # 重新编码没有带来收益时保留原图
+                return PreprocessedImage(data, _PIL_FORMATS[source_format], original_bytes, width, height)
+
+            result = PreprocessedImage(processed, 'image/jpeg', original_bytes, image.size[0], image.size[1], tiles)
+            logger.info(
+                f"Preprocessed {source_format} image {width}x{height} -> {image.size[0]}x{image.size[1]}, "
+                f"{original_bytes} -> {result.processed_bytes} bytes, {len(tiles)} tiles"
+            )
+            return result
+        except Exception as e:
+            # 预处理失败不影响主流程，原图直接上传
+            logger.warning(f"Image preprocessing failed, using original upload: {e}")
+            return PreprocessedImage(data, sniff_mime_type(data), original_bytes)
+
+    def _tile_grid(self, width, height):
+        """
+        计算分块的 (列数, 行数)，图片不够大或未开启分块时返回 (1, 1)
+        """
+        if not self.tiling or max(width, height) <= Config.TILE_TRIGGER_SIDE:
+            return 1, 1
+        tile_size = Config.TILE_SIZE
+        while True:
+            cols = max(1, math.ceil(width / tile_size))
+            rows = max(1, math.ceil(height / tile_size))
+            if cols * rows <= Config.TILE_MAX:
+                return cols, rows
+            # 分块数超过上限时放大单块尺寸
+            tile_size = int(tile_size * 1.25)
+
+    def _make_tiles(self, image, grid, original_bytes):
+        """
+        按网格切分带重叠的分块，每块单独缩放并编码为 JPEG
+        image 须为已按 EXIF 转正的完整分辨率图片
+        """
+        width, height = image.size
+        cols, rows = grid
+        tile_w = min(width, math.ceil(width / cols * (1 + Config.TILE_OVERLAP)))
+        tile_h = min(height, math.ceil(height / rows * (1 + Config.TILE_OVERLAP)))
+
+        tiles = []
+        for row in range(rows):
+            top = round((height - tile_h) * row / (rows - 1)) if rows > 1 else 0
+            for col in range(cols):
+                left = round((width - tile_w) * col / (cols - 1)) if cols > 1 else 0
+                tile = image.crop((left, top, left + tile_w, top + tile_h))
+                tile.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                tiles.append(PreprocessedImage(
+                    self._encode_jpeg(tile), 'image/jpeg', original_bytes, tile.size[0], tile.size[1]
+                ))
+        return tiles
+
+    def _encode_jpeg(self, image):
+        # JPEG 不支持透明通道，透明区域铺白底
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+        return buffer.getvalue()
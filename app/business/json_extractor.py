@@ -0,0 +1,253 @@
+import re
+import json
+
+# 大模型输出的公共 JSON 提取与解析：只扫描一次、只解析一次，常见的格式缺陷就地修复
+
+_decoder = json.JSONDecoder()
+
+# JSON 中不允许出现的控制字符（保留 \t \n \r）
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+
+# 对象或数组结尾前多余的逗号
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+# 未加引号且带货币符号/单位的价格，如 "price": ¥12、"价格": 12元
+_UNQUOTED_PRICE_RE = re.compile(
+    r'("(?:price|价格)"\s*:\s*)(?![\s"\d\-\[{]|null|true|false)[^\d,}\]\n]*(-?\d+(?:\.\d+)?)[^,}\]\n]*'
+)
+_SUFFIXED_PRICE_RE = re.compile(r'("(?:price|价格)"\s*:\s*)(-?\d+(?:\.\d+)?)[^\d\s,}\]\n"][^,}\]\n]*')
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def extract_json(content, expect=None):
+    """
+    从大模型输出中提取并解析 JSON，返回 Python 对象；无法得到有效 JSON 时返回 None
+
+    - 优先使用 ```json 代码块，其次是任意 ``` 代码块，最后是正文中第一个 { 或 [
+    - 解析失败时依次尝试修复：控制字符、多余逗号、未加引号的价格、被截断的数组/对象
+    - expect=list 时，若得到的是只包含一个列表字段的对象（如 {"dishes": [...]}），自动取出该列表
+    """
+    if not isinstance(content, str) or not content:
+        return None
+
+    start, end = _locate(content)
+    if start < 0:
+        return None
+    text = content[start:end]
+
+    data = _parse(text)
+    if data is None:
+        data = _parse(repair_json(text))
+    if data is None:
+        return None
+
+    if expect is list and isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+        if len(lists) == 1:
+            data = lists[0]
+    if expect is not None and not isinstance(data, expect):
+        return None
+    return data
+
+
+def _locate(content):
+    """
+    定位 JSON 文本的起止位置，只做字符串查找，不使用正则
+    """
+    fence = content.find('```json')
+    if fence >= 0:
+        body = fence + len('```json')
+    else:
+        fence = content.find('```')
+        body = fence + 3 if fence >= 0 else -1
+
+    if body >= 0:
+        close = content.find('```', body)
+        # 没有结束标记时通常是输出被截断，取到末尾
+        return body, close if close >= 0 else len(content)
+
+    # 没有代码块时从第一个 { 或 [ 开始
+    positions = [pos for pos in (content.find('{'), content.find('[')) if pos >= 0]
+    if not positions:
+        return -1, -1
+    return min(positions), len(content)
+
+
+def _parse(text):
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        # raw_decode 允许 JSON 之后还有多余的说明文字
+        data, _ = _decoder.raw_decode(text)
+        return data
+    except json.JSONDecodeError:
+        return None
+
+
+def repair_json(text):
+    """
+    修复大模型输出中常见的 JSON 缺陷
+    """
+    text = _CONTROL_CHARS_RE.sub('', text.strip())
+    # 从第一个 { 或 [ 开始，去掉前面的说明文字
+    positions = [pos for pos in (text.find('{'), text.find('[')) if pos >= 0]
+    if positions:
+        text = text[min(positions):]
+    text = _UNQUOTED_PRICE_RE.sub(r'\1\2', text)
+    text = _SUFFIXED_PRICE_RE.sub(r'\1\2', text)
+    text = _close_truncated(text)
+    text = _TRAILING_COMMA_RE.sub(r'\1', text)
+    return text
+
+
+def _close_truncated(text):
+    """
+    补全被截断的 JSON：回退到最后一个完整元素之后，再补上缺失的右括号
+    数组中被截断的对象/数组元素整个丢弃（只有部分字段的菜品比没有更糟）
+    """
+    # 尚未闭合的括号及其位置
+    stack = []
+    in_string = False
+    escaped = False
+    # 最近一个可以安全截断的位置，以及该位置处尚未闭合的括号
+    safe_end = 0
+    safe_stack = []
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append((char, i))
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            safe_end = i + 1
+            safe_stack = list(stack)
+            if not stack:
+                # 顶层值已完整，后面的内容全部丢弃
+                return text[:safe_end]
+        elif char == ',':
+            safe_end = i
+            safe_stack = list(stack)
+
+    if not stack and not in_string:
+        return text
+    # 最外层的数组中有未闭合的元素时，从该元素开始处截断
+    for depth in range(len(safe_stack) - 1):
+        if safe_stack[depth][0] == '[':
+            safe_end = safe_stack[depth + 1][1]
+            safe_stack = safe_stack[:depth + 1]
+            break
+    return text[:safe_end].rstrip().rstrip(',') + ''.join(_CLOSERS[c] for c, _ in reversed(safe_stack))
+
+
+class IncrementalDishParser:
+    """
+    流式输出的增量解析器：逐段喂入大模型输出，每当一道菜（数组中的对象）闭合就立即解析出来
+
+    适用于菜单识别的两种输出结构：{"分类": [菜品, ...], ...} 或 [菜品, ...]
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_key = None
+        self._category = None
+        self._item_start = None
+
+    def feed(self, chunk):
+        """
+        喂入一段新输出，返回其中闭合的菜品 [(分类, 菜品字典)]
+        """
+        if self._finished or not chunk:
+            return []
+        self._buffer.append(chunk)
+        text = ''.join(self._buffer)
+        self._buffer = [text]
+
+        items = []
+        i = self._pos
+        length = len(text)
+        while i < length:
+            char = text[i]
+            if not self._started:
+                # 跳过 ```json 等前导内容，直到第一个 { 或 [
+                if char in '{[':
+                    self._started = True
+                    self._stack.append(char)
+                i += 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._stack == ['{']:
+                        self._last_key = self._parse_key(text[self._string_start:i + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in '{[':
+                if char == '[' and self._stack == ['{']:
+                    self._category = self._last_key
+                if char == '{' and self._stack and self._stack[-1] == '[' and self._item_start is None:
+                    self._item_start = i
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if char == '}' and self._item_start is not None and self._stack and self._stack[-1] == '[':
+                    item = self._parse_item(text[self._item_start:i + 1])
+                    self._item_start = None
+                    if item is not None:
+                        items.append((self._category, item))
+                if not self._stack:
+                    self._finished = True
+                    break
+            i += 1
+
+        self._pos = i
+        # 当前正在输出的菜品之前的内容已经处理完，可以丢弃
+        keep_from = self._item_start if self._item_start is not None else i
+        if self._in_string and self._string_start is not None:
+            keep_from = min(keep_from, self._string_start)
+        self._buffer = [text[keep_from:]]
+        self._pos -= keep_from
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        if self._string_start is not None:
+            self._string_start -= keep_from
+        return items
+
+    @staticmethod
+    def _parse_key(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return text[1:-1]
+
+    @staticmethod
+    def _parse_item(text):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            item = extract_json(text, expect=dict)
+        return item if isinstance(item, dict) else None
@@ -1,59 +1,226 @@
-import re
-import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from app.services.stage_cache import StageCacheMixin
+from app.services.dish_store import DishNutritionStore
+from app.services.deadline import is_degraded, mark_degraded
+from app.business.json_extractor import extract_json, IncrementalDishParser
+from app.services.metrics import timed_stage, PARSE_FAILURES
 
-class MenuRecognition:
-    def __init__(self, glm41v_service):
+class MenuRecognition(StageCacheMixin):
+    def __init__(self, glm41v_service, cache=None):
         self.glm41v_service = glm41v_service
+        self.cache = cache
 
-    def recognize(self, image_base64):
+    @timed_stage('recognize')
+    def recognize(self, image_base64, mime_type='image/jpeg', deadline=None):
         try:
+            # 相同图片直接返回缓存的识别结果
+            cache_key = self._stage_cache_key(image_base64)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
             # 调用 GLM-4.1V API
-            response = self.glm41v_service.recognize_menu(image_base64)
-            
-            # 解析响应并返回菜单文本
-            # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
-            if 'choices' in response and len(response['choices']) > 0:
-                content = response['choices'][0].get('message', {}).get('content', '')
-                # 提取有效的JSON部分
-                return self._extract_valid_json(content)
-            return ''
+            response = self.glm41v_service.recognize_menu(image_base64, mime_type, deadline)
+            menu_data = self._parse_response(response)
+            self._cache_set(cache_key, menu_data)
+            return menu_data
+        except Exception as e:
+            raise Exception(f"菜单识别失败: {str(e)}")
+
+    @timed_stage('recognize')
+    def recognize_stream(self, image_base64, mime_type='image/jpeg', deadline=None):
+        """
+        流式识别菜单：模型每输出完一道菜就产出 (分类, 菜品)，识别完成后整份菜单写入阶段缓存
+        """
+        cache_key = self._stage_cache_key(image_base64)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            yield from self._iter_menu_items(cached)
+            return
+
+        parser = IncrementalDishParser()
+        menu_data = {}
+        try:
+            for delta in self.glm41v_service.recognize_menu_stream(image_base64, mime_type, deadline):
+                for category, item in parser.feed(delta):
+                    category = self._stream_category(category)
+                    menu_data.setdefault(category, []).append(item)
+                    yield category, item
+        except Exception as e:
+            raise Exception(f"菜单识别失败: {str(e)}")
+        self._cache_set(cache_key, menu_data)
+
+    @timed_stage('recognize')
+    def recognize_tiles(self, image_base64, tiles, deadline=None):
+        """
+        分块识别超大或多栏菜单：各分块并发识别，再合并去重为一份菜单数据
+        image_base64 为整图，仅用于缓存键
+        """
+        try:
+            cache_key = self._stage_cache_key(image_base64, stage='menu-tiled')
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            def recognize_tile(tile):
+                try:
+                    response = self.glm41v_service.recognize_menu(tile.base64, tile.mime_type, deadline)
+                    return self._parse_response(response)
+                except Exception as e:
+                    print("分块识别失败：", str(e))
+                    return None
+
+            with ThreadPoolExecutor(max_workers=len(tiles)) as executor:
+                tile_menus = list(executor.map(recognize_tile, tiles))
+
+            menu_data = self._merge_tiles_within(tile_menus, deadline)
+            if not is_degraded(deadline, 'menu'):
+                self._cache_set(cache_key, menu_data)
+            return menu_data
+        except Exception as e:
+            raise Exception(f"菜单识别失败: {str(e)}")
+
+    def _merge_tiles_within(self, tile_menus, deadline):
+        """
+        合并分块结果；超时时已识别的分块照常合并（不写缓存），全部分块都未完成才按超时处理
+        """
+        if deadline is not None and deadline.expired() and None in tile_menus:
+            if all(menu_data is None for menu_data in tile_menus):
+                deadline.check('recognize_menu')
+            print(f"菜单识别超时，合并已完成的 {len(tile_menus) - tile_menus.count(None)}/{len(tile_menus)} 个分块")
+            mark_degraded(deadline, 'menu')
+        return self._merge_tile_menus(tile_menus)
+
+    def _stage_cache_key(self, image_base64, stage='menu'):
+        # 缓存值为解析后的菜单数据（dict），阶段名与早先缓存菜单文本的 'recognize' 区分开
+        service = self.glm41v_service
+        return self._cache_key(stage, service.MODEL, service.PROMPT_VERSION, image_base64)
+
+    @staticmethod
+    def _stream_category(category):
+        # 模型直接输出菜品数组（没有分类）时统一归入一个默认分类
+        return category if category is not None else '菜品'
+
+    @staticmethod
+    def _iter_menu_items(menu_data):
+        if not isinstance(menu_data, dict):
+            return
+        for category, items in menu_data.items():
+            if isinstance(items, list):
+                for item in items:
+                    if isinstance(item, dict):
+                        yield category, item
+
+    def _merge_tile_menus(self, tile_menus):
+        """
+        合并各分块的分类/菜品数据，按归一化菜名去掉重叠区域中重复识别的菜品
+        """
+        if all(menu_data is None for menu_data in tile_menus):
+            raise Exception("所有分块识别均失败")
+
+        merged = {}
+        seen = {}
+        for menu_data in tile_menus:
+            if not isinstance(menu_data, dict):
+                continue
+            for category, items in menu_data.items():
+                if not isinstance(items, list):
+                    continue
+                for item in items:
+                    if not isinstance(item, dict) or not item.get('name'):
+                        continue
+                    key = DishNutritionStore.normalize(item['name'])
+                    if key in seen:
+                        # 重复的菜品只补全缺失的字段（如被切断一半的价格）
+                        existing = seen[key]
+                        for field, value in item.items():
+                            if not existing.get(field) and value:
+                                existing[field] = value
+                        continue
+                    dish = dict(item)
+                    seen[key] = dish
+                    merged.setdefault(category, []).append(dish)
+
+        print(f"分块识别合并后共 {len(seen)} 道菜")
+        return merged or None
+
+    def _parse_response(self, response):
+        """
+        解析响应并返回菜单数据（分类 -> 菜品列表），没有有效JSON时返回 None
+        """
+        # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0].get('message', {}).get('content', '')
+            menu_data = extract_json(content)
+            if menu_data is None:
+                print("菜单识别结果中未找到有效的JSON")
+                PARSE_FAILURES.inc(stage='recognize')
+            return menu_data
+        return None
+
+
+class AsyncMenuRecognition(MenuRecognition):
+    """
+    MenuRecognition 的 asyncio 版本，配合 AsyncGLM41VService 使用
+    """
+
+    @timed_stage('recognize')
+    async def recognize(self, image_base64, mime_type='image/jpeg', deadline=None):
+        try:
+            cache_key = self._stage_cache_key(image_base64)
+            cached = await self._acache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            response = await self.glm41v_service.recognize_menu(image_base64, mime_type, deadline)
+            menu_data = self._parse_response(response)
+            await self._acache_set(cache_key, menu_data)
+            return menu_data
+        except Exception as e:
+            raise Exception(f"菜单识别失败: {str(e)}")
+
+    @timed_stage('recognize')
+    async def recognize_stream(self, image_base64, mime_type='image/jpeg', deadline=None):
+        cache_key = self._stage_cache_key(image_base64)
+        cached = await self._acache_get(cache_key)
+        if cached is not None:
+            for category, item in self._iter_menu_items(cached):
+                yield category, item
+            return
+
+        parser = IncrementalDishParser()
+        menu_data = {}
+        try:
+            async for delta in self.glm41v_service.recognize_menu_stream(image_base64, mime_type, deadline):
+                for category, item in parser.feed(delta):
+                    category = self._stream_category(category)
+                    menu_data.setdefault(category, []).append(item)
+                    yield category, item
         except Exception as e:
             raise Exception(f"菜单识别失败: {str(e)}")
-    
-    def _extract_valid_json(self, content):
-        """
-        从内容中提取有效的JSON部分
-        """
-        # 查找被```json和```包围的JSON代码块
-        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content, re.DOTALL)
-        if json_match:
-            json_content = json_match.group(1)
-            # 验证是否为有效的JSON
-            try:
-                # 尝试解析JSON以确保其有效性
-                json.loads(json_content)
-                # 如果解析成功，直接返回JSON内容
-                return json_content
-            except json.JSONDecodeError:
-                # 如果解析失败，尝试清理JSON内容中的异常字符
-                cleaned_json = self._clean_json_content(json_content)
+        await self._acache_set(cache_key, menu_data)
+
+    @timed_stage('recognize')
+    async def recognize_tiles(self, image_base64, tiles, deadline=None):
+        try:
+            cache_key = self._stage_cache_key(image_base64, stage='menu-tiled')
+            cached = await self._acache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            async def recognize_tile(tile):
                 try:
-                    json.loads(cleaned_json)
-                    return cleaned_json
-                except json.JSONDecodeError:
-                    # 如果仍然解析失败，返回原始内容让后续处理逻辑处理错误
-                    pass
-        
-        # 如果没有找到有效的JSON代码块，返回原始内容
-        return content
-
-    def _clean_json_content(self, json_content):
-        """
-        清理JSON内容中的异常字符
-        """
-        # 移除可能导致解析错误的异常字符
-        # 移除末尾的多余字符
-        cleaned = json_content.strip()
-        # 移除可能导致问题的特殊字符
-        cleaned = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', cleaned)
-        return cleaned
\ No newline at end of file
+                    response = await self.glm41v_service.recognize_menu(tile.base64, tile.mime_type, deadline)
+                    return self._parse_response(response)
+                except Exception as e:
+                    print("分块识别失败：", str(e))
+                    return None
+
+            tile_menus = await asyncio.gather(*(recognize_tile(tile) for tile in tiles))
+            menu_data = self._merge_tiles_within(tile_menus, deadline)
+            if not is_degraded(deadline, 'menu'):
+                await self._acache_set(cache_key, menu_data)
+            return menu_data
+        except Exception as e:
+            raise Exception(f"菜单识别失败: {str(e)}")
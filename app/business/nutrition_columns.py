@@ -0,0 +1,46 @@
+import re
+import math
+import numpy as np
+
+# 营养字段的列顺序
+NUTRITION_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+
+# 每克宏量营养素提供的热量（kcal）
+MACRO_KCAL_PER_GRAM = np.array([4.0, 4.0, 9.0])
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def to_number(value):
+    """
+    将大模型输出的营养数值转换为 float，无法识别或不是有限数值时返回 NaN
+    兼容 "350"、"350kcal"、"约12.5g" 这类带单位的写法
+    """
+    if isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)):
+        return _finite(value)
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            return _finite(match.group(0))
+    return np.nan
+
+
+def _finite(value):
+    # json 会把 Infinity、1e999 解析为 inf，超大整数转为 float 时溢出
+    try:
+        value = float(value)
+    except OverflowError:
+        return np.nan
+    return value if math.isfinite(value) else np.nan
+
+
+def pack_columns(dishes, fields=NUTRITION_FIELDS):
+    """
+    将菜品（Dish）列表打包为 (菜品数, 字段数) 的 float64 矩阵，缺失值为 NaN
+    Dish 的数值字段已是 float 或 None，无需逐个转换
+    """
+    rows = [[getattr(dish, field) for field in fields] for dish in dishes]
+    # dtype=float 时 None 会被转换为 NaN
+    return np.array(rows, dtype=float).reshape(len(dishes), len(fields))
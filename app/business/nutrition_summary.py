@@ -1,33 +1,149 @@
+import numpy as np
+from config import Config
 from app.services.glm45_air_service import GLM45AirService
+from app.services.stage_cache import StageCacheMixin
+from app.business.nutrition_columns import NUTRITION_FIELDS, MACRO_KCAL_PER_GRAM, pack_columns
+from app.business.json_extractor import extract_json
+from app.services.deadline import DeadlineExceeded, mark_degraded
+from app.services.metrics import timed_stage, PARSE_FAILURES
 
-class NutritionSummary:
-    def __init__(self, glm45_air_service):
+class NutritionSummary(StageCacheMixin):
+    def __init__(self, glm45_air_service, cache=None, mode=None, llm_fallback=None):
         self.glm45_air_service = glm45_air_service
+        self.cache = cache
+        # local: 本地聚合计算；llm: 始终交给大模型
+        self.mode = mode or Config.NUTRITION_SUMMARY_MODE
+        # 本地模式下菜品缺少营养字段时，是否退回大模型
+        self.llm_fallback = Config.NUTRITION_SUMMARY_LLM_FALLBACK if llm_fallback is None else llm_fallback
 
-    def generate(self, recommended_dishes):
+    @timed_stage('summary')
+    def generate(self, recommended_dishes, deadline=None):
         """
         生成营养总结报告
         """
         try:
+            summary_data = self._local_summary(recommended_dishes)
+            if summary_data is not None:
+                return summary_data
+
+            cache_key = self._stage_cache_key(recommended_dishes)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
             # 调用 GLM-4.5-Air API 生成营养总结
-            response = self.glm45_air_service.generate_nutrition_summary(recommended_dishes)
-            
-            # 解析响应并返回营养总结
-            # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
-            if 'choices' in response and len(response['choices']) > 0:
-                content = response['choices'][0].get('message', {}).get('content', '')
-                
-                # 提取JSON部分
-                import re
-                import json
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content, re.DOTALL)
-                if json_match:
-                    json_content = json_match.group(1)
-                    summary_data = json.loads(json_content)
-                    return summary_data
-                else:
-                    # 如果没有JSON格式，返回空对象
-                    return {}
-            return {}
+            try:
+                response = self.glm45_air_service.generate_nutrition_summary(recommended_dishes, deadline)
+            except DeadlineExceeded as e:
+                print("营养总结超时，使用本地聚合：", str(e))
+                mark_degraded(deadline, 'summary')
+                return self._fallback_summary(recommended_dishes)
+            summary_data = self._parse_response(response)
+            self._cache_set(cache_key, summary_data)
+            return summary_data
+        except Exception as e:
+            raise Exception(f"生成营养总结失败: {str(e)}")
+
+    def _stage_cache_key(self, recommended_dishes):
+        service = self.glm45_air_service
+        return self._cache_key('summary', service.MODEL, service.SUMMARY_PROMPT_VERSION, recommended_dishes)
+
+    def _local_summary(self, recommended_dishes):
+        """
+        本地聚合计算营养总结，需要交给大模型处理时返回 None
+        """
+        if self.mode != 'local':
+            return None
+
+        matrix = pack_columns(recommended_dishes)
+        if self.llm_fallback and np.isnan(matrix).any():
+            print("推荐菜品缺少营养字段，使用大模型生成营养总结")
+            return None
+        return summarize_matrix(matrix, [dish.name for dish in recommended_dishes])
+
+    @staticmethod
+    def _fallback_summary(recommended_dishes):
+        """
+        时限内拿不到大模型总结时的本地聚合（缺失的营养字段按 0 计，不写缓存）
+        """
+        return summarize_matrix(pack_columns(recommended_dishes), [dish.name for dish in recommended_dishes])
+
+    def _parse_response(self, response):
+        """
+        解析响应并返回营养总结
+        """
+        # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0].get('message', {}).get('content', '')
+
+            # 提取并解析JSON部分，没有有效JSON时返回空对象
+            summary_data = extract_json(content, expect=dict)
+            if summary_data is None:
+                PARSE_FAILURES.inc(stage='summary')
+                return {}
+            return summary_data
+        return {}
+
+
+def summarize_matrix(matrix, names):
+    """
+    对 (菜品数, 4) 的营养矩阵做一次向量化聚合
+    返回总量、每道菜占比和宏量营养素供能比
+    """
+    matrix = np.nan_to_num(matrix, nan=0.0)
+    totals = matrix.sum(axis=0)
+
+    # 每道菜在各项营养中的占比（总量为 0 的列占比记为 0）
+    safe_totals = np.where(totals > 0, totals, 1.0)
+    shares = np.where(totals > 0, matrix / safe_totals, 0.0)
+
+    # 宏量营养素供能比：蛋白质/碳水 4 kcal/g，脂肪 9 kcal/g
+    macro_kcal = totals[1:] * MACRO_KCAL_PER_GRAM
+    macro_total = macro_kcal.sum()
+    macro_ratios = macro_kcal / macro_total if macro_total > 0 else np.zeros(3)
+
+    summary = {
+        'totalCalories': round(float(totals[0]), 1),
+        'totalProtein': round(float(totals[1]), 1),
+        'totalCarbs': round(float(totals[2]), 1),
+        'totalFat': round(float(totals[3]), 1),
+        'macroRatios': {
+            field: round(float(ratio), 4) for field, ratio in zip(NUTRITION_FIELDS[1:], macro_ratios)
+        },
+        'dishShares': [
+            {'name': name, **{field: round(float(share), 4) for field, share in zip(NUTRITION_FIELDS, row)}}
+            for name, row in zip(names, shares)
+        ],
+        'source': 'local',
+    }
+    return summary
+
+
+class AsyncNutritionSummary(NutritionSummary):
+    """
+    NutritionSummary 的 asyncio 版本，配合 AsyncGLM45AirService 使用
+    """
+
+    @timed_stage('summary')
+    async def generate(self, recommended_dishes, deadline=None):
+        try:
+            summary_data = self._local_summary(recommended_dishes)
+            if summary_data is not None:
+                return summary_data
+
+            cache_key = self._stage_cache_key(recommended_dishes)
+            cached = await self._acache_get(cache_key)
+            if cached is not None:
+                return cached
+
+            try:
+                response = await self.glm45_air_service.generate_nutrition_summary(recommended_dishes, deadline)
+            except DeadlineExceeded as e:
+                print("营养总结超时，使用本地聚合：", str(e))
+                mark_degraded(deadline, 'summary')
+                return self._fallback_summary(recommended_dishes)
+            summary_data = self._parse_response(response)
+            await self._acache_set(cache_key, summary_data)
+            return summary_data
         except Exception as e:
-            raise Exception(f"生成营养总结失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"生成营养总结失败: {str(e)}")
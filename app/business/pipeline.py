@@ -0,0 +1,292 @@
+import json
+import math
+import traceback
+from config import Config
+from app.business.json_extractor import extract_json
+from app.business.nutrition_columns import to_number
+from app.business.dish import Dish
+from app.services.rate_limiter import find_overload_error
+from app.services.deadline import find_deadline_error, mark_degraded, stage_status
+
+# 菜单处理流程的阶段编排：同步路由（Flask）、异步路由（Starlette）和批量任务共用，
+# 路由文件中只保留读取请求、序列化响应等与传输方式有关的部分
+
+
+class MenuPipeline:
+    """
+    逐阶段执行菜单处理流程：菜单识别 -> 健康分析 -> 菜品推荐 -> 营养总结 -> 计算总价
+    """
+
+    def __init__(self, menu_recognition, health_analysis, recommendation_engine, nutrition_summary,
+                 fused_analysis, cost_calculator):
+        self.menu_recognition = menu_recognition
+        self.health_analysis = health_analysis
+        self.recommendation_engine = recommendation_engine
+        self.nutrition_summary = nutrition_summary
+        self.fused_analysis = fused_analysis
+        self.cost_calculator = cost_calculator
+
+    def _streams_menu(self, image):
+        # 合并分析需要完整的菜品列表，不与流式识别重叠
+        return Config.MENU_STREAM_ENABLED and not image.tiles and not self.fused_analysis.applies_to()
+
+    def run(self, image, deadline=None):
+        """
+        逐阶段执行，每完成一个阶段产出 (阶段名, 该阶段的结果字段)，image 为预处理后的 PreprocessedImage
+        deadline 为整个请求的时间预算：超时的阶段返回部分结果或本地兜底结果，在 stageStatus 中标为 partial
+        """
+        fused = None
+        if self._streams_menu(image):
+            # 1-3. 流式识别菜单，已识别出的菜品边识别边送去健康分析
+            menu_data = {}
+
+            def dish_stream():
+                recognized = 0
+                try:
+                    for category, item in self.menu_recognition.recognize_stream(
+                        image.base64, image.mime_type, deadline
+                    ):
+                        dish = _add_menu_item(menu_data, category, item)
+                        if dish is not None:
+                            recognized += 1
+                            yield dish
+                except Exception as e:
+                    _recognition_interrupted(e, recognized, deadline)
+
+            # 菜单识别完成就产出 menu 阶段，不等待仍在进行的健康分析
+            for stage, dishes in self.health_analysis.analyze_stream(dish_stream(), deadline):
+                if stage == 'menu':
+                    print("菜单识别结果：", menu_data)
+                    yield 'menu', _menu_fields(menu_data, dishes, image)
+                else:
+                    dish_list_with_nutrition = dishes
+        else:
+            # 1. 菜单识别（超大或多栏菜单按分块并发识别）
+            if image.tiles:
+                menu_data = self.menu_recognition.recognize_tiles(image.base64, image.tiles, deadline)
+            else:
+                menu_data = self.menu_recognition.recognize(image.base64, image.mime_type, deadline)
+            print("菜单识别结果：", menu_data)
+
+            # 2. 解析菜单数据为菜品列表
+            dish_list = parse_menu_text(menu_data)
+            print("解析后的菜品列表：", dish_list)
+            yield 'menu', _menu_fields(menu_data, dish_list, image)
+
+            if self.fused_analysis.applies_to(len(dish_list)):
+                # 3-5. 合并分析：一次调用得到营养信息、推荐菜品和营养总结
+                fused = self.fused_analysis.analyze(dish_list, deadline)
+                dish_list_with_nutrition = fused[0]
+            else:
+                # 3. 健康分析（分析菜品营养成分）
+                dish_list_with_nutrition = self.health_analysis.analyze(dish_list, deadline)
+        print("健康分析结果：", dish_list_with_nutrition)
+        yield 'nutrition', {'dishList': dish_list_with_nutrition}
+
+        # 4. 菜品推荐（根据健康程度推荐菜品）
+        if fused is None:
+            recommended_dishes = self.recommendation_engine.recommend(dish_list_with_nutrition, deadline)
+        else:
+            recommended_dishes = fused[1]
+        print("推荐菜品结果：", recommended_dishes)
+        yield 'recommendations', {'recommendedDishes': recommended_dishes}
+
+        # 5. 生成营养总结
+        if fused is None:
+            nutrition_summary_data = self.nutrition_summary.generate(recommended_dishes, deadline)
+        else:
+            nutrition_summary_data = fused[2]
+        print("营养总结结果：", nutrition_summary_data)
+        yield 'summary', self._summary_fields(nutrition_summary_data, recommended_dishes, deadline)
+
+    def collect(self, image, deadline=None):
+        """
+        依次执行各阶段并合并结果，后面阶段的字段覆盖前面的（如带营养信息的dishList）
+        """
+        result = {}
+        for stage, data in self.run(image, deadline):
+            result.update(data)
+        return result
+
+    def _summary_fields(self, nutrition_summary_data, recommended_dishes, deadline):
+        # 6. 计算总价
+        total_cost = self.cost_calculator.calculate(recommended_dishes)
+        print("总价计算结果：", total_cost)
+        status = stage_status(deadline)
+        return {
+            'nutritionSummary': nutrition_summary_data,
+            'totalCost': total_cost,
+            'stageStatus': status,
+            'partial': any(value != 'ok' for value in status.values()),
+        }
+
+
+class AsyncMenuPipeline(MenuPipeline):
+    """
+    MenuPipeline 的 asyncio 版本，各阶段使用 Async* 业务类
+    """
+
+    async def run(self, image, deadline=None):
+        fused = None
+        if self._streams_menu(image):
+            menu_data = {}
+
+            async def dish_stream():
+                recognized = 0
+                try:
+                    async for category, item in self.menu_recognition.recognize_stream(
+                        image.base64, image.mime_type, deadline
+                    ):
+                        dish = _add_menu_item(menu_data, category, item)
+                        if dish is not None:
+                            recognized += 1
+                            yield dish
+                except Exception as e:
+                    _recognition_interrupted(e, recognized, deadline)
+
+            async for stage, dishes in self.health_analysis.analyze_stream(dish_stream(), deadline):
+                if stage == 'menu':
+                    print("菜单识别结果：", menu_data)
+                    yield 'menu', _menu_fields(menu_data, dishes, image)
+                else:
+                    dish_list_with_nutrition = dishes
+        else:
+            if image.tiles:
+                menu_data = await self.menu_recognition.recognize_tiles(image.base64, image.tiles, deadline)
+            else:
+                menu_data = await self.menu_recognition.recognize(image.base64, image.mime_type, deadline)
+            print("菜单识别结果：", menu_data)
+
+            dish_list = parse_menu_text(menu_data)
+            print("解析后的菜品列表：", dish_list)
+            yield 'menu', _menu_fields(menu_data, dish_list, image)
+
+            if self.fused_analysis.applies_to(len(dish_list)):
+                fused = await self.fused_analysis.analyze(dish_list, deadline)
+                dish_list_with_nutrition = fused[0]
+            else:
+                dish_list_with_nutrition = await self.health_analysis.analyze(dish_list, deadline)
+        print("健康分析结果：", dish_list_with_nutrition)
+        yield 'nutrition', {'dishList': dish_list_with_nutrition}
+
+        if fused is None:
+            recommended_dishes = await self.recommendation_engine.recommend(dish_list_with_nutrition, deadline)
+        else:
+            recommended_dishes = fused[1]
+        print("推荐菜品结果：", recommended_dishes)
+        yield 'recommendations', {'recommendedDishes': recommended_dishes}
+
+        if fused is None:
+            nutrition_summary_data = await self.nutrition_summary.generate(recommended_dishes, deadline)
+        else:
+            nutrition_summary_data = fused[2]
+        print("营养总结结果：", nutrition_summary_data)
+        yield 'summary', self._summary_fields(nutrition_summary_data, recommended_dishes, deadline)
+
+    async def collect(self, image, deadline=None):
+        result = {}
+        async for stage, data in self.run(image, deadline):
+            result.update(data)
+        return result
+
+
+def _add_menu_item(menu_data, category, item):
+    # 流式识别出的条目按分类记录下来（用于 menuText），有效条目转为菜品
+    menu_data.setdefault(category, []).append(item)
+    return parse_menu_item(item)
+
+
+def _recognition_interrupted(error, recognized, deadline):
+    # 识别到一半超时：已识别出的菜品照常分析；一道菜都没有识别出来时按超时失败
+    if not recognized or find_deadline_error(error) is None:
+        raise error
+    print(f"菜单识别超时，使用已识别出的 {recognized} 道菜")
+    mark_degraded(deadline, 'menu')
+
+
+def _menu_fields(menu_data, dish_list, image):
+    return {'menuText': menu_text_of(menu_data), 'dishList': dish_list, 'imageInfo': image.info()}
+
+
+def deadline_response(timeout):
+    """
+    菜单识别在时限内没有任何结果：返回 504 和各阶段状态
+    """
+    print("处理菜单超时：", str(timeout))
+    return {'error': str(timeout), 'stageStatus': {'menu': 'timeout'}}
+
+
+def error_response(e):
+    """
+    将处理流程中的异常转换为 (状态码, 响应体, 响应头)：上游繁忙 503，超时 504，其余 500
+    """
+    overload = find_overload_error(e)
+    if overload is not None:
+        # 上游配额已满：快速返回 503，而不是让请求排队或重试到超时
+        print("上游繁忙，拒绝请求：", str(overload))
+        return 503, {'error': str(overload)}, {'Retry-After': str(overload.retry_after)}
+    timeout = find_deadline_error(e)
+    if timeout is not None:
+        return 504, deadline_response(timeout), {}
+    print("处理菜单时出错：", str(e))
+    traceback.print_exc()
+    return 500, {'error': str(e)}, {}
+
+
+def menu_text_of(menu_data):
+    """
+    响应中的 menuText 仍为菜单JSON文本，保持接口兼容
+    """
+    if not menu_data:
+        return ''
+    return json.dumps(menu_data, ensure_ascii=False)
+
+
+def parse_menu_item(item):
+    """
+    将菜单中的一个菜品条目整理为 Dish(name, description, price)，无效条目返回 None
+    """
+    if not isinstance(item, dict):
+        return None
+    name = str(item.get('name', '') or '')
+    # 只有当名称不为空时才添加
+    if not name:
+        return None
+
+    # 查找价格键，兼容 "¥12"、"12元" 这类带单位的价格
+    price = 0
+    for k in ['price', '价格']:
+        if k in item:
+            value_number = to_number(item[k])
+            if not math.isnan(value_number):
+                price = value_number
+            break
+
+    return Dish(name, str(item.get('description', '') or ''), price)
+
+
+def parse_menu_text(menu_data):
+    """
+    解析菜单数据为菜品列表
+    menu_data 为识别阶段解析好的菜单数据（分类 -> 菜品列表），也兼容大模型返回的原始文本
+    """
+    if isinstance(menu_data, str):
+        menu_data = extract_json(menu_data)
+
+    if not isinstance(menu_data, dict):
+        print("菜单数据不是字典格式，返回空的菜品列表")
+        return []
+
+    # 遍历所有分类，提取菜品信息
+    dishes = []
+    for key, value in menu_data.items():
+        if not isinstance(value, list):
+            continue
+        print(f"处理分类: {key}，包含 {len(value)} 个项目")
+        for item in value:
+            dish = parse_menu_item(item)
+            if dish is not None:
+                dishes.append(dish)
+
+    print(f"总共解析到 {len(dishes)} 道菜")
+    return dishes
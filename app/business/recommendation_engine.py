@@ -1,51 +1,77 @@
-import math
-import json
-import re
+import numpy as np
+from config import Config
+from app.services.stage_cache import StageCacheMixin
+from app.business.nutrition_columns import pack_columns
+from app.business.json_extractor import extract_json
+from app.business.dish import Dish, dishes_from
+from app.services.prompt_compiler import compile_dish_table, parse_dish_id
+from app.services.deadline import DeadlineExceeded, mark_degraded
+from app.services.metrics import timed_stage, PARSE_FAILURES
 
-class RecommendationEngine:
-    def __init__(self, glm45_air_service):
+# 评分所需的列：卡路里、蛋白质、脂肪、价格
+SCORE_FIELDS = ('calories', 'protein', 'fat', 'price')
+
+class RecommendationEngine(StageCacheMixin):
+    def __init__(self, glm45_air_service, cache=None, mode=None, top_n=None, weights=None, llm_reasons=None):
         self.glm45_air_service = glm45_air_service
+        self.cache = cache
+        # local: 本地评分排序；llm: 由大模型排序
+        self.mode = mode or Config.RECOMMENDATION_MODE
+        self.top_n = top_n or Config.RECOMMENDATION_TOP_N
+        # 健康评分权重（低卡路里、低脂肪、高蛋白）
+        self.weights = weights or {
+            'calories': Config.RECOMMENDATION_WEIGHT_CALORIES,
+            'fat': Config.RECOMMENDATION_WEIGHT_FAT,
+            'protein': Config.RECOMMENDATION_WEIGHT_PROTEIN,
+        }
+        # 本地排序后是否调用大模型为推荐菜品生成推荐理由
+        self.llm_reasons = Config.RECOMMENDATION_LLM_REASONS if llm_reasons is None else llm_reasons
 
-    def recommend(self, dish_list_with_nutrition):
+    @timed_stage('recommend')
+    def recommend(self, dish_list_with_nutrition, deadline=None):
         """
         根据菜品营养信息推荐健康菜品
         """
         try:
             print("开始菜品推荐，菜品列表：", dish_list_with_nutrition)
-            
+
             # 检查菜品列表是否包含营养信息
             has_nutrition_info = self._has_nutrition_info(dish_list_with_nutrition)
             print("菜品列表是否包含营养信息：", has_nutrition_info)
-            
-            if has_nutrition_info:
-                # 如果包含营养信息，则调用 GLM-4.5-Air API 进行菜品推荐
-                response = self.glm45_air_service.recommend_dishes(dish_list_with_nutrition)
-                print("API响应：", response)
-                
-                # 解析响应并返回推荐菜品
-                # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
-                if 'choices' in response and len(response['choices']) > 0:
-                    content = response['choices'][0].get('message', {}).get('content', '')
-                    print("API返回内容：", content)
-                    
-                    # 提取JSON部分
-                    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content, re.DOTALL)
-                    if json_match:
-                        json_content = json_match.group(1)
-                        print("提取到的JSON内容：", json_content)
-                        recommended_dishes = json.loads(json_content)
-                        print("解析后的推荐菜品：", recommended_dishes)
-                        
-                        # 对推荐菜品进行后续计算处理
-                        processed_dishes = self._process_recommendations(recommended_dishes)
-                        print("处理后的推荐菜品：", processed_dishes)
-                        
-                        return processed_dishes
+
+            if has_nutrition_info and self.mode == 'local':
+                # 本地一次性计算所有菜品的评分并取前N名
+                recommended_dishes = self._rank(dish_list_with_nutrition)
+                if self.llm_reasons:
+                    try:
+                        response = self.glm45_air_service.explain_recommendations(recommended_dishes, deadline)
+                    except DeadlineExceeded as e:
+                        # 推荐理由只是锦上添花，时限内来不及生成就只返回本地排序
+                        print("推荐理由超时，忽略：", str(e))
+                        mark_degraded(deadline, 'recommendations')
                     else:
-                        print("未找到JSON格式数据，返回空列表")
-                        return []
-                print("API响应格式不正确，返回空列表")
-                return []
+                        self._attach_reasons(recommended_dishes, response)
+                return recommended_dishes
+            elif has_nutrition_info:
+                cache_key = self._stage_cache_key(dish_list_with_nutrition)
+                cached = self._cache_get(cache_key)
+                if cached is not None:
+                    return dishes_from(cached)
+
+                # 如果包含营养信息，则调用 GLM-4.5-Air API 进行菜品推荐（编号对应候选列表中的下标）
+                candidates = self._candidates(dish_list_with_nutrition)
+                try:
+                    response = self.glm45_air_service.recommend_dishes(candidates, deadline)
+                except DeadlineExceeded as e:
+                    # 时限内拿不到大模型推荐时退回本地评分排序（不写缓存）
+                    print("大模型推荐超时，使用本地排序：", str(e))
+                    mark_degraded(deadline, 'recommendations')
+                    return self._rank(dish_list_with_nutrition)
+                print("API响应：", response)
+
+                processed_dishes = self._parse_response(response, candidates)
+                self._cache_set(cache_key, processed_dishes)
+                return processed_dishes
             else:
                 # 如果不包含营养信息，则直接返回原始菜品列表（不进行推荐）
                 # 这种情况下，我们假设所有菜品都是可选的
@@ -56,75 +82,227 @@ class RecommendationEngine:
             print("菜品推荐出错：", str(e))
             raise Exception(f"菜品推荐失败: {str(e)}")
 
+    def _stage_cache_key(self, dish_list_with_nutrition):
+        service = self.glm45_air_service
+        return self._cache_key('recommend', service.MODEL, service.RECOMMEND_PROMPT_VERSION, dish_list_with_nutrition)
+
+    def _parse_response(self, response, dish_list):
+        """
+        解析响应并返回推荐菜品
+        大模型只返回菜品编号和评分，完整记录从 dish_list 还原
+        """
+        # GLM API响应格式: {'choices': [{'message': {'content': '...'}}]}
+        if 'choices' in response and len(response['choices']) > 0:
+            content = response['choices'][0].get('message', {}).get('content', '')
+            print("API返回内容：", content)
+
+            # 提取并解析JSON部分
+            recommended_items = extract_json(content, expect=list)
+            if recommended_items is not None:
+                print("解析后的推荐菜品：", recommended_items)
+
+                # 对推荐菜品进行后续计算处理（还原出的菜品已是副本，无需再复制）
+                processed_dishes = self._attach_scores(self._rehydrate(recommended_items, dish_list))
+                print("处理后的推荐菜品：", processed_dishes)
+
+                return processed_dishes
+            else:
+                print("未找到JSON格式数据，返回空列表")
+                PARSE_FAILURES.inc(stage='recommend')
+                return []
+        print("API响应格式不正确，返回空列表")
+        return []
+
+    def from_ranking(self, items, dish_list):
+        """
+        使用合并分析返回的推荐编号；没有有效编号时退回本地评分排序
+        """
+        dishes = self._rehydrate(items, dish_list) if isinstance(items, list) else []
+        if not dishes:
+            print("合并分析未返回有效推荐，使用本地评分排序")
+            PARSE_FAILURES.inc(stage='recommend')
+            return self._rank(dish_list)
+        return self._attach_scores(dishes)
+
+    def _rehydrate(self, items, dish_list):
+        """
+        按大模型给出的顺序把编号还原为菜品副本；无效或重复的编号忽略
+        兼容旧格式：带 name 的完整记录直接创建菜品
+        """
+        dishes = []
+        seen = set()
+        for item in items:
+            value = item.get('id') if isinstance(item, dict) else item
+            index = parse_dish_id(value, len(dish_list))
+            if index is not None:
+                if index not in seen:
+                    seen.add(index)
+                    dishes.append(dish_list[index].copy())
+            elif isinstance(item, dict) and item.get('name'):
+                dishes.append(Dish.from_dict(item))
+            else:
+                print("忽略无效的推荐编号：", value)
+        return dishes
+
     def _has_nutrition_info(self, dish_list):
         """
         检查菜品列表是否包含营养信息
         """
-        if not isinstance(dish_list, list) or len(dish_list) == 0:
+        if not dish_list:
             return False
-            
+
         # 检查第一个菜品是否包含营养信息字段
-        first_dish = dish_list[0]
-        if isinstance(first_dish, dict):
-            nutrition_fields = ['calories', 'protein', 'carbs', 'fat']
-            return any(field in first_dish for field in nutrition_fields)
-        
-        return False
+        return dish_list[0].has_nutrition()
+
+    def _score(self, dishes):
+        """
+        向量化计算所有菜品的蛋白质密度、蛋白质性价比和健康评分
+        返回三个长度为菜品数的数组
+        """
+        columns = np.nan_to_num(pack_columns(dishes, SCORE_FIELDS), nan=0.0)
+        calories, protein, fat, price = columns.T
+
+        has_calories = calories > 0
+        has_price = price > 0
+        safe_calories = np.where(has_calories, calories, 1.0)
+        safe_price = np.where(has_price, price, 1.0)
+
+        # 计算营养密度（蛋白质/卡路里比率）
+        protein_density = np.where(has_calories, np.ceil(protein / safe_calories * 1000) / 1000, 0.0)
+
+        # 计算性价比（蛋白质/价格比率）
+        protein_value = np.where(has_price, np.ceil(protein / safe_price * 100) / 100, 0.0)
+
+        # 计算健康评分（综合考虑卡路里、脂肪和蛋白质）
+        calorie_score = np.ceil((1 - np.minimum(calories / 1000, 1)) * 100) / 100
+        fat_score = np.ceil((1 - np.minimum(fat / 50, 1)) * 100) / 100
+        protein_score = np.ceil(np.minimum(protein / 50, 1) * 100) / 100
+        weighted = (calorie_score * self.weights['calories']
+                    + fat_score * self.weights['fat']
+                    + protein_score * self.weights['protein'])
+        health_score = np.where(has_calories, np.ceil(weighted * 100) / 100, 0.0)
+
+        return protein_density, protein_value, health_score
+
+    def _candidates(self, dish_list):
+        """
+        发给大模型排序的候选菜品：营养表超出提示词预算时按本地健康评分预选，
+        而不是按菜单顺序截断（否则菜单靠后的健康菜品永远不会被推荐）
+        """
+        _, _, tokens = compile_dish_table(dish_list)
+        if tokens <= Config.PROMPT_TOKEN_BUDGET:
+            return dish_list
+        _, _, health_score = self._score(dish_list)
+        order = np.argsort(-health_score, kind='stable')
+        _, count, _ = compile_dish_table([dish_list[i] for i in order.tolist()], budget=Config.PROMPT_TOKEN_BUDGET)
+        # 候选菜品保持菜单顺序，编号只与候选列表对应
+        selected = sorted(order[:count].tolist())
+        print(f"营养表超出提示词预算，按本地评分预选 {len(selected)}/{len(dish_list)} 道候选菜品")
+        return [dish_list[i] for i in selected]
+
+    def _rank(self, dish_list):
+        """
+        按健康评分降序取前N道菜（评分相同时保持原始顺序）
+        """
+        if not dish_list:
+            return []
+        protein_density, protein_value, health_score = self._score(dish_list)
+
+        top_n = min(self.top_n, len(dish_list))
+        order = np.argsort(-health_score, kind='stable')[:top_n]
+        # 推荐结果是带评分的副本，健康分析的菜品列表保持不变
+        recommended = []
+        for i in order.tolist():
+            dish = dish_list[i].copy()
+            dish.protein_density = float(protein_density[i])
+            dish.protein_value = float(protein_value[i])
+            dish.health_score = float(health_score[i])
+            recommended.append(dish)
+        return recommended
+
+    def _attach_reasons(self, recommended_dishes, response):
+        """
+        将大模型生成的推荐理由按菜名附加到推荐菜品上
+        """
+        if 'choices' not in response or len(response['choices']) == 0:
+            return
+        content = response['choices'][0].get('message', {}).get('content', '')
+        reasons = extract_json(content, expect=list)
+        if reasons is None:
+            print("推荐理由解析失败，忽略")
+            PARSE_FAILURES.inc(stage='explain')
+            return
+        reason_by_name = {
+            item.get('name'): item.get('reason')
+            for item in reasons if isinstance(item, dict) and item.get('reason')
+        }
+        for dish in recommended_dishes:
+            if dish.name in reason_by_name:
+                dish.health_description = reason_by_name[dish.name]
 
     def _process_recommendations(self, recommended_dishes):
         """
         对推荐菜品进行后续计算处理
         """
-        if not isinstance(recommended_dishes, list):
-            return recommended_dishes
-            
-        processed_dishes = []
-        for dish in recommended_dishes:
-            if isinstance(dish, dict):
-                # 创建菜品副本以避免修改原始数据
-                processed_dish = dish.copy()
-                
-                # 获取营养信息（如果存在）
-                calories = dish.get('calories', 0)
-                protein = dish.get('protein', 0)
-                carbs = dish.get('carbs', 0)
-                fat = dish.get('fat', 0)
-                price = dish.get('price', 0)
-                
-                # 使用math库进行一些计算
-                # 计算营养密度（蛋白质/卡路里比率）
-                if calories > 0:
-                    protein_density = math.ceil((protein / calories) * 1000) / 1000
-                    processed_dish['proteinDensity'] = protein_density
-                else:
-                    processed_dish['proteinDensity'] = 0
-                
-                # 计算性价比（蛋白质/价格比率）
-                if price > 0:
-                    protein_value = math.ceil((protein / price) * 100) / 100
-                    processed_dish['proteinValue'] = protein_value
-                else:
-                    processed_dish['proteinValue'] = 0
-                
-                # 计算健康评分（综合考虑卡路里、脂肪和蛋白质）
-                health_score = 0
-                if calories > 0:
-                    # 低卡路里得分（卡路里越低得分越高）
-                    calorie_score = math.ceil((1 - min(calories / 1000, 1)) * 100) / 100
-                    
-                    # 低脂肪得分（脂肪越低得分越高）
-                    fat_score = math.ceil((1 - min(fat / 50, 1)) * 100) / 100
-                    
-                    # 高蛋白得分（蛋白质越高得分越高）
-                    protein_score = math.ceil(min(protein / 50, 1) * 100) / 100
-                    
-                    # 综合评分（加权平均）
-                    health_score = math.ceil((calorie_score * 0.4 + fat_score * 0.3 + protein_score * 0.3) * 100) / 100
-                
-                processed_dish['healthScore'] = health_score
-                
-                processed_dishes.append(processed_dish)
-            else:
-                processed_dishes.append(dish)
-        
-        return processed_dishes
\ No newline at end of file
+        # 返回带评分的副本以避免修改原始数据
+        return self._attach_scores([dish.copy() for dish in recommended_dishes])
+
+    def _attach_scores(self, dishes):
+        """
+        计算并写入评分（就地修改），返回 dishes
+        """
+        if not dishes:
+            return dishes
+        protein_density, protein_value, health_score = self._score(dishes)
+        for dish, density, value, score in zip(
+            dishes, protein_density.tolist(), protein_value.tolist(), health_score.tolist()
+        ):
+            dish.protein_density = density
+            dish.protein_value = value
+            dish.health_score = score
+        return dishes
+
+
+class AsyncRecommendationEngine(RecommendationEngine):
+    """
+    RecommendationEngine 的 asyncio 版本，配合 AsyncGLM45AirService 使用
+    """
+
+    @timed_stage('recommend')
+    async def recommend(self, dish_list_with_nutrition, deadline=None):
+        try:
+            print("开始菜品推荐，菜品列表：", dish_list_with_nutrition)
+            has_nutrition_info = self._has_nutrition_info(dish_list_with_nutrition)
+            if has_nutrition_info and self.mode == 'local':
+                recommended_dishes = self._rank(dish_list_with_nutrition)
+                if self.llm_reasons:
+                    try:
+                        response = await self.glm45_air_service.explain_recommendations(recommended_dishes, deadline)
+                    except DeadlineExceeded as e:
+                        print("推荐理由超时，忽略：", str(e))
+                        mark_degraded(deadline, 'recommendations')
+                    else:
+                        self._attach_reasons(recommended_dishes, response)
+                return recommended_dishes
+            elif has_nutrition_info:
+                cache_key = self._stage_cache_key(dish_list_with_nutrition)
+                cached = await self._acache_get(cache_key)
+                if cached is not None:
+                    return dishes_from(cached)
+
+                candidates = self._candidates(dish_list_with_nutrition)
+                try:
+                    response = await self.glm45_air_service.recommend_dishes(candidates, deadline)
+                except DeadlineExceeded as e:
+                    print("大模型推荐超时，使用本地排序：", str(e))
+                    mark_degraded(deadline, 'recommendations')
+                    return self._rank(dish_list_with_nutrition)
+                print("API响应：", response)
+                processed_dishes = self._parse_response(response, candidates)
+                await self._acache_set(cache_key, processed_dishes)
+                return processed_dishes
+            print("菜品列表不包含营养信息，直接返回原始菜品列表")
+            return self._process_recommendations(dish_list_with_nutrition)
+        except Exception as e:
+            print("菜品推荐出错：", str(e))
+            raise Exception(f"菜品推荐失败: {str(e)}")
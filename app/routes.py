@@ -1,8 +1,7 @@
 import os
-from flask import Blueprint, request, jsonify, send_from_directory
-import base64
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import json
-import re
+from config import Config
 from app.services.glm41v_service import GLM41VService
 from app.services.glm45_air_service import GLM45AirService
 from app.business.menu_recognition import MenuRecognition
@@ -10,6 +9,18 @@ from app.business.cost_calculator import CostCalculator
 from app.business.health_analysis import HealthAnalysis
 from app.business.recommendation_engine import RecommendationEngine
 from app.business.nutrition_summary import NutritionSummary
+from app.business.fused_analysis import FusedAnalysis
+from app.business.image_preprocessing import ImagePreprocessor
+from app.business.batch_jobs import JobManager, JobQueueFullError, JobTooLargeError
+from app.business.pipeline import MenuPipeline, error_response
+from app.business.dish import dish_json_default
+from app.services.stage_cache import get_stage_cache
+from app.services.dish_store import get_dish_store
+from app.services.nutrition_kb import get_nutrition_kb
+from app.services.rate_limiter import rate_limiter_stats
+from app.services.deadline import Deadline
+from app.services.metrics import stage_timer
+from app.services.static_assets import StaticAssets
 
 main = Blueprint('main', __name__, static_folder='static')
 
@@ -17,263 +28,227 @@ main = Blueprint('main', __name__, static_folder='static')
 # 使用延迟初始化避免在Vercel构建时出现问题
 glm41v_service = None
 glm45_air_service = None
+image_preprocessor = ImagePreprocessor()
 menu_recognition = None
 cost_calculator = None
 health_analysis = None
 recommendation_engine = None
 nutrition_summary = None
+fused_analysis = None
+pipeline = None
+job_manager = None
+static_assets = None
 
 def init_services():
     """延迟初始化服务，避免在Vercel构建时出错"""
     global glm41v_service, glm45_air_service, menu_recognition
-    global cost_calculator, health_analysis, recommendation_engine, nutrition_summary
+    global cost_calculator, health_analysis, recommendation_engine, nutrition_summary, fused_analysis, pipeline
     
     if glm41v_service is None:
         try:
             glm41v_service = GLM41VService()
             glm45_air_service = GLM45AirService()
-            menu_recognition = MenuRecognition(glm41v_service)
+            stage_cache = get_stage_cache()
+            menu_recognition = MenuRecognition(glm41v_service, cache=stage_cache)
             cost_calculator = CostCalculator()
-            health_analysis = HealthAnalysis(glm45_air_service)
-            recommendation_engine = RecommendationEngine(glm45_air_service)
-            nutrition_summary = NutritionSummary(glm45_air_service)
+            health_analysis = HealthAnalysis(
+                glm45_air_service, cache=stage_cache, dish_store=get_dish_store(), knowledge_base=get_nutrition_kb()
+            )
+            recommendation_engine = RecommendationEngine(glm45_air_service, cache=stage_cache)
+            nutrition_summary = NutritionSummary(glm45_air_service, cache=stage_cache)
+            fused_analysis = FusedAnalysis(
+                glm45_air_service, health_analysis, recommendation_engine, nutrition_summary, cache=stage_cache
+            )
+            pipeline = MenuPipeline(
+                menu_recognition, health_analysis, recommendation_engine, nutrition_summary,
+                fused_analysis, cost_calculator
+            )
         except Exception as e:
             print(f"Warning: Could not initialize services: {e}")
 
+def get_job_manager():
+    """延迟创建批量任务的后台线程池"""
+    global job_manager
+    if job_manager is None:
+        job_manager = JobManager(process_image_bytes)
+    return job_manager
+
+@main.record_once
+def load_static_assets(state):
+    """注册蓝图时（应用启动时）读入并预压缩静态文件"""
+    global static_assets
+    static_assets = StaticAssets(main.static_folder)
+
+def serve_asset(asset):
+    status, headers, body = static_assets.respond(
+        asset, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match')
+    )
+    return Response(body, status=status, headers=headers)
+
 @main.route('/')
 def index():
     # 在所有环境中都返回静态文件
-    return send_from_directory(main.static_folder, 'index.html')
+    return serve_asset(static_assets.get(static_assets.index))
 
 @main.route('/<path:filename>')
 def static_files(filename):
     """提供静态文件"""
-    try:
-        return send_from_directory(main.static_folder, filename)
-    except FileNotFoundError:
-        # 如果文件不存在，返回index.html以支持前端路由
-        return send_from_directory(main.static_folder, 'index.html')
+    asset = static_assets.get(filename)
+    if asset is not None:
+        return serve_asset(asset)
+    if filename.startswith('api/'):
+        return jsonify({'error': '接口不存在'}), 404
+    if '.' in filename.rsplit('/', 1)[-1]:
+        # 带扩展名的路径是找不到的资源文件，直接 404，不返回整个页面
+        return Response('Not Found', status=404, mimetype='text/plain')
+    # 其余路径返回index.html以支持前端路由
+    return serve_asset(static_assets.get(static_assets.index))
 
 @main.route('/health')
 def health_check():
     return jsonify({"status": "ok", "environment": "vercel" if os.getenv('VERCEL') == '1' else "local"})
 
+@main.route('/api/cache/stats')
+def cache_stats():
+    """阶段缓存的命中/未命中/淘汰计数"""
+    stage_cache = get_stage_cache()
+    if stage_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **stage_cache.stats()})
+
+@main.route('/api/rate-limits')
+def rate_limits():
+    """各模型/API密钥限流器的当前速率、并发、排队和拒绝计数"""
+    return jsonify(rate_limiter_stats())
+
+@main.route('/api/hedging')
+def hedging_stats():
+    """各上游端点的延迟样本数、当前对冲等待时间，以及对冲、对冲胜出和超出对冲比例上限的次数"""
+    init_services()
+    services = [service for service in (glm41v_service, glm45_air_service) if service is not None]
+    return jsonify({
+        'enabled': Config.HEDGE_ENABLED,
+        'endpoints': [stats for service in services for stats in service.hedger.stats()],
+    })
+
+def process_image_bytes(data):
+    """
+    处理一张原始图片，返回与 /api/process-menu 相同结构的结果（批量任务使用）
+    """
+    init_services()
+    image = image_preprocessor.process(data)
+    print("图片预处理：", image.info())
+    return pipeline.collect(image)
+
+def read_image():
+    """
+    读取上传的图片并预处理（纠正方向、缩放、重新编码），没有图片时返回 None
+    """
+    if 'image' not in request.files:
+        return None
+    image_file = request.files['image']
+    image = image_preprocessor.process(image_file.read())
+    print("图片预处理：", image.info())
+    return image
+
 @main.route('/api/process-menu', methods=['POST'])
 def process_menu():
+    # 请求的时间预算从收到请求开始计算（包括读取和预处理图片）
+    deadline = Deadline.start()
     try:
         # 初始化服务
         init_services()
         
         # 获取上传的图片
-        if 'image' not in request.files:
+        image = read_image()
+        if image is None:
             return jsonify({'error': '没有找到图片文件'}), 400
         
-        image_file = request.files['image']
-        
-        # 将图片转换为base64
-        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # 1. 菜单识别
-        menu_text = menu_recognition.recognize(image_base64)
-        print("菜单识别结果：", menu_text)
-        
-        # 2. 解析菜单文本为菜品列表
-        dish_list = parse_menu_text(menu_text)
-        print("解析后的菜品列表：", dish_list)
-        
-        # 3. 健康分析（分析菜品营养成分）
-        dish_list_with_nutrition = health_analysis.analyze(dish_list)
-        print("健康分析结果：", dish_list_with_nutrition)
-        
-        # 4. 菜品推荐（根据健康程度推荐菜品）
-        recommended_dishes = recommendation_engine.recommend(dish_list_with_nutrition)
-        print("推荐菜品结果：", recommended_dishes)
-        
-        # 5. 生成营养总结
-        nutrition_summary_data = nutrition_summary.generate(recommended_dishes)
-        print("营养总结结果：", nutrition_summary_data)
-        
-        # 6. 计算总价
-        total_cost = cost_calculator.calculate(recommended_dishes)
-        print("总价计算结果：", total_cost)
-        
         # 返回结果
-        return jsonify({
-            'menuText': menu_text,
-            'dishList': dish_list_with_nutrition,
-            'recommendedDishes': recommended_dishes,
-            'nutritionSummary': nutrition_summary_data,
-            'totalCost': total_cost
-        })
+        with stage_timer('pipeline', 'process_menu'):
+            result = pipeline.collect(image, deadline)
+        return jsonify(result)
     except Exception as e:
-        print("处理菜单时出错：", str(e))
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        status, body, headers = error_response(e)
+        return jsonify(body), status, headers
 
-def parse_menu_text(menu_text):
+def sse_event(event, data):
+    """按 Server-Sent Events 格式编码一条事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=dish_json_default)}\n\n"
+
+@main.route('/api/process-menu/stream', methods=['POST'])
+def process_menu_stream():
     """
-    解析菜单文本为菜品列表
-    支持处理结构化的JSON格式菜单数据和文本格式
+    流式处理菜单：每完成一个阶段就推送一条 SSE 事件
+    依次为 menu、nutrition、recommendations、summary，最后是 done；出错时推送 error
     """
+    deadline = Deadline.start()
+    init_services()
     
-    # 检查是否包含JSON代码块
-    if '```json' in menu_text:
-        print("检测到JSON代码块")
-        try:
-            # 提取JSON部分
-            json_match = re.search(r'```json\s*([\s\S]*?)\s*```', menu_text, re.DOTALL)
-            if json_match:
-                json_content = json_match.group(1)
-                print("提取到代码块中的JSON内容")
-                print("JSON内容长度:", len(json_content))
-                print("JSON内容预览:", repr(json_content[:100]))
-                
-                # 清理JSON内容，移除可能的注释和多余空格
-                json_content = json_content.strip()
-                print("清理前的JSON内容:", repr(json_content[:100]))
-                
-                # 尝试解析JSON
-                menu_data = json.loads(json_content)
-                print("JSON解析成功")
-                
-                # 解析结构化的菜单数据（通用方法）
-                dishes = []
-                
-                # 遍历所有键值对
-                if isinstance(menu_data, dict):
-                    for key, value in menu_data.items():
-                        print(f"处理分类: {key}")
-                        # 如果值是列表，且列表中的元素是字典
-                        if isinstance(value, list):
-                            print(f"  分类 {key} 包含 {len(value)} 个项目")
-                            for i, item in enumerate(value):
-                                if isinstance(item, dict):
-                                    print(f"    处理项目 {i}: {item}")
-                                    # 尝试提取菜品信息
-                                    # 查找名称键
-                                    name = ""
-                                    for k in ['name',]:
-                                        if k in item:
-                                            name = str(item[k])
-                                            break
-                                    
-                                    # 查找描述键
-                                    description = ""
-                                    for k in ['description']:
-                                        if k in item:
-                                            description = str(item[k])
-                                            break
-                                    
-                                    # 查找价格键
-                                    price = 0
-                                    for k in ['price','价格']:
-                                        if k in item:
-                                            try:
-                                                price = float(item[k])
-                                            except (ValueError, TypeError):
-                                                pass
-                                            break
-                                    
-                                    dish = {
-                                        'name': name,
-                                        'description': description,
-                                        'price': price
-                                    }
-                                    
-                                    # 只有当名称不为空时才添加
-                                    if dish['name']:
-                                        dishes.append(dish)
-                                        print(f"    添加菜品: {dish['name']}")
-                
-                    # 如果成功解析到菜品，返回结果
-                    if dishes:
-                        print(f"总共解析到 {len(dishes)} 道菜")
-                        return dishes
-                    else:
-                        print("没有解析到任何菜品")
-                else:
-                    print("JSON数据不是字典格式")
-            else:
-                print("未找到有效的JSON代码块")
-        except json.JSONDecodeError as e:
-            print(f"JSON解析失败: {e}")
-            print("错误位置附近的内容:", repr(menu_text[max(0, e.pos-50):e.pos+50]))
-        except Exception as e:
-            print(f"解析过程中出现错误: {e}")
-            import traceback
-            traceback.print_exc()
-    else:
-        # 如果没有代码块，尝试直接解析整个内容为JSON
-        print("尝试直接解析菜单文本为JSON")
+    image = read_image()
+    if image is None:
+        return jsonify({'error': '没有找到图片文件'}), 400
+    
+    def generate():
         try:
-            menu_data = json.loads(menu_text)
-            print("直接JSON解析成功")
-            
-            # 解析结构化的菜单数据（通用方法）
-            dishes = []
-            
-            # 遍历所有键值对
-            if isinstance(menu_data, dict):
-                for key, value in menu_data.items():
-                    print(f"处理分类: {key}")
-                    # 如果值是列表，且列表中的元素是字典
-                    if isinstance(value, list):
-                        print(f"  分类 {key} 包含 {len(value)} 个项目")
-                        for i, item in enumerate(value):
-                            if isinstance(item, dict):
-                                print(f"    处理项目 {i}: {item}")
-                                # 尝试提取菜品信息
-                                # 查找名称键
-                                name = ""
-                                for k in ['name',]:
-                                    if k in item:
-                                        name = str(item[k])
-                                        break
-                                
-                                # 查找描述键
-                                description = ""
-                                for k in ['description']:
-                                    if k in item:
-                                        description = str(item[k])
-                                        break
-                                
-                                # 查找价格键
-                                price = 0
-                                for k in ['price','价格']:
-                                    if k in item:
-                                        try:
-                                            price = float(item[k])
-                                        except (ValueError, TypeError):
-                                            pass
-                                        break
-                                
-                                dish = {
-                                    'name': name,
-                                    'description': description,
-                                    'price': price
-                                }
-                                
-                                # 只有当名称不为空时才添加
-                                if dish['name']:
-                                    dishes.append(dish)
-                                    print(f"    添加菜品: {dish['name']}")
-            
-                # 如果成功解析到菜品，返回结果
-                if dishes:
-                    print(f"总共解析到 {len(dishes)} 道菜")
-                    return dishes
-                else:
-                    print("没有解析到任何菜品")
-            else:
-                print("JSON数据不是字典格式")
-        except json.JSONDecodeError as e:
-            print(f"直接JSON解析失败: {e}")
+            with stage_timer('pipeline', 'process_menu_stream'):
+                for stage, data in pipeline.run(image, deadline):
+                    yield sse_event(stage, data)
+            yield sse_event('done', {})
         except Exception as e:
-            print(f"直接解析过程中出现错误: {e}")
-            import traceback
-            traceback.print_exc()
+            # 响应头已经发出，状态码和 Retry-After 只能放进 error 事件
+            status, body, headers = error_response(e)
+            if 'Retry-After' in headers:
+                body['retryAfter'] = int(headers['Retry-After'])
+            yield sse_event('error', body)
     
-    # 如果没有找到有效的JSON或解析失败，返回空列表
-    print("返回空的菜品列表")
-    return []
\ No newline at end of file
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # 关闭反向代理缓冲，保证事件即时送达
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+@main.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    批量提交菜单图片（表单字段 images，可多个），立即返回任务ID，图片在后台依次处理
+    """
+    image_files = request.files.getlist('images')
+    if not image_files:
+        return jsonify({'error': '没有找到图片文件'}), 400
+    
+    images = [(image_file.filename, image_file.read()) for image_file in image_files]
+    try:
+        job = get_job_manager().submit(images)
+    except JobTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except JobQueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    
+    return jsonify({
+        'jobId': job.id,
+        'status': job.status,
+        'total': len(images),
+        'statusUrl': f'/api/jobs/{job.id}',
+        'resultsUrl': f'/api/jobs/{job.id}/results',
+    }), 202
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询批量任务状态及每张图片的进度"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@main.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """获取批量任务中已完成图片的处理结果"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict(include_results=True))
@@ -0,0 +1,104 @@
+import time
+from config import Config
+
+# 处理流程中可能因超时只返回部分结果的阶段（与流式接口的事件名一致）
+PIPELINE_STAGES = ('menu', 'nutrition', 'recommendations', 'summary')
+
+
+class DeadlineExceeded(Exception):
+    """
+    请求的时间预算已用完：发出上游请求前检查到，或等待上游/限流器时超时
+    """
+
+
+class Deadline:
+    """
+    单个请求的截止时间，随调用链显式传给各阶段和每个上游请求
+    每次上游请求的超时取默认超时与剩余预算中较小的，后面的阶段自然只能用剩下的时间
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        # 因超时只返回了部分结果或本地兜底结果的阶段
+        self.degraded = set()
+
+    @classmethod
+    def start(cls, budget=None):
+        """
+        从现在开始计时；预算为 0（不限制）时返回 None
+        """
+        budget = Config.REQUEST_DEADLINE if budget is None else budget
+        return cls(budget) if budget and budget > 0 else None
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self, slack=0.0):
+        """
+        slack 用于判断一次超时是否由预算引起（套接字超时可能比设定值略早返回）
+        """
+        return time.monotonic() + slack >= self.expires_at
+
+    def check(self, operation):
+        """
+        预算已用完时抛出 DeadlineExceeded，不再发出新的上游请求
+        """
+        if self.expired():
+            raise self.error(operation)
+
+    def error(self, operation):
+        return DeadlineExceeded(f"请求已超出 {self.budget:g} 秒的处理时限（{operation}）")
+
+    def bound(self, seconds):
+        """
+        把一个超时（秒）限制在剩余预算内
+        """
+        # 超时为 0 时部分客户端会变成非阻塞调用，留一个极小的下限（check 已保证预算尚未用完）
+        remaining = max(self.remaining(), 0.01)
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def degrade(self, stage):
+        """
+        记录某个阶段因超时降级（部分结果或本地兜底），降级的结果不写缓存
+        """
+        self.degraded.add(stage)
+
+
+def remaining(deadline):
+    """
+    剩余预算（秒），没有时限时返回 None（可直接作为各类 wait 的 timeout）
+    """
+    return deadline.remaining() if deadline is not None else None
+
+
+def mark_degraded(deadline, stage):
+    """
+    记录阶段因超时降级；没有时限（deadline 为 None，如批量任务）时什么也不做
+    """
+    if deadline is not None:
+        deadline.degrade(stage)
+
+
+def is_degraded(deadline, stage):
+    return deadline is not None and stage in deadline.degraded
+
+
+def stage_status(deadline, stages=PIPELINE_STAGES):
+    """
+    各阶段的完成情况：ok 为完整结果，partial 为超时后的部分结果或本地兜底结果
+    """
+    return {stage: 'partial' if is_degraded(deadline, stage) else 'ok' for stage in stages}
+
+
+def find_deadline_error(exc):
+    """
+    沿异常链查找 DeadlineExceeded（业务层会把底层异常包装为普通 Exception）
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, DeadlineExceeded):
+            return exc
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return None
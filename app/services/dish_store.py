@@ -0,0 +1,151 @@
+import re
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 营养字段，与健康分析提示词要求的输出字段保持一致
+NUTRITION_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+
+# 归一化时去掉的空白和标点（含全角）
+_NOISE_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+# SQLite 单条语句的参数上限较低，批量查询时分块
+_LOOKUP_CHUNK = 500
+
+
+class DishNutritionStore:
+    """
+    菜品级营养数据的持久化存储（SQLite）
+    以归一化的 名称+描述 为键，健康分析只需要把未见过的菜品发给大模型
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or Config.DISH_STORE_PATH
+        # sqlite3 连接不能跨线程共享，每个线程各持有一个连接
+        self._local = threading.local()
+        self._init_schema()
+
+    @staticmethod
+    def normalize(name, description=''):
+        """
+        归一化菜品键：全角转半角、统一大小写、去掉空白和标点
+        """
+        def clean(text):
+            text = unicodedata.normalize('NFKC', str(text or '')).lower()
+            return _NOISE_RE.sub('', text)
+        return f"{clean(name)}|{clean(description)}"
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS dish_nutrition (
+                    dish_key TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    name TEXT,
+                    calories REAL,
+                    protein REAL,
+                    carbs REAL,
+                    fat REAL,
+                    updated_at REAL,
+                    PRIMARY KEY (dish_key, prompt_version)
+                )
+                '''
+            )
+
+    def get_many(self, dish_list, prompt_version):
+        """
+        批量查询菜品营养信息
+        返回 {菜品下标: {'calories': ..., 'protein': ..., 'carbs': ..., 'fat': ...}}
+        """
+        keys_by_index = {}
+        for i, dish in enumerate(dish_list):
+            if dish.name:
+                keys_by_index[i] = self.normalize(dish.name, dish.description)
+        if not keys_by_index:
+            return {}
+
+        rows = {}
+        unique_keys = list(set(keys_by_index.values()))
+        conn = self._connect()
+        for start in range(0, len(unique_keys), _LOOKUP_CHUNK):
+            chunk = unique_keys[start:start + _LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = conn.execute(
+                f'SELECT dish_key, calories, protein, carbs, fat FROM dish_nutrition '
+                f'WHERE prompt_version = ? AND dish_key IN ({placeholders})',
+                [prompt_version, *chunk],
+            )
+            for dish_key, *values in cursor:
+                rows[dish_key] = dict(zip(NUTRITION_FIELDS, values))
+
+        return {i: dict(rows[key]) for i, key in keys_by_index.items() if key in rows}
+
+    def put_many(self, dish_list, nutrition_list, prompt_version):
+        """
+        写入菜品营养信息，dish_list 与 nutrition_list（均为 Dish）按下标一一对应
+        缺少营养字段的结果（如大模型输出不完整）不会写入
+        """
+        now = time.time()
+        records = []
+        for dish, nutrition in zip(dish_list, nutrition_list):
+            values = [getattr(nutrition, field) for field in NUTRITION_FIELDS]
+            if not dish.name or None in values:
+                continue
+            records.append((
+                self.normalize(dish.name, dish.description),
+                prompt_version,
+                dish.name,
+                *values,
+                now,
+            ))
+        if not records:
+            return 0
+
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO dish_nutrition '
+                '(dish_key, prompt_version, name, calories, protein, carbs, fat, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                records,
+            )
+        return len(records)
+
+
+_dish_store = None
+_dish_store_lock = threading.Lock()
+
+
+def get_dish_store():
+    """
+    获取进程内共享的菜品营养存储，配置关闭或数据库不可用时返回 None
+    """
+    global _dish_store
+    if not Config.DISH_STORE_ENABLED:
+        return None
+    if _dish_store is None:
+        with _dish_store_lock:
+            if _dish_store is None:
+                try:
+                    _dish_store = DishNutritionStore()
+                except sqlite3.Error as e:
+                    logger.warning(f"Dish nutrition store unavailable: {e}")
+                    return None
+    return _dish_store
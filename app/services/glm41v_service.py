@@ -2,11 +2,19 @@ import requests
 import json
 import logging
 from config import Config
+from app.services.http_client import GLMHttpClient, AsyncGLMHttpClient, httpx
+from app.services.hedging import RequestHedger
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 class GLM41VService:
+    MODEL = "glm-4v-flash"
+    # 修改提示词时递增版本号，使阶段缓存中的旧结果失效
+    PROMPT_VERSION = "menu-v1"
+    # 子类替换为异步客户端，避免先创建再丢弃同步客户端
+    HTTP_CLIENT_CLASS = GLMHttpClient
+
     def __init__(self):
         self.api_key = Config.GLM_4_1V_API_KEY
         self.base_url = Config.API_BASE_URL
@@ -15,15 +23,17 @@ class GLM41VService:
         if not self.api_key:
             raise ValueError("GLM_4_1V_API_KEY is not set in the configuration")
 
-    def recognize_menu(self, image_base64):
-        url = self.base_url
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "glm-4v-flash",
+        # 共享连接池的HTTP客户端，请求头只构建一次
+        self.http_client = self.HTTP_CLIENT_CLASS(self.api_key, self.base_url)
+        # 按调用名维护的延迟直方图和对冲策略（HEDGE_ENABLED 开启时生效）
+        self.hedger = RequestHedger(self.MODEL)
+
+    def _build_payload(self, image_base64, mime_type="image/jpeg"):
+        """
+        构造菜单识别请求体（同步与异步客户端共用）
+        """
+        return {
+            "model": self.MODEL,
             "temperature": 0.9,
             "top_k": 4,
             "max_tokens": 1024,
@@ -34,7 +44,7 @@ class GLM41VService:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{mime_type};base64,{image_base64}"
                             }
                         },
                         {
@@ -66,12 +76,15 @@ class GLM41VService:
                 }
             ]
         }
+
+    def recognize_menu(self, image_base64, mime_type="image/jpeg", deadline=None):
+        payload = self._build_payload(image_base64, mime_type)
         
         try:
             logger.info("Calling GLM-4.1V API for menu recognition")
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
+            result = self.http_client.post(
+                payload, operation='recognize_menu', deadline=deadline, hedge=self.hedger.policy('recognize_menu')
+            )
             logger.info("Successfully received response from GLM-4.1V API")
             return result
         except requests.exceptions.RequestException as e:
@@ -79,4 +92,67 @@ class GLM41VService:
             raise Exception(f"GLM-4.1V API 调用失败: {str(e)}")
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse GLM-4.1V API response: {str(e)}")
-            raise Exception(f"解析 GLM-4.1V API 响应失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"解析 GLM-4.1V API 响应失败: {str(e)}")
+
+    def recognize_menu_stream(self, image_base64, mime_type="image/jpeg", deadline=None):
+        """
+        流式识别菜单，逐段产出模型输出的文本
+        """
+        payload = self._build_payload(image_base64, mime_type)
+
+        try:
+            logger.info("Calling GLM-4.1V API for menu recognition (stream)")
+            yield from self.http_client.stream(
+                payload, operation='recognize_menu', deadline=deadline,
+                hedge=self.hedger.policy('recognize_menu', stream=True),
+            )
+            logger.info("Finished streaming response from GLM-4.1V API")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"GLM-4.1V API call failed: {str(e)}")
+            raise Exception(f"GLM-4.1V API 调用失败: {str(e)}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse GLM-4.1V API stream: {str(e)}")
+            raise Exception(f"解析 GLM-4.1V API 响应失败: {str(e)}")
+
+
+class AsyncGLM41VService(GLM41VService):
+    """
+    GLM41VService 的 asyncio 版本，等待上游时不占用线程
+    """
+
+    HTTP_CLIENT_CLASS = AsyncGLMHttpClient
+
+    async def recognize_menu(self, image_base64, mime_type="image/jpeg", deadline=None):
+        payload = self._build_payload(image_base64, mime_type)
+
+        try:
+            logger.info("Calling GLM-4.1V API for menu recognition (async)")
+            result = await self.http_client.post(
+                payload, operation='recognize_menu', deadline=deadline, hedge=self.hedger.policy('recognize_menu')
+            )
+            logger.info("Successfully received response from GLM-4.1V API")
+            return result
+        except httpx.HTTPError as e:
+            logger.error(f"GLM-4.1V API call failed: {str(e)}")
+            raise Exception(f"GLM-4.1V API 调用失败: {str(e)}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse GLM-4.1V API response: {str(e)}")
+            raise Exception(f"解析 GLM-4.1V API 响应失败: {str(e)}")
+
+    async def recognize_menu_stream(self, image_base64, mime_type="image/jpeg", deadline=None):
+        payload = self._build_payload(image_base64, mime_type)
+
+        try:
+            logger.info("Calling GLM-4.1V API for menu recognition (async stream)")
+            async for delta in self.http_client.stream(
+                payload, operation='recognize_menu', deadline=deadline,
+                hedge=self.hedger.policy('recognize_menu', stream=True),
+            ):
+                yield delta
+            logger.info("Finished streaming response from GLM-4.1V API")
+        except httpx.HTTPError as e:
+            logger.error(f"GLM-4.1V API call failed: {str(e)}")
+            raise Exception(f"GLM-4.1V API 调用失败: {str(e)}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse GLM-4.1V API stream: {str(e)}")
+            raise Exception(f"解析 GLM-4.1V API 响应失败: {str(e)}")
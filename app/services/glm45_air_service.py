@@ -1,37 +1,70 @@
 import requests
 import json
+import logging
 from config import Config
+from app.services.http_client import GLMHttpClient, AsyncGLMHttpClient, httpx
+from app.services.hedging import RequestHedger
+from app.services.prompt_compiler import NUTRITION_COLUMNS, compile_dish_table, estimate_payload_tokens
+from app.services.metrics import PROMPT_TOKENS_ESTIMATED
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 空输入时直接返回的响应结构，避免无意义的上游调用
+EMPTY_LIST_RESPONSE = {
+    "choices": [{
+        "message": {
+            "content": "```json\n[]\n```"
+        }
+    }]
+}
+
+EMPTY_SUMMARY_RESPONSE = {
+    "choices": [{
+        "message": {
+            "content": "```json\n{\n  \"totalCalories\": 0,\n  \"totalProtein\": 0,\n  \"totalCarbs\": 0,\n  \"totalFat\": 0\n}\n```"
+        }
+    }]
+}
+
+EMPTY_FUSED_RESPONSE = {
+    "choices": [{
+        "message": {
+            "content": "```json\n{\"nutrition\": [], \"recommended\": []}\n```"
+        }
+    }]
+}
+
+# 合并调用的菜品表：名称、描述和已知的营养值（未知为 -）
+FUSED_COLUMNS = NUTRITION_COLUMNS[:1] + (('desc', 'description'),) + NUTRITION_COLUMNS[1:]
 
 class GLM45AirService:
+    MODEL = "glm-4-flash"
+    # 修改提示词时递增版本号，使阶段缓存中的旧结果失效
+    HEALTH_PROMPT_VERSION = "health-v1"
+    RECOMMEND_PROMPT_VERSION = "recommend-v2"
+    SUMMARY_PROMPT_VERSION = "summary-v2"
+    EXPLAIN_PROMPT_VERSION = "explain-v1"
+    FUSED_PROMPT_VERSION = "fused-v1"
+    # 子类替换为异步客户端，避免先创建再丢弃同步客户端
+    HTTP_CLIENT_CLASS = GLMHttpClient
+
     def __init__(self):
         self.api_key = Config.GLM_4_5_AIR_API_KEY
         self.base_url = Config.API_BASE_URL
+        # 共享连接池的HTTP客户端，请求头只构建一次
+        self.http_client = self.HTTP_CLIENT_CLASS(self.api_key, self.base_url)
+        # 按调用名维护的延迟直方图和对冲策略（HEDGE_ENABLED 开启时生效）
+        self.hedger = RequestHedger(self.MODEL)
 
-    def analyze_health(self, dish_list):
-        url = self.base_url
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # 检查菜品列表是否为空
-        if not dish_list:
-            # 如果菜品列表为空，返回空的响应结构
-            return {
-                "choices": [{
-                    "message": {
-                        "content": "```json\n[]\n```"
-                    }
-                }]
-            }
-        
+    def _build_health_payload(self, dish_list):
         # 构造菜品列表字符串
         dish_list_str = ""
         for dish in dish_list:
-            dish_list_str += f"{dish['name']}: {dish['description']}\n"
-        
-        payload = {
-            "model": "glm-4-flash",
+            dish_list_str += f"{dish.name}: {dish.description}\n"
+
+        return {
+            "model": self.MODEL,
             "temperature": 0.9,
             "top_k": 4,
             "max_tokens": 8192,  # 减少max_tokens以控制输出长度
@@ -46,40 +79,16 @@ class GLM45AirService:
                 }
             ]
         }
-        
-        try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-            return result
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"GLM-4.5-Air API (健康分析) 调用失败: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"解析 GLM-4.5-Air API (健康分析) 响应失败: {str(e)}")
 
-    def recommend_dishes(self, dish_list_with_nutrition):
-        url = self.base_url
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # 检查菜品列表是否为空
-        if not dish_list_with_nutrition:
-            # 如果菜品列表为空，返回空的推荐列表
-            return {
-                "choices": [{
-                    "message": {
-                        "content": "```json\n[]\n```"
-                    }
-                }]
-            }
-        
-        payload = {
-            "model": "glm-4-flash",
+    def _build_recommend_payload(self, dish_list_with_nutrition):
+        # 菜品以短编号 + 营养表发送，大模型只返回编号和评分，完整记录由推荐引擎在本地还原
+        # 大菜单已由推荐引擎按本地评分预选到预算以内，这里的 budget 只是兜底
+        table, count, _ = compile_dish_table(dish_list_with_nutrition, budget=Config.PROMPT_TOKEN_BUDGET)
+        return {
+            "model": self.MODEL,
             "temperature": 0.9,
             "top_k": 4,
-            "max_tokens": 1000,
+            "max_tokens": 200,
             "messages": [
                 {
                     "role": "system",
@@ -87,44 +96,18 @@ class GLM45AirService:
                 },
                 {
                     "role": "user",
-                    "content": f"以下是包含营养信息的菜品列表:\n{json.dumps(dish_list_with_nutrition, ensure_ascii=False, indent=2)}\n\n请根据健康程度（低卡路里、低脂肪、高蛋白等综合因素）对这些菜品进行排序，并推荐最健康的1-3个单品或搭配合理的组合。请以JSON数组格式返回推荐的菜品。"
+                    "content": f"菜品营养表（共{count}道，字段以|分隔，kcal为热量，其余单位为g，-表示未知）:\n{table}\n\n请根据健康程度（低卡路里、低脂肪、高蛋白等综合因素）推荐最健康的1-3道菜。只返回JSON数组，按推荐顺序排列，每个元素为{{\"id\": 菜品编号, \"score\": 0到1之间的健康评分}}，不要返回其他字段。"
                 }
             ]
         }
-        
-        try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-            return result
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"GLM-4.5-Air API (推荐) 调用失败: {str(e)}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"解析 GLM-4.5-Air API (推荐) 响应失败: {str(e)}")
 
-    def generate_nutrition_summary(self, recommended_dishes):
-        url = self.base_url
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # 检查推荐菜品列表是否为空
-        if not recommended_dishes:
-            # 如果推荐菜品列表为空，返回空的营养总结
-            return {
-                "choices": [{
-                    "message": {
-                        "content": "```json\n{\n  \"totalCalories\": 0,\n  \"totalProtein\": 0,\n  \"totalCarbs\": 0,\n  \"totalFat\": 0\n}\n```"
-                    }
-                }]
-            }
-        
-        payload = {
-            "model": "glm-4-flash",
+    def _build_summary_payload(self, recommended_dishes):
+        table, _, _ = compile_dish_table(recommended_dishes, budget=Config.PROMPT_TOKEN_BUDGET, with_ids=False)
+        return {
+            "model": self.MODEL,
             "temperature": 0.9,
             "top_k": 4,
-            "max_tokens": 1000,
+            "max_tokens": 200,
             "messages": [
                 {
                     "role": "system",
@@ -132,17 +115,167 @@ class GLM45AirService:
                 },
                 {
                     "role": "user",
-                    "content": f"以下是推荐的菜品及其营养信息:\n{json.dumps(recommended_dishes, ensure_ascii=False, indent=2)}\n\n请生成这些菜品的综合营养总结，包括总热量(kcal)、总蛋白质(g)、总碳水化合物(g)和总脂肪(g)。请以JSON对象格式返回，包含totalCalories, totalProtein, totalCarbs, totalFat字段。"
+                    "content": f"推荐菜品营养表（字段以|分隔，kcal为热量，其余单位为g，-表示未知）:\n{table}\n\n请生成这些菜品的综合营养总结。只返回JSON对象，包含totalCalories, totalProtein, totalCarbs, totalFat字段（数值）。"
                 }
             ]
         }
-        
+
+    def _build_explain_payload(self, recommended_dishes):
+        # 只发送生成推荐理由所需的字段
+        dishes = [
+            dish.to_dict(('name', 'calories', 'protein', 'carbs', 'fat', 'healthScore'))
+            for dish in recommended_dishes
+        ]
+        return {
+            "model": self.MODEL,
+            "temperature": 0.9,
+            "top_k": 4,
+            "max_tokens": 600,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的营养师，能够用简短的语言解释菜品推荐理由。"
+                },
+                {
+                    "role": "user",
+                    "content": f"以下菜品已按健康评分排序推荐:\n{json.dumps(dishes, ensure_ascii=False)}\n\n请为每道菜写一句不超过20字的推荐理由。以JSON数组格式返回，每个对象包含name, reason字段。"
+                }
+            ]
+        }
+
+    def _build_fused_payload(self, dish_list, summarize=True):
+        # 一次调用完成健康分析、推荐和（可选的）营养总结；营养库已知的营养值直接填入表中，大模型只补全未知的
+        table, count, _ = compile_dish_table(dish_list, columns=FUSED_COLUMNS)
+        tasks = [
+            "1. nutrition：为营养值为-的菜品估算卡路里、蛋白质(g)、碳水化合物(g)和脂肪(g)，数组元素为{\"id\": 菜品编号, \"calories\", \"protein\", \"carbs\", \"fat\"}，营养值已知的菜品不要返回；",
+            "2. recommended：根据健康程度（低卡路里、低脂肪、高蛋白等综合因素）推荐最健康的1-3道菜，按推荐顺序排列，数组元素为{\"id\": 菜品编号, \"score\": 0到1之间的健康评分}；",
+        ]
+        if summarize:
+            tasks.append("3. summary：推荐菜品的综合营养总结，对象包含totalCalories, totalProtein, totalCarbs, totalFat字段（数值）。")
+        tasks_str = "\n".join(tasks)
+        return {
+            "model": self.MODEL,
+            "temperature": 0.9,
+            "top_k": 4,
+            "max_tokens": 8192,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "你是一个专业的营养师，能够分析菜品的营养成分并推荐健康的菜品组合。"
+                },
+                {
+                    "role": "user",
+                    "content": f"菜品表（共{count}道，字段以|分隔，kcal为热量，其余单位为g，-表示未知）:\n{table}\n\n请完成以下任务，只返回一个JSON对象，不要包含健康评价描述:\n{tasks_str}"
+                }
+            ]
+        }
+
+    def _estimate(self, payload, operation):
+        """
+        发送前估算输入 token 数，记录指标，超出预算时告警
+        """
+        tokens = estimate_payload_tokens(payload)
+        PROMPT_TOKENS_ESTIMATED.inc(tokens, model=self.MODEL, operation=operation)
+        if tokens > Config.PROMPT_TOKEN_BUDGET:
+            logger.warning(f"{operation} prompt is ~{tokens} tokens, over budget {Config.PROMPT_TOKEN_BUDGET}")
+        return tokens
+
+    def _send(self, payload, purpose, operation, deadline=None):
+        self._estimate(payload, operation)
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
+            result = self.http_client.post(
+                payload, operation=operation, deadline=deadline, hedge=self.hedger.policy(operation)
+            )
             return result
         except requests.exceptions.RequestException as e:
-            raise Exception(f"GLM-4.5-Air API (营养总结) 调用失败: {str(e)}")
+            raise Exception(f"GLM-4.5-Air API ({purpose}) 调用失败: {str(e)}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"解析 GLM-4.5-Air API ({purpose}) 响应失败: {str(e)}")
+
+    def analyze_health(self, dish_list, deadline=None):
+        # 检查菜品列表是否为空
+        if not dish_list:
+            # 如果菜品列表为空，返回空的响应结构
+            return EMPTY_LIST_RESPONSE
+
+        return self._send(self._build_health_payload(dish_list), "健康分析", 'analyze_health', deadline)
+
+    def recommend_dishes(self, dish_list_with_nutrition, deadline=None):
+        # 检查菜品列表是否为空
+        if not dish_list_with_nutrition:
+            # 如果菜品列表为空，返回空的推荐列表
+            return EMPTY_LIST_RESPONSE
+
+        return self._send(self._build_recommend_payload(dish_list_with_nutrition), "推荐", 'recommend_dishes', deadline)
+
+    def generate_nutrition_summary(self, recommended_dishes, deadline=None):
+        # 检查推荐菜品列表是否为空
+        if not recommended_dishes:
+            # 如果推荐菜品列表为空，返回空的营养总结
+            return EMPTY_SUMMARY_RESPONSE
+
+        return self._send(self._build_summary_payload(recommended_dishes), "营养总结", 'generate_nutrition_summary', deadline)
+
+    def explain_recommendations(self, recommended_dishes, deadline=None):
+        # 检查推荐菜品列表是否为空
+        if not recommended_dishes:
+            return EMPTY_LIST_RESPONSE
+
+        return self._send(self._build_explain_payload(recommended_dishes), "推荐理由", 'explain_recommendations', deadline)
+
+    def analyze_menu(self, dish_list, summarize=True, deadline=None):
+        # 检查菜品列表是否为空
+        if not dish_list:
+            return EMPTY_FUSED_RESPONSE
+
+        return self._send(self._build_fused_payload(dish_list, summarize), "合并分析", 'analyze_menu', deadline)
+
+
+class AsyncGLM45AirService(GLM45AirService):
+    """
+    GLM45AirService 的 asyncio 版本，请求体构造与同步版本共用
+    """
+
+    HTTP_CLIENT_CLASS = AsyncGLMHttpClient
+
+    async def _send(self, payload, purpose, operation, deadline=None):
+        self._estimate(payload, operation)
+        try:
+            result = await self.http_client.post(
+                payload, operation=operation, deadline=deadline, hedge=self.hedger.policy(operation)
+            )
+            return result
+        except httpx.HTTPError as e:
+            raise Exception(f"GLM-4.5-Air API ({purpose}) 调用失败: {str(e)}")
         except json.JSONDecodeError as e:
-            raise Exception(f"解析 GLM-4.5-Air API (营养总结) 响应失败: {str(e)}")
\ No newline at end of file
+            raise Exception(f"解析 GLM-4.5-Air API ({purpose}) 响应失败: {str(e)}")
+
+    async def analyze_health(self, dish_list, deadline=None):
+        if not dish_list:
+            return EMPTY_LIST_RESPONSE
+
+        return await self._send(self._build_health_payload(dish_list), "健康分析", 'analyze_health', deadline)
+
+    async def recommend_dishes(self, dish_list_with_nutrition, deadline=None):
+        if not dish_list_with_nutrition:
+            return EMPTY_LIST_RESPONSE
+
+        return await self._send(self._build_recommend_payload(dish_list_with_nutrition), "推荐", 'recommend_dishes', deadline)
+
+    async def generate_nutrition_summary(self, recommended_dishes, deadline=None):
+        if not recommended_dishes:
+            return EMPTY_SUMMARY_RESPONSE
+
+        return await self._send(self._build_summary_payload(recommended_dishes), "营养总结", 'generate_nutrition_summary', deadline)
+
+    async def explain_recommendations(self, recommended_dishes, deadline=None):
+        if not recommended_dishes:
+            return EMPTY_LIST_RESPONSE
+
+        return await self._send(self._build_explain_payload(recommended_dishes), "推荐理由", 'explain_recommendations', deadline)
+
+    async def analyze_menu(self, dish_list, summarize=True, deadline=None):
+        if not dish_list:
+            return EMPTY_FUSED_RESPONSE
+
+        return await self._send(self._build_fused_payload(dish_list, summarize), "合并分析", 'analyze_menu', deadline)
@@ -0,0 +1,431 @@
+import math
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+from app.services.metrics import UPSTREAM_HEDGES
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的对数分桶：从 1ms 起每档增长 10%，最后一档约 300 秒（分位数误差不超过 10%）
+_MIN_LATENCY = 0.001
+_BUCKET_GROWTH = 1.1
+_BUCKET_COUNT = math.ceil(math.log(300 / _MIN_LATENCY, _BUCKET_GROWTH)) + 1
+
+# 对冲配额最多累积的次数：上游一段时间很快之后突然变慢，也不会一下子把所有请求都对冲
+_BUDGET_CAP = 10
+
+# 流式请求某一路正常结束的标记
+_END = object()
+
+class HedgeCancelled(Exception):
+    """
+    对冲的另一路已经返回，本路请求不再发出或重试
+    """
+
+
+def _bucket_index(seconds):
+    if seconds <= _MIN_LATENCY:
+        return 0
+    return min(_BUCKET_COUNT - 1, math.ceil(math.log(seconds / _MIN_LATENCY, _BUCKET_GROWTH)))
+
+
+def _bucket_bound(index):
+    return _MIN_LATENCY * _BUCKET_GROWTH ** index
+
+
+class LatencyHistogram:
+    """
+    滚动窗口的延迟直方图：保留当前和上一个窗口（各 window 秒），轮换时丢弃更早的数据
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._current = [0] * _BUCKET_COUNT
+        self._previous = [0] * _BUCKET_COUNT
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rotate(self, now):
+        elapsed = now - self._started
+        if elapsed < self.window:
+            return
+        # 超过两个窗口没有新数据时，上一个窗口也已过期
+        self._previous = self._current if elapsed < 2 * self.window else [0] * _BUCKET_COUNT
+        self._current = [0] * _BUCKET_COUNT
+        self._started = now
+
+    def observe(self, seconds):
+        with self._lock:
+            self._rotate(time.monotonic())
+            self._current[_bucket_index(seconds)] += 1
+
+    def count(self):
+        with self._lock:
+            self._rotate(time.monotonic())
+            return sum(self._current) + sum(self._previous)
+
+    def percentile(self, q):
+        """
+        第 q 百分位的延迟（秒，取所在分桶的上界），没有数据时返回 None
+        """
+        with self._lock:
+            self._rotate(time.monotonic())
+            counts = [a + b for a, b in zip(self._current, self._previous)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = math.ceil(total * q / 100)
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank:
+                return _bucket_bound(index)
+        return _bucket_bound(_BUCKET_COUNT - 1)
+
+
+class HedgePolicy:
+    """
+    一个上游端点（模型 + 调用名）的对冲策略
+    请求超过最近延迟的第 percentile 百分位仍未返回时，再发出一个相同的请求，取先成功的结果并取消另一个
+    每个请求积累 max_rate 次对冲配额，对冲一次消耗 1 次，长期看对冲比例不超过 max_rate
+    """
+
+    def __init__(self, model, operation, percentile=None, min_delay=None, min_samples=None, max_rate=None,
+                 window=None, executor=None):
+        self.model = model
+        self.operation = operation
+        # 同步请求使用的线程池，由所属服务的 RequestHedger 提供（线程在第一次对冲请求时才创建）
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=2 * Config.GLM_HTTP_POOL_MAXSIZE, thread_name_prefix='hedge'
+        )
+        self.percentile = percentile if percentile is not None else Config.HEDGE_PERCENTILE
+        self.min_delay = min_delay if min_delay is not None else Config.HEDGE_MIN_DELAY
+        self.min_samples = min_samples if min_samples is not None else Config.HEDGE_MIN_SAMPLES
+        self.max_rate = max_rate if max_rate is not None else Config.HEDGE_MAX_RATE
+        self.latency = LatencyHistogram(window if window is not None else Config.HEDGE_WINDOW)
+        self._budget = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+        self.capped = 0
+
+    def delay(self):
+        """
+        发出对冲请求前的等待时间（秒）；样本不足时返回 None（不对冲）
+        """
+        if self.latency.count() < self.min_samples:
+            return None
+        return max(self.latency.percentile(self.percentile), self.min_delay)
+
+    def _start(self):
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self._budget + self.max_rate, _BUDGET_CAP)
+        return self.delay()
+
+    def _try_hedge(self):
+        with self._lock:
+            if self._budget < 1:
+                self.capped += 1
+                outcome = 'capped'
+            else:
+                self._budget -= 1
+                self.hedged += 1
+                outcome = 'fired'
+        UPSTREAM_HEDGES.inc(model=self.model, operation=self.operation, outcome=outcome)
+        return outcome == 'fired'
+
+    def _record_win(self):
+        with self._lock:
+            self.won += 1
+        UPSTREAM_HEDGES.inc(model=self.model, operation=self.operation, outcome='won')
+
+    def _timed(self, attempt, *args):
+        # 每一路请求各自计时，只记录成功返回的延迟
+        start = time.perf_counter()
+        result = attempt(*args)
+        self.latency.observe(time.perf_counter() - start)
+        return result
+
+    def call(self, attempt):
+        """
+        执行一次可对冲的请求，attempt(cancelled) 发出请求并返回结果
+        cancelled 为 threading.Event，另一路先返回后被置位（同步请求无法中断，只能阻止其继续重试）
+        """
+        delay = self._start()
+        if delay is None:
+            return self._timed(attempt, None)
+
+        executor = self.executor
+        cancelled = threading.Event()
+        primary = executor.submit(self._timed, attempt, cancelled)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._try_hedge():
+            return primary.result()
+
+        logger.info(f"Hedging {self.operation} after {delay:.2f}s")
+        hedge = executor.submit(self._timed, attempt, cancelled)
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            self._record_win()
+                        return future.result()
+            # 两路都失败时抛出原请求的错误
+            return primary.result()
+        finally:
+            cancelled.set()
+
+    async def acall(self, attempt):
+        """
+        call 的 asyncio 版本，attempt() 返回发出请求的协程；落后的一路直接取消
+        """
+        delay = self._start()
+        if delay is None:
+            return await self._atimed(attempt)
+
+        primary = asyncio.ensure_future(self._atimed(attempt))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._try_hedge():
+                return await primary
+
+            logger.info(f"Hedging {self.operation} after {delay:.2f}s")
+            hedge = asyncio.ensure_future(self._atimed(attempt))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._record_win()
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _atimed(self, attempt):
+        start = time.perf_counter()
+        result = await attempt()
+        self.latency.observe(time.perf_counter() - start)
+        return result
+
+    def stream(self, attempt):
+        """
+        可对冲的流式请求，attempt() 返回产出文本增量的迭代器
+        按首个数据块的等待时间对冲：先产出数据的一路胜出，另一路停止读取并关闭响应
+        """
+        delay = self._start()
+        if delay is None:
+            yield from self._first_timed(attempt())
+            return
+
+        executor = self.executor
+        results = queue.Queue()
+        cancelled = {'primary': threading.Event()}
+        executor.submit(self._pump, attempt, 'primary', cancelled['primary'], results)
+        alive = {'primary'}
+        errors = []
+        winner = None
+        deadline = time.monotonic() + delay
+        try:
+            while True:
+                # 还没决定是否对冲时，最多等到对冲时间点
+                timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                try:
+                    leg, item, error = results.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = None
+                    if self._try_hedge():
+                        logger.info(f"Hedging {self.operation} after {delay:.2f}s without output")
+                        cancelled['hedge'] = threading.Event()
+                        executor.submit(self._pump, attempt, 'hedge', cancelled['hedge'], results)
+                        alive.add('hedge')
+                    continue
+
+                if winner is None:
+                    if error is not None:
+                        # 一路在产出数据前失败，另一路仍可能成功
+                        alive.discard(leg)
+                        errors.append(error)
+                        if not alive:
+                            raise errors[0]
+                        continue
+                    winner = leg
+                    deadline = None
+                    for name, event in cancelled.items():
+                        if name != winner:
+                            event.set()
+                    if winner == 'hedge':
+                        self._record_win()
+                if leg != winner:
+                    continue
+                if error is not None:
+                    raise error
+                if item is _END:
+                    return
+                yield item
+        finally:
+            for event in cancelled.values():
+                event.set()
+
+    def _pump(self, attempt, leg, cancelled, results):
+        iterator = self._first_timed(attempt())
+        try:
+            for item in iterator:
+                if cancelled.is_set():
+                    return
+                results.put((leg, item, None))
+            results.put((leg, _END, None))
+        except Exception as e:
+            results.put((leg, None, e))
+        finally:
+            # 关闭生成器时一并关闭上游响应
+            iterator.close()
+
+    def _first_timed(self, iterator):
+        # 流式请求按首个数据块的等待时间统计延迟
+        start = time.perf_counter()
+        first = True
+        try:
+            for item in iterator:
+                if first:
+                    self.latency.observe(time.perf_counter() - start)
+                    first = False
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    async def astream(self, attempt):
+        """
+        stream 的 asyncio 版本，attempt() 返回异步迭代器；落后的一路直接取消
+        """
+        delay = self._start()
+        if delay is None:
+            async for item in self._afirst_timed(attempt()):
+                yield item
+            return
+
+        results = asyncio.Queue()
+        tasks = {'primary': asyncio.ensure_future(self._apump(attempt, 'primary', results))}
+        errors = []
+        winner = None
+        hedge_at = time.monotonic() + delay
+        try:
+            while True:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                try:
+                    leg, item, error = await asyncio.wait_for(results.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedge_at = None
+                    if self._try_hedge():
+                        logger.info(f"Hedging {self.operation} after {delay:.2f}s without output")
+                        tasks['hedge'] = asyncio.ensure_future(self._apump(attempt, 'hedge', results))
+                    continue
+
+                if winner is None:
+                    if error is not None:
+                        errors.append(error)
+                        if len(errors) == len(tasks):
+                            raise errors[0]
+                        continue
+                    winner = leg
+                    hedge_at = None
+                    for name, task in tasks.items():
+                        if name != winner:
+                            task.cancel()
+                    if winner == 'hedge':
+                        self._record_win()
+                if leg != winner:
+                    continue
+                if error is not None:
+                    raise error
+                if item is _END:
+                    return
+                yield item
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+    async def _apump(self, attempt, leg, results):
+        try:
+            async for item in self._afirst_timed(attempt()):
+                await results.put((leg, item, None))
+            await results.put((leg, _END, None))
+        except Exception as e:
+            await results.put((leg, None, e))
+
+    async def _afirst_timed(self, iterator):
+        start = time.perf_counter()
+        first = True
+        async for item in iterator:
+            if first:
+                self.latency.observe(time.perf_counter() - start)
+                first = False
+            yield item
+
+    def stats(self):
+        delay = self.delay()
+        with self._lock:
+            return {
+                'model': self.model,
+                'operation': self.operation,
+                'samples': self.latency.count(),
+                'hedgeDelay': round(delay, 3) if delay is not None else None,
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'won': self.won,
+                'capped': self.capped,
+            }
+
+
+class RequestHedger:
+    """
+    一个 GLM 服务的对冲策略集合：每个调用名（端点）各自维护延迟直方图和对冲配额
+    未开启对冲或调用名不在 HEDGE_OPERATIONS 中时返回 None
+    """
+
+    def __init__(self, model, enabled=None, operations=None, max_workers=None):
+        self.model = model
+        self.enabled = Config.HEDGE_ENABLED if enabled is None else enabled
+        if operations is None:
+            operations = [name.strip() for name in Config.HEDGE_OPERATIONS.split(',') if name.strip()]
+        self.operations = frozenset(operations)
+        self._policies = {}
+        self._lock = threading.Lock()
+        # 每个服务各用一个线程池：对冲中的同步请求原请求和对冲请求各占一个线程，
+        # 共用一个线程池时一个服务的慢请求会让其他服务的原请求排队等线程
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or 2 * Config.GLM_HTTP_POOL_MAXSIZE, thread_name_prefix=f'hedge-{model}'
+        )
+
+    def policy(self, operation, stream=False):
+        """
+        调用名对应的对冲策略；流式请求按首个数据块计时，与非流式请求分开统计
+        """
+        if not self.enabled or operation not in self.operations:
+            return None
+        name = f"{operation}:stream" if stream else operation
+        policy = self._policies.get(name)
+        if policy is None:
+            with self._lock:
+                policy = self._policies.setdefault(name, HedgePolicy(self.model, name, executor=self.executor))
+        return policy
+
+    def stats(self):
+        return [policy.stats() for policy in list(self._policies.values())]
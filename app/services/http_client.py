@@ -0,0 +1,520 @@
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+import requests
+from contextlib import contextmanager, nullcontext
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+from app.services.single_flight import request_fingerprint, get_single_flight, get_async_single_flight
+from app.services.rate_limiter import (
+    get_rate_limiter, get_async_rate_limiter, parse_retry_after, UpstreamOverloadedError,
+)
+from app.services.deadline import DeadlineExceeded
+from app.services.hedging import HedgeCancelled
+from app.services.metrics import (
+    UPSTREAM_DURATION, UPSTREAM_REQUEST_BYTES, UPSTREAM_RESPONSE_BYTES, record_usage,
+)
+
+# httpx 仅在异步（ASGI）入口下需要
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 进程内共享的 Session，所有 GLM 服务复用同一组 keep-alive 连接池
+_shared_session = None
+_session_lock = threading.Lock()
+
+# 可安全重放的上游状态码（429 由限流器处理）
+RETRY_STATUS = (502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """
+    在 urllib3 指数退避的基础上叠加随机抖动，避免并发请求同时重试
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, Config.GLM_HTTP_BACKOFF_JITTER)
+
+
+def _backoff_seconds(attempt):
+    """
+    第 attempt 次重试前的等待时间（指数退避 + 随机抖动）
+    """
+    return Config.GLM_HTTP_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, Config.GLM_HTTP_BACKOFF_JITTER)
+
+
+def _retry_delay(attempt, deadline):
+    """
+    502-504 重试前的等待时间，不超过请求的剩余预算（用完后下一轮的检查会抛出 DeadlineExceeded）
+    """
+    delay = _backoff_seconds(attempt)
+    return delay if deadline is None else min(delay, deadline.remaining())
+
+
+def _throttle_delay(response, attempt):
+    """
+    429 后的等待时间：优先使用上游给出的 Retry-After
+    """
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    return retry_after if retry_after is not None else _backoff_seconds(attempt)
+
+
+def _throttled_error(call, delay):
+    """
+    429 重试次数用完：按上游繁忙处理，路由返回 503 和 Retry-After，而不是 500
+    """
+    retry_after = max(1, math.ceil(delay))
+    return UpstreamOverloadedError(f"上游持续限流（{call.model}），请 {retry_after} 秒后重试", retry_after)
+
+
+def _check_deadline(deadline, operation):
+    if deadline is not None:
+        deadline.check(operation)
+
+
+def _deadline_error(deadline, error):
+    """
+    上游请求出错时预算恰好用完，说明是被截短的超时触发的，改为抛出 DeadlineExceeded
+    """
+    if deadline is not None and deadline.expired(slack=0.05):
+        return DeadlineExceeded(f"等待上游响应时超出请求时限: {error}")
+    return None
+
+
+def _check_cancelled(cancelled):
+    # 对冲的另一路已经返回：不再发出请求或重试
+    if cancelled is not None and cancelled.is_set():
+        raise HedgeCancelled("对冲的另一路请求已返回")
+
+
+def _build_retry():
+    # urllib3 只重试建立连接失败（请求还没有发出，每次连接超时都受请求预算限制）。
+    # 读超时不重试，避免一个卡住的上游把等待时间成倍放大。
+    # 502-504 由 GLMHttpClient 逐次检查请求预算后重试，不在 urllib3 内部按 Retry-After 长时间等待；
+    # 429 由限流器按 Retry-After 统一暂停该模型的所有请求。
+    return JitteredRetry(
+        total=Config.GLM_HTTP_MAX_RETRIES,
+        connect=Config.GLM_HTTP_MAX_RETRIES,
+        read=0,
+        status=0,
+        # chat/completions 没有副作用，POST 重放是安全的
+        allowed_methods=frozenset(['POST']),
+        backoff_factor=Config.GLM_HTTP_BACKOFF_FACTOR,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+
+
+def get_shared_session():
+    """
+    获取进程内共享的 requests.Session（懒加载，线程安全）
+    """
+    global _shared_session
+    if _shared_session is None:
+        with _session_lock:
+            if _shared_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=Config.GLM_HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=Config.GLM_HTTP_POOL_MAXSIZE,
+                    max_retries=_build_retry(),
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _shared_session = session
+    return _shared_session
+
+
+class GLMHttpClient:
+    """
+    GLM chat/completions 的共享传输层
+    每个 API 密钥对应一个客户端实例，请求头只构建一次，底层连接池全局共享
+    """
+
+    def __init__(self, api_key, base_url=None, connect_timeout=None, read_timeout=None):
+        self.base_url = base_url or Config.API_BASE_URL
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else Config.GLM_HTTP_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else Config.GLM_HTTP_READ_TIMEOUT,
+        )
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.api_key = api_key
+        self.session = get_shared_session()
+        self.single_flight = get_single_flight()
+
+    def post(self, payload, timeout=None, operation='chat', deadline=None, hedge=None):
+        """
+        发送 chat/completions 请求并返回解析后的 JSON
+        出错时抛出 requests.exceptions.RequestException 或 json.JSONDecodeError，由调用方包装
+        operation 为指标中的调用名称（如 analyze_health）
+        deadline 为请求的 Deadline：超时不超过剩余预算，预算用完时抛出 DeadlineExceeded
+        hedge 为该端点的 HedgePolicy：响应较慢时再发一个相同请求，取先返回的
+        """
+        body = json.dumps(payload)
+        call = _UpstreamCall(payload.get('model'), operation, get_rate_limiter(payload.get('model'), self.api_key))
+        if hedge is None:
+            send = lambda: self._post(body, call, timeout, deadline)
+        else:
+            send = lambda: hedge.call(lambda cancelled: self._post(body, call, timeout, deadline, cancelled))
+        if self.single_flight is None:
+            return send()
+        # 同时在途的相同请求只发出一次（被合并的请求不占用限流配额）
+        key = request_fingerprint(self.base_url, body)
+        return self.single_flight.do(key, send, deadline)
+
+    def _timeout(self, timeout, deadline):
+        connect, read = timeout or self.timeout
+        if deadline is None:
+            return connect, read
+        return deadline.bound(connect), deadline.bound(read)
+
+    def _post(self, body, call, timeout=None, deadline=None, cancelled=None):
+        with call.timer(body):
+            response = self._send(body, call, timeout, deadline, cancelled)
+            call.record_response(len(response.content))
+            result = response.json()
+            record_usage(call.model, call.operation, result.get('usage'))
+            return result
+
+    def _send(self, body, call, timeout=None, deadline=None, cancelled=None):
+        limiter = call.limiter
+        attempt = 0
+        while True:
+            _check_deadline(deadline, call.operation)
+            _check_cancelled(cancelled)
+            try:
+                with _slot(limiter, deadline):
+                    response = self.session.post(
+                        self.base_url,
+                        headers=self.headers,
+                        data=body,
+                        timeout=self._timeout(timeout, deadline),
+                    )
+            except requests.exceptions.RequestException as e:
+                error = _deadline_error(deadline, e)
+                if error is not None:
+                    raise error from e
+                raise
+            if response.status_code == 429:
+                self._throttled(call, response, attempt)
+                attempt += 1
+                continue
+            if response.status_code in RETRY_STATUS and attempt < Config.GLM_HTTP_MAX_RETRIES:
+                time.sleep(_retry_delay(attempt, deadline))
+                attempt += 1
+                continue
+            response.raise_for_status()
+            if limiter is not None:
+                limiter.record_success()
+            return response
+
+    @staticmethod
+    def _throttled(call, response, attempt):
+        """
+        处理 429：限流器暂停该模型的请求（没有限流器时直接等待）
+        重试次数用完时抛出 UpstreamOverloadedError
+        """
+        delay = _throttle_delay(response, attempt)
+        if call.limiter is not None:
+            call.limiter.penalize(delay)
+        if attempt >= Config.GLM_HTTP_MAX_RETRIES:
+            raise _throttled_error(call, delay)
+        if call.limiter is None:
+            time.sleep(delay)
+
+    def stream(self, payload, timeout=None, operation='chat', deadline=None, hedge=None):
+        """
+        以流式（stream: true）发送请求，逐段产出模型输出的文本增量
+        hedge 为按首个数据块计时的 HedgePolicy
+        """
+        body = json.dumps(dict(payload, stream=True))
+        call = _UpstreamCall(payload.get('model'), operation, get_rate_limiter(payload.get('model'), self.api_key))
+        if hedge is None:
+            send = lambda: self._stream(body, call, timeout, deadline)
+        else:
+            send = lambda: hedge.stream(lambda: self._stream(body, call, timeout, deadline))
+        if self.single_flight is None:
+            return send()
+        key = request_fingerprint(self.base_url, body)
+        return self.single_flight.stream(key, send, deadline)
+
+    def _stream(self, body, call, timeout=None, deadline=None):
+        try:
+            yield from self._stream_once(body, call, timeout, deadline)
+        except requests.exceptions.RequestException as e:
+            error = _deadline_error(deadline, e)
+            if error is not None:
+                raise error from e
+            raise
+
+    def _stream_once(self, body, call, timeout=None, deadline=None):
+        limiter = call.limiter
+        attempt = 0
+        with call.timer(body):
+            while True:
+                _check_deadline(deadline, call.operation)
+                # 上游按在途的生成计算并发，流式请求占用并发名额直到输出读完或被关闭
+                with _slot(limiter, deadline), self.session.post(
+                    self.base_url,
+                    headers=self.headers,
+                    data=body,
+                    timeout=self._timeout(timeout, deadline),
+                    stream=True,
+                ) as response:
+                    # 还没有产出任何内容，429 和 502-504 可以安全重试
+                    if response.status_code == 429:
+                        self._throttled(call, response, attempt)
+                        attempt += 1
+                        continue
+                    if response.status_code in RETRY_STATUS and attempt < Config.GLM_HTTP_MAX_RETRIES:
+                        time.sleep(_retry_delay(attempt, deadline))
+                        attempt += 1
+                        continue
+                    response.raise_for_status()
+                    if limiter is not None:
+                        limiter.record_success()
+                    # 按字节读取整行后再解码，避免 SSE 响应未声明字符集时中文被错误解码
+                    for line in response.iter_lines():
+                        # 读超时只限制相邻两段的间隔，整体输出时长在这里按预算截断
+                        _check_deadline(deadline, call.operation)
+                        call.record_response(len(line) + 1)
+                        chunk = _parse_stream_line(line.decode('utf-8'))
+                        if chunk is None:
+                            break
+                        delta = call.handle_chunk(chunk)
+                        if delta:
+                            yield delta
+                    return
+
+
+def _slot(limiter, deadline=None):
+    # 同步/异步限流器的 slot() 分别用于 with / async with，nullcontext 两者都支持
+    return limiter.slot(deadline) if limiter is not None else nullcontext()
+
+
+def _parse_stream_line(line):
+    """
+    解析一行 SSE 数据，返回该数据块（非数据行返回空字典）；遇到 [DONE] 时返回 None
+    """
+    if not line or not line.startswith('data:'):
+        return {}
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return None
+    return json.loads(data)
+
+
+class _UpstreamCall:
+    """
+    一次上游调用的限流器和指标记录（耗时、收发字节数、token 用量）
+    """
+
+    def __init__(self, model, operation, limiter):
+        self.model = model
+        self.operation = operation
+        self.limiter = limiter
+
+    @contextmanager
+    def timer(self, body):
+        UPSTREAM_REQUEST_BYTES.inc(len(body), model=self.model, operation=self.operation)
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            UPSTREAM_DURATION.observe(
+                time.perf_counter() - start, model=self.model, operation=self.operation, outcome=outcome
+            )
+
+    def record_response(self, size):
+        UPSTREAM_RESPONSE_BYTES.inc(size, model=self.model, operation=self.operation)
+
+    def handle_chunk(self, chunk):
+        """
+        记录流式数据块中的 usage（通常在最后一块），返回其中的文本增量
+        """
+        record_usage(self.model, self.operation, chunk.get('usage'))
+        choices = chunk.get('choices') or [{}]
+        return choices[0].get('delta', {}).get('content') or ''
+
+
+class AsyncGLMHttpClient:
+    """
+    GLMHttpClient 的 asyncio 版本，基于 httpx.AsyncClient
+    连接池、超时和重试策略与同步客户端保持一致
+    """
+
+    def __init__(self, api_key, base_url=None, connect_timeout=None, read_timeout=None):
+        if httpx is None:
+            raise ImportError("httpx is required for the async GLM services")
+
+        self.base_url = base_url or Config.API_BASE_URL
+        self.timeout = httpx.Timeout(
+            read_timeout if read_timeout is not None else Config.GLM_HTTP_READ_TIMEOUT,
+            connect=connect_timeout if connect_timeout is not None else Config.GLM_HTTP_CONNECT_TIMEOUT,
+        )
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=Config.GLM_HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=Config.GLM_HTTP_POOL_MAXSIZE,
+            ),
+        )
+        self.api_key = api_key
+        self.single_flight = get_async_single_flight()
+
+    async def post(self, payload, timeout=None, operation='chat', deadline=None, hedge=None):
+        """
+        发送 chat/completions 请求并返回解析后的 JSON
+        出错时抛出 httpx.HTTPError 或 json.JSONDecodeError，由调用方包装
+        """
+        body = json.dumps(payload)
+        call = _UpstreamCall(payload.get('model'), operation, get_async_rate_limiter(payload.get('model'), self.api_key))
+        if hedge is None:
+            send = lambda: self._post(body, call, timeout, deadline)
+        else:
+            # 落后的一路会被直接取消（连同其 HTTP 请求）
+            send = lambda: hedge.acall(lambda: self._post(body, call, timeout, deadline))
+        if self.single_flight is None:
+            return await send()
+        key = request_fingerprint(self.base_url, body)
+        return await self.single_flight.do(key, send, deadline)
+
+    def _timeout(self, timeout, deadline):
+        timeout = timeout or self.timeout
+        if deadline is None:
+            return timeout
+        return httpx.Timeout(deadline.bound(timeout.read), connect=deadline.bound(timeout.connect))
+
+    async def _post(self, body, call, timeout=None, deadline=None):
+        with call.timer(body):
+            response = await self._send(body, call, timeout, deadline)
+            call.record_response(len(response.content))
+            result = response.json()
+            record_usage(call.model, call.operation, result.get('usage'))
+            return result
+
+    async def _send(self, body, call, timeout=None, deadline=None):
+        limiter = call.limiter
+        attempt = 0
+        while True:
+            _check_deadline(deadline, call.operation)
+            try:
+                async with _slot(limiter, deadline):
+                    response = await self.client.post(
+                        self.base_url, content=body, timeout=self._timeout(timeout, deadline)
+                    )
+            except httpx.HTTPError as e:
+                error = _deadline_error(deadline, e)
+                if error is not None:
+                    raise error from e
+                if not isinstance(e, httpx.ConnectError) or attempt >= Config.GLM_HTTP_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_retry_delay(attempt, deadline))
+            else:
+                if response.status_code == 429:
+                    await self._throttled(call, response, attempt)
+                elif response.status_code in RETRY_STATUS and attempt < Config.GLM_HTTP_MAX_RETRIES:
+                    await asyncio.sleep(_retry_delay(attempt, deadline))
+                else:
+                    response.raise_for_status()
+                    if limiter is not None:
+                        limiter.record_success()
+                    return response
+            attempt += 1
+
+    @staticmethod
+    async def _throttled(call, response, attempt):
+        delay = _throttle_delay(response, attempt)
+        if call.limiter is not None:
+            call.limiter.penalize(delay)
+        if attempt >= Config.GLM_HTTP_MAX_RETRIES:
+            raise _throttled_error(call, delay)
+        if call.limiter is None:
+            await asyncio.sleep(delay)
+
+    async def stream(self, payload, timeout=None, operation='chat', deadline=None, hedge=None):
+        """
+        以流式（stream: true）发送请求，逐段产出模型输出的文本增量
+        """
+        body = json.dumps(dict(payload, stream=True))
+        call = _UpstreamCall(payload.get('model'), operation, get_async_rate_limiter(payload.get('model'), self.api_key))
+        if hedge is None:
+            send = lambda: self._stream(body, call, timeout, deadline)
+        else:
+            send = lambda: hedge.astream(lambda: self._stream(body, call, timeout, deadline))
+        if self.single_flight is None:
+            chunks = send()
+        else:
+            key = request_fingerprint(self.base_url, body)
+            chunks = self.single_flight.stream(key, send, deadline)
+        async for delta in chunks:
+            yield delta
+
+    async def _stream(self, body, call, timeout=None, deadline=None):
+        try:
+            async for delta in self._stream_once(body, call, timeout, deadline):
+                yield delta
+        except httpx.HTTPError as e:
+            error = _deadline_error(deadline, e)
+            if error is not None:
+                raise error from e
+            raise
+
+    async def _stream_once(self, body, call, timeout=None, deadline=None):
+        limiter = call.limiter
+        attempt = 0
+        with call.timer(body):
+            while True:
+                _check_deadline(deadline, call.operation)
+                async with _slot(limiter, deadline), self.client.stream(
+                    'POST', self.base_url, content=body, timeout=self._timeout(timeout, deadline)
+                ) as response:
+                    if response.status_code == 429:
+                        await self._throttled(call, response, attempt)
+                        attempt += 1
+                        continue
+                    if response.status_code in RETRY_STATUS and attempt < Config.GLM_HTTP_MAX_RETRIES:
+                        await asyncio.sleep(_retry_delay(attempt, deadline))
+                        attempt += 1
+                        continue
+                    response.raise_for_status()
+                    if limiter is not None:
+                        limiter.record_success()
+                    async for line in response.aiter_lines():
+                        _check_deadline(deadline, call.operation)
+                        call.record_response(len(line.encode('utf-8')) + 1)
+                        chunk = _parse_stream_line(line)
+                        if chunk is None:
+                            break
+                        delta = call.handle_chunk(chunk)
+                        if delta:
+                            yield delta
+                    return
+
+    async def aclose(self):
+        await self.client.aclose()
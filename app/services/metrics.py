@@ -0,0 +1,236 @@
+import time
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from config import Config
+
+# 进程内的轻量指标注册表，以 Prometheus 文本格式在 /metrics 输出
+# 不依赖 prometheus_client；多进程部署时每个进程各自暴露自己的指标
+
+# 默认的耗时分桶（秒），覆盖本地计算到大模型长输出
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not Config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_items(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        if not Config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_items(self, items):
+        lines = []
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'menu_ocr_stage_duration_seconds',
+    'Duration of each processing stage.',
+    ('stage', 'component', 'outcome'),
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    'menu_ocr_upstream_duration_seconds',
+    'Duration of GLM chat/completions calls (including retries and rate-limit waits).',
+    ('model', 'operation', 'outcome'),
+))
+UPSTREAM_REQUEST_BYTES = REGISTRY.register(Counter(
+    'menu_ocr_upstream_request_bytes_total',
+    'Request body bytes sent to GLM.',
+    ('model', 'operation'),
+))
+UPSTREAM_RESPONSE_BYTES = REGISTRY.register(Counter(
+    'menu_ocr_upstream_response_bytes_total',
+    'Response body bytes received from GLM.',
+    ('model', 'operation'),
+))
+UPSTREAM_TOKENS = REGISTRY.register(Counter(
+    'menu_ocr_upstream_tokens_total',
+    'Token usage reported by GLM.',
+    ('model', 'operation', 'type'),
+))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+    'menu_ocr_upstream_hedges_total',
+    'Hedged GLM calls: hedges fired, hedges that answered first, and hedges skipped by the rate cap.',
+    ('model', 'operation', 'outcome'),
+))
+PARSE_FAILURES = REGISTRY.register(Counter(
+    'menu_ocr_parse_failures_total',
+    'LLM outputs that contained no usable JSON.',
+    ('stage',),
+))
+PROMPT_TOKENS_ESTIMATED = REGISTRY.register(Counter(
+    'menu_ocr_prompt_tokens_estimated_total',
+    'Prompt tokens estimated before sending, for comparison with reported usage.',
+    ('model', 'operation'),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'menu_ocr_cache_lookups_total',
+    'Stage cache and dish store lookups by outcome.',
+    ('cache', 'component', 'outcome'),
+))
+
+
+def record_usage(model, operation, usage):
+    """
+    记录 GLM 响应中的 usage（prompt_tokens / completion_tokens）
+    """
+    if not isinstance(usage, dict):
+        return
+    for token_type in ('prompt_tokens', 'completion_tokens'):
+        if isinstance(usage.get(token_type), (int, float)):
+            UPSTREAM_TOKENS.inc(usage[token_type], model=model, operation=operation, type=token_type.split('_')[0])
+
+
+@contextmanager
+def stage_timer(stage, component):
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except GeneratorExit:
+        # 调用方提前停止迭代（如客户端断开）
+        outcome = 'cancelled'
+        raise
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage, component=component, outcome=outcome)
+
+
+def timed_stage(stage):
+    """
+    业务方法的耗时装饰器，component 取实例的类名
+    支持普通函数、协程以及（异步）生成器（从开始迭代计时到迭代结束）
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(self, *args, **kwargs):
+                with stage_timer(stage, type(self).__name__):
+                    async for item in func(self, *args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                with stage_timer(stage, type(self).__name__):
+                    return await func(self, *args, **kwargs)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(self, *args, **kwargs):
+                with stage_timer(stage, type(self).__name__):
+                    yield from func(self, *args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with stage_timer(stage, type(self).__name__):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    return REGISTRY.render()
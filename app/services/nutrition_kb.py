@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import logging
+import functools
+import threading
+import unicodedata
+from collections import defaultdict
+from config import Config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 随代码发布的常见菜品营养数据
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'dish_nutrition.json')
+
+NUTRITION_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+
+# 括号中的份量/备注，如 "宫保鸡丁（小份）"、"水饺(12只)"
+_NOTE_RE = re.compile(r'[（(【\[][^）)】\]]*[）)】\]]')
+# 归一化时去掉的空白和标点（含全角）
+_NOISE_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+# 菜单上常见的修饰前缀，去掉后才是菜名本身
+_PREFIXES = ('招牌', '特色', '秘制', '私房', '精品', '特价', '经典', '推荐')
+
+# 菜单上常见的繁体/异体字，归一化为简体
+_VARIANTS = str.maketrans('雞鷄魚麵飯湯燒蝦絲醬燉豬鴨滷乾鍋涼腸餃雜蔥薑蘿蔔筍鹹',
+                          '鸡鸡鱼面饭汤烧虾丝酱炖猪鸭卤干锅凉肠饺杂葱姜萝卜笋咸')
+# 同音或字形相近、识别/书写时常被混用的字（"宫爆鸡丁"、"麻婆豆付"），替换代价按 0.25 计
+_CONFUSABLE = frozenset(
+    frozenset(pair) for pair in ('保爆', '付腐', '旦蛋', '沙砂', '伴拌', '扣叩', '焖闷', '烩会', '炝呛')
+)
+_CONFUSABLE_COST = 0.25
+# 其余字不允许直接替换，只能删一个再插一个（代价 2）："土鸡丝"与"土豆丝"只差一个字，却是两道菜
+_SUBSTITUTION_COST = 2
+# 短菜名一个字就能决定是哪道菜：较短的菜名不超过这个长度时，加权编辑距离最多为 1
+_SHORT_NAME_LEN = 5
+_SHORT_NAME_MAX_DISTANCE = 1
+
+# 每次查询做编辑距离比较的候选数上限（按共享的二元组数量取前几名）
+_MAX_CANDIDATES = 8
+
+
+def _substitution_cost(char_a, char_b):
+    if char_a == char_b:
+        return 0
+    return _CONFUSABLE_COST if frozenset((char_a, char_b)) in _CONFUSABLE else _SUBSTITUTION_COST
+
+
+def _edit_distance(a, b):
+    """
+    加权的 Levenshtein 距离：只有易混字可以低代价替换，其余字的差异按删除加插入计算（菜名很短，直接动态规划）
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + _substitution_cost(char_a, char_b)))
+        previous = current
+    return previous[-1]
+
+
+def _grams(key):
+    # 首尾补位的二元组，首字和末字也能参与候选召回
+    padded = f"^{key}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class NutritionKnowledgeBase:
+    """
+    本地菜品营养知识库：内置常见菜品，可通过 NUTRITION_KB_PATHS 追加/覆盖
+    按归一化菜名精确匹配，失败时用二元组倒排索引召回候选、再按编辑距离计算相似度作为置信度
+    """
+
+    def __init__(self, paths=None, min_confidence=None):
+        self.min_confidence = Config.NUTRITION_KB_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.entries = []
+        # 归一化菜名（含别名）-> 条目下标
+        self._exact = {}
+        self._keys = []
+        self._gram_index = defaultdict(list)
+
+        if paths is None:
+            paths = [BUNDLED_PATH] + [path for path in Config.NUTRITION_KB_PATHS.split(os.pathsep) if path]
+        for path in paths:
+            self._load(path)
+        for key, index in self._exact.items():
+            key_id = len(self._keys)
+            self._keys.append((key, index))
+            for gram in _grams(key):
+                self._gram_index[gram].append(key_id)
+
+        # 同一菜名在各个请求中反复出现，缓存匹配结果
+        self._match = functools.lru_cache(maxsize=4096)(self._match_uncached)
+
+    @staticmethod
+    def normalize(name):
+        """
+        归一化菜名：全角转半角、繁体转简体、统一大小写、去掉括号备注、空白标点和修饰前缀
+        """
+        text = unicodedata.normalize('NFKC', str(name or '')).lower().translate(_VARIANTS)
+        text = _NOISE_RE.sub('', _NOTE_RE.sub('', text))
+        for prefix in _PREFIXES:
+            if text.startswith(prefix) and len(text) - len(prefix) >= 2:
+                text = text[len(prefix):]
+                break
+        return text
+
+    def _load(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load nutrition knowledge base {path}: {e}")
+            return
+        loaded = 0
+        for item in data.get('dishes', []) if isinstance(data, dict) else []:
+            if not isinstance(item, dict) or not item.get('name'):
+                continue
+            try:
+                nutrition = {field: float(item[field]) for field in NUTRITION_FIELDS}
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping knowledge base entry without complete nutrition: {item.get('name')}")
+                continue
+            index = len(self.entries)
+            self.entries.append({'name': item['name'], **nutrition})
+            # 后加载的文件覆盖同名条目
+            for name in [item['name'], *item.get('aliases', [])]:
+                key = self.normalize(name)
+                if key:
+                    self._exact[key] = index
+            loaded += 1
+        logger.info(f"Loaded {loaded} dishes from nutrition knowledge base {path}")
+
+    def lookup(self, name):
+        """
+        查询菜名，返回 (条目, 置信度)；没有足够相似的菜品时返回 None
+        """
+        key = self.normalize(name)
+        if not key:
+            return None
+        return self._match(key)
+
+    def _match_uncached(self, key):
+        index = self._exact.get(key)
+        if index is not None:
+            return self.entries[index], 1.0
+
+        # 共享二元组最多的候选
+        shared = defaultdict(int)
+        for gram in _grams(key):
+            for key_id in self._gram_index.get(gram, ()):
+                shared[key_id] += 1
+        candidates = sorted(shared, key=shared.get, reverse=True)[:_MAX_CANDIDATES]
+
+        best = None
+        best_score = 0.0
+        for key_id in candidates:
+            candidate, index = self._keys[key_id]
+            # 菜名末字通常是主料或形态（肉、鱼、蛋、面），末字不同不视为同一道菜
+            if _substitution_cost(candidate[-1], key[-1]) == _SUBSTITUTION_COST:
+                continue
+            distance = _edit_distance(key, candidate)
+            if min(len(key), len(candidate)) <= _SHORT_NAME_LEN and distance > _SHORT_NAME_MAX_DISTANCE:
+                continue
+            score = 1 - distance / max(len(key), len(candidate))
+            if score > best_score:
+                best, best_score = index, score
+        if best is None or best_score < self.min_confidence:
+            return None
+        return self.entries[best], round(best_score, 2)
+
+    def get_many(self, dish_list):
+        """
+        批量查询，返回 {菜品下标: 营养信息}，营养信息附带来源和置信度
+        """
+        known = {}
+        for i, dish in enumerate(dish_list):
+            match = self.lookup(dish.name)
+            if match is None:
+                continue
+            entry, confidence = match
+            if confidence < 1.0:
+                print(f"营养知识库模糊匹配：{dish.name} -> {entry['name']}（置信度 {confidence}）")
+            known[i] = {
+                **{field: entry[field] for field in NUTRITION_FIELDS},
+                'nutritionSource': 'knowledge_base',
+                'nutritionConfidence': confidence,
+            }
+        return known
+
+
+_nutrition_kb = None
+_nutrition_kb_lock = threading.Lock()
+
+
+def get_nutrition_kb():
+    """
+    获取进程内共享的营养知识库，配置关闭时返回 None
+    """
+    global _nutrition_kb
+    if not Config.NUTRITION_KB_ENABLED:
+        return None
+    if _nutrition_kb is None:
+        with _nutrition_kb_lock:
+            if _nutrition_kb is None:
+                _nutrition_kb = NutritionKnowledgeBase()
+    return _nutrition_kb
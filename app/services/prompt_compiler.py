@@ -0,0 +1,107 @@
+import re
+import math
+import logging
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 紧凑的提示词构造：菜品以短编号 + 表格行发送，大模型只需返回编号，完整记录在本地还原
+
+# 中日韩字符及全角符号（GLM 分词器中大致一个字符一个 token）
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 其余字符（英文、数字、标点、空白）平均约 3.5 个字符一个 token
+_CHARS_PER_TOKEN = 3.5
+# 每条消息的角色、分隔符等固定开销
+_MESSAGE_OVERHEAD = 4
+
+_ID_RE = re.compile(r'^\s*d?(\d+)\s*$', re.IGNORECASE)
+# 表格单元格中会破坏行/列结构的字符
+_CELL_NOISE_RE = re.compile(r'[|\r\n]+')
+
+# 营养表的列：表头和取值的属性名
+NUTRITION_COLUMNS = (
+    ('name', 'name'),
+    ('kcal', 'calories'),
+    ('protein', 'protein'),
+    ('carbs', 'carbs'),
+    ('fat', 'fat'),
+)
+
+
+def estimate_tokens(text):
+    """
+    估算文本的 token 数（用于发送前的预算控制，不要求与计费完全一致）
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / _CHARS_PER_TOKEN)
+
+
+def estimate_payload_tokens(payload):
+    """
+    估算 chat/completions 请求体中所有消息的输入 token 数
+    """
+    total = 0
+    for message in payload.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        total += estimate_tokens(content or '') + _MESSAGE_OVERHEAD
+    return total
+
+
+def dish_id(index):
+    return f"d{index + 1}"
+
+
+def parse_dish_id(value, count):
+    """
+    将大模型返回的编号（"d3"、"3" 或 3）转换为菜品下标，无效编号返回 None
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        index = value - 1
+    elif isinstance(value, str):
+        match = _ID_RE.match(value)
+        if not match:
+            return None
+        index = int(match.group(1)) - 1
+    else:
+        return None
+    return index if 0 <= index < count else None
+
+
+def _cell(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        # 保留一位小数，整数不带 .0
+        value = round(value, 1)
+        return str(int(value)) if value.is_integer() else str(value)
+    return _CELL_NOISE_RE.sub(' ', str(value)).strip()
+
+
+def compile_dish_table(dishes, columns=NUTRITION_COLUMNS, budget=None, with_ids=True):
+    """
+    将菜品编码为紧凑的表格：表头一行，之后每道菜一行，字段以 | 分隔，缺失值为 -
+    指定 budget 时，加入下一行会超出 token 预算则停止（后面的菜品不发送）
+    返回 (表格文本, 收录的菜品数, 估算的 token 数)
+    """
+    header = (['id'] if with_ids else []) + [title for title, _ in columns]
+    lines = ['|'.join(header)]
+    tokens = estimate_tokens(lines[0])
+    count = 0
+    for index, dish in enumerate(dishes):
+        cells = [dish_id(index)] if with_ids else []
+        cells.extend(_cell(getattr(dish, attr)) for _, attr in columns)
+        line = '|'.join(cells)
+        line_tokens = estimate_tokens(line) + 1
+        if budget is not None and tokens + line_tokens > budget:
+            logger.warning(f"Dish table truncated at {count}/{len(dishes)} dishes (token budget {budget})")
+            break
+        lines.append(line)
+        tokens += line_tokens
+        count += 1
+    return '\n'.join(lines), count, tokens
@@ -0,0 +1,341 @@
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from config import Config
+from app.services.deadline import DeadlineExceeded
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_limiters = {}
+_async_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class UpstreamOverloadedError(Exception):
+    """
+    上游配额已满且等待队列已满（或等待超时），请求被快速拒绝
+    retry_after 为建议客户端重试前等待的秒数
+    """
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def find_overload_error(exc):
+    """
+    沿异常链（raise ... from / 在 except 中抛出的新异常）查找 UpstreamOverloadedError
+    业务层会把底层异常包装为普通 Exception，路由层据此仍能返回 503
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, UpstreamOverloadedError):
+            return exc
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头（秒数或 HTTP 日期），无法解析时返回 None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_overrides(spec):
+    """
+    解析 GLM_RATE_LIMITS，格式为 "模型=每秒请求数:并发数,..."，如 "glm-4v-flash=2:4,glm-4-flash=10:16"
+    """
+    overrides = {}
+    for part in (spec or '').split(','):
+        if '=' not in part:
+            continue
+        model, limits = part.split('=', 1)
+        qps, _, concurrency = limits.partition(':')
+        try:
+            overrides[model.strip()] = (
+                float(qps) if qps.strip() else Config.GLM_RATE_QPS,
+                int(concurrency) if concurrency.strip() else Config.GLM_MAX_CONCURRENCY,
+            )
+        except ValueError:
+            logger.warning(f"Ignoring invalid GLM_RATE_LIMITS entry: {part}")
+    return overrides
+
+
+class _TokenBucket:
+    """
+    令牌桶 + 并发上限的状态，由 RateLimiter 加锁访问
+    收到 429 时按 Retry-After 暂停发放令牌并把速率减半，之后每次成功逐步恢复到配额上限
+    """
+
+    def __init__(self, name, qps, max_concurrency, burst=None, max_queue=None, max_wait=None):
+        self.name = name
+        self.max_rate = qps
+        self.min_rate = max(qps * 0.1, 0.1)
+        self.rate = qps
+        self.burst = burst or Config.GLM_RATE_BURST
+        self.tokens = float(self.burst)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue if max_queue is not None else Config.GLM_RATE_QUEUE_SIZE
+        self.max_wait = max_wait if max_wait is not None else Config.GLM_RATE_MAX_WAIT
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_time(self, now):
+        """
+        距离可以发出请求还需等待的秒数；0 表示立即可发，None 表示需等待其他请求释放并发名额
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.active >= self.max_concurrency:
+            return None
+        self._refill(now)
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def _take(self):
+        self.tokens -= 1
+        self.active += 1
+
+    def _retry_after(self):
+        # 给被拒绝的客户端一个大致的重试时间
+        now = time.monotonic()
+        return max(1, int(max(self.blocked_until - now, self.waiting / self.rate) + 0.999))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        retry_after = self._retry_after()
+        logger.warning(f"Rejecting upstream call to {self.name}: {reason}")
+        return UpstreamOverloadedError(f"上游服务繁忙（{self.name}），请 {retry_after} 秒后重试", retry_after)
+
+    def _wait_until(self, deadline):
+        wait_until = time.monotonic() + self.max_wait
+        return min(wait_until, deadline.expires_at) if deadline is not None else wait_until
+
+    def _timed_out(self, deadline):
+        # 因请求预算用完而放弃排队时不计入拒绝数，交给路由返回部分结果
+        if deadline is not None and deadline.expired():
+            return DeadlineExceeded(f"等待上游配额（{self.name}）时超出请求时限")
+        return self._reject("wait timed out")
+
+    def _penalize(self, delay):
+        now = time.monotonic()
+        self.throttled += 1
+        self.blocked_until = max(self.blocked_until, now + delay)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        logger.warning(f"Upstream {self.name} throttled, pausing {delay:.1f}s, rate -> {self.rate:.2f}/s")
+
+    def _record_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+    def stats(self):
+        return {
+            'rate': round(self.rate, 3),
+            'maxRate': self.max_rate,
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+        }
+
+
+class RateLimiter(_TokenBucket):
+    """
+    单个模型/API密钥的限流器（线程安全）
+    等待队列已满或等待超过 max_wait 时抛出 UpstreamOverloadedError
+    异步请求通过 AsyncRateLimiter 共用同一个令牌桶和并发名额
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+        # 正在等待名额的异步请求：(事件循环, asyncio.Event)
+        self._async_waiters = set()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, deadline=None):
+        """
+        等待令牌和并发名额；deadline 为请求的 Deadline，排队时间不超过其剩余预算
+        """
+        wait_until = self._wait_until(deadline)
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                raise self._reject("wait queue full")
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(now)
+                    if wait == 0:
+                        self._take()
+                        return
+                    remaining = wait_until - now
+                    if remaining <= 0:
+                        raise self._timed_out(deadline)
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+            # 异步等待者可能在其他线程的事件循环中
+            for loop, event in list(self._async_waiters):
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    self._async_waiters.discard((loop, event))
+
+    def penalize(self, delay):
+        with self._cond:
+            self._penalize(delay)
+
+    def record_success(self):
+        with self._cond:
+            self._record_success()
+
+
+class AsyncRateLimiter:
+    """
+    RateLimiter 的 asyncio 入口，与同一模型/API密钥的同步请求共用令牌桶和并发名额
+    （ASGI 入口下部分路由经 WsgiToAsgi 在线程中同步调用上游），等待时不阻塞事件循环
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.name = limiter.name
+
+    @asynccontextmanager
+    async def slot(self, deadline=None):
+        await self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, deadline=None):
+        limiter = self.limiter
+        wait_until = limiter._wait_until(deadline)
+        loop = asyncio.get_running_loop()
+        with limiter._cond:
+            if limiter.waiting >= limiter.max_queue:
+                raise limiter._reject("wait queue full")
+            limiter.waiting += 1
+        try:
+            while True:
+                waiter = (loop, asyncio.Event())
+                with limiter._cond:
+                    now = time.monotonic()
+                    wait = limiter._wait_time(now)
+                    if wait == 0:
+                        limiter._take()
+                        return
+                    remaining = wait_until - now
+                    if remaining <= 0:
+                        raise limiter._timed_out(deadline)
+                    limiter._async_waiters.add(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining if wait is None else min(wait, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with limiter._cond:
+                        limiter._async_waiters.discard(waiter)
+        finally:
+            with limiter._cond:
+                limiter.waiting -= 1
+
+    def release(self):
+        self.limiter.release()
+
+    def penalize(self, delay):
+        self.limiter.penalize(delay)
+
+    def record_success(self):
+        self.limiter.record_success()
+
+    def stats(self):
+        return self.limiter.stats()
+
+
+def _limiter_name(model, api_key):
+    # 日志和统计中不出现密钥原文
+    key_id = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:8]
+    return f"{model}:{key_id}"
+
+
+def _create(model, api_key):
+    # 调用方持有 _limiters_lock
+    name = _limiter_name(model, api_key)
+    limiter = _limiters.get(name)
+    if limiter is None:
+        qps, concurrency = _parse_overrides(Config.GLM_RATE_LIMITS).get(
+            model, (Config.GLM_RATE_QPS, Config.GLM_MAX_CONCURRENCY)
+        )
+        limiter = _limiters[name] = RateLimiter(name, qps, concurrency)
+    return limiter
+
+
+def get_rate_limiter(model, api_key):
+    """
+    获取模型/API密钥对应的限流器（进程内共享），关闭限流时返回 None
+    """
+    if not Config.GLM_RATE_LIMIT_ENABLED:
+        return None
+    with _limiters_lock:
+        return _create(model, api_key)
+
+
+def get_async_rate_limiter(model, api_key):
+    """
+    异步请求使用的限流器，与 get_rate_limiter 返回的同步限流器共用配额
+    """
+    if not Config.GLM_RATE_LIMIT_ENABLED:
+        return None
+    with _limiters_lock:
+        limiter = _create(model, api_key)
+        async_limiter = _async_limiters.get(limiter.name)
+        if async_limiter is None:
+            async_limiter = _async_limiters[limiter.name] = AsyncRateLimiter(limiter)
+        return async_limiter
+
+
+def rate_limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
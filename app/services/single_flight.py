@@ -0,0 +1,310 @@
+import copy
+import asyncio
+import hashlib
+import logging
+import threading
+from config import Config
+from app.services.deadline import DeadlineExceeded, remaining
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_single_flight = None
+_async_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def request_fingerprint(url, body):
+    """
+    上游请求的指纹：相同地址、相同请求体（模型、提示词、图片/菜品数据）的请求视为同一个请求
+    """
+    return hashlib.sha256(f"{url}\n{body}".encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _LeaderTimedOut(Exception):
+    """
+    领头的流式请求因它自己的时限中断，跟随者还没有收到任何片段，可以自行重新发起
+    """
+
+
+def _leader_timed_out(error):
+    # 领头请求超时只说明领头请求的预算用完了，跟随者按自己的预算重试
+    return isinstance(error, DeadlineExceeded)
+
+
+def _interrupted(error):
+    # 跟随者已经转发了部分片段，无法换一个请求接着输出
+    return Exception(f"合并的上游流式请求被中断: {error}")
+
+
+class _SharedStream:
+    """
+    一次流式请求的输出缓冲，跟随者从头回放已收到的片段，再等待新片段
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并进行中的相同上游请求：同一指纹同一时刻只发出一个请求，其余调用等待并共享其结果
+    只合并同时在途的请求，不缓存已完成的结果（结果缓存由阶段缓存负责）
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, deadline=None):
+        """
+        deadline 为本调用方的 Deadline：跟随者最多等到自己的时限，领头请求超时后按自己的预算重试
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                return self._lead(key, call, fn)
+
+            logger.info(f"Coalesced in-flight upstream call {key[:12]}")
+            if not call.event.wait(timeout=remaining(deadline)):
+                raise deadline.error('single_flight')
+            if _leader_timed_out(call.error):
+                logger.info(f"Leader of upstream call {key[:12]} ran out of time, retrying")
+                continue
+            if call.error is not None:
+                raise call.error
+            # 每个调用方拿到独立的副本，避免互相修改
+            return copy.deepcopy(call.result)
+
+    def _lead(self, key, call, fn):
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stream(self, key, fn, deadline=None):
+        """
+        流式请求的合并：领头的调用方读取上游并转发给所有跟随者
+        """
+        while True:
+            with self._lock:
+                shared = self._streams.get(key)
+                leader = shared is None
+                if leader:
+                    shared = _SharedStream()
+                    self._streams[key] = shared
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                yield from self._lead_stream(key, shared, fn)
+                return
+            logger.info(f"Coalesced in-flight upstream stream {key[:12]}")
+            try:
+                yield from self._follow_stream(shared, deadline)
+                return
+            except _LeaderTimedOut:
+                logger.info(f"Leader of upstream stream {key[:12]} ran out of time, retrying")
+
+    def _lead_stream(self, key, shared, fn):
+        try:
+            for chunk in fn():
+                with self._cond:
+                    shared.chunks.append(chunk)
+                    self._cond.notify_all()
+                yield chunk
+        except GeneratorExit:
+            # 领头的调用方提前放弃时，跟随者拿不到完整输出
+            shared.error = Exception("上游流式请求被中断")
+            raise
+        except Exception as e:
+            shared.error = e
+            raise
+        finally:
+            with self._cond:
+                self._streams.pop(key, None)
+                shared.done = True
+                self._cond.notify_all()
+
+    def _follow_stream(self, shared, deadline=None):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(shared.chunks) and not shared.done:
+                    if not self._cond.wait(timeout=remaining(deadline)) and deadline.expired():
+                        raise deadline.error('single_flight')
+                if index < len(shared.chunks):
+                    chunk = shared.chunks[index]
+                    index += 1
+                elif shared.error is not None:
+                    if _leader_timed_out(shared.error):
+                        if index == 0:
+                            raise _LeaderTimedOut()
+                        raise _interrupted(shared.error)
+                    raise shared.error
+                else:
+                    return
+            yield chunk
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本，所有调用都在同一个事件循环内，不需要加锁
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, deadline=None):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self._lead(key, fn)
+            self.coalesced += 1
+            logger.info(f"Coalesced in-flight upstream call {key[:12]}")
+            try:
+                # shield：某个跟随者被取消或超时不影响领头的请求
+                result = await asyncio.wait_for(asyncio.shield(future), remaining(deadline))
+            except asyncio.TimeoutError:
+                raise deadline.error('single_flight') from None
+            except DeadlineExceeded:
+                logger.info(f"Leader of upstream call {key[:12]} ran out of time, retrying")
+                continue
+            return copy.deepcopy(result)
+
+    async def _lead(self, key, fn):
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else Exception("上游请求被取消"))
+            # 没有跟随者时也要取走异常，避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+    async def stream(self, key, fn, deadline=None):
+        while True:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = _SharedStream()
+                shared.event = asyncio.Event()
+                self._streams[key] = shared
+                self.leaders += 1
+                chunks = self._lead_stream(key, shared, fn)
+            else:
+                self.coalesced += 1
+                logger.info(f"Coalesced in-flight upstream stream {key[:12]}")
+                chunks = self._follow_stream(shared, deadline)
+            try:
+                async for chunk in chunks:
+                    yield chunk
+                return
+            except _LeaderTimedOut:
+                logger.info(f"Leader of upstream stream {key[:12]} ran out of time, retrying")
+            finally:
+                # 调用方提前退出时立即关闭内层生成器，让跟随者尽快得知中断
+                await chunks.aclose()
+
+    async def _lead_stream(self, key, shared, fn):
+        try:
+            async for chunk in fn():
+                shared.chunks.append(chunk)
+                self._wake(shared)
+                yield chunk
+        except GeneratorExit:
+            shared.error = Exception("上游流式请求被中断")
+            raise
+        except BaseException as e:
+            shared.error = e if isinstance(e, Exception) else Exception("上游流式请求被取消")
+            raise
+        finally:
+            self._streams.pop(key, None)
+            shared.done = True
+            self._wake(shared)
+
+    @staticmethod
+    def _wake(shared):
+        shared.event.set()
+        shared.event = asyncio.Event()
+
+    async def _follow_stream(self, shared, deadline=None):
+        index = 0
+        while True:
+            if index < len(shared.chunks):
+                chunk = shared.chunks[index]
+                index += 1
+                yield chunk
+            elif shared.done:
+                if shared.error is not None:
+                    if _leader_timed_out(shared.error):
+                        if index == 0:
+                            raise _LeaderTimedOut()
+                        raise _interrupted(shared.error)
+                    raise shared.error
+                return
+            else:
+                try:
+                    await asyncio.wait_for(shared.event.wait(), remaining(deadline))
+                except asyncio.TimeoutError:
+                    raise deadline.error('single_flight') from None
+
+
+def get_single_flight():
+    """
+    进程内共享的请求合并器（懒加载），关闭时返回 None
+    """
+    global _single_flight
+    if not Config.SINGLE_FLIGHT_ENABLED:
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
+
+
+def get_async_single_flight():
+    global _async_single_flight
+    if not Config.SINGLE_FLIGHT_ENABLED:
+        return None
+    if _async_single_flight is None:
+        _async_single_flight = AsyncSingleFlight()
+    return _async_single_flight
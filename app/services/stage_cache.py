@@ -0,0 +1,214 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import logging
+import threading
+import tempfile
+from collections import OrderedDict
+from config import Config
+from app.services.metrics import CACHE_LOOKUPS
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def _json_default(obj):
+    # 业务对象（如 Dish）提供 to_dict，读取时由业务类还原
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+class StageCache:
+    """
+    流水线各阶段输出的内容寻址缓存
+    内存 LRU（带 TTL）在前，本地磁盘存储在后；键为 SHA-256(阶段, 模型, 提示词版本, 输入)
+    值以 JSON 文本保存，每次读取都会得到新的对象，调用方可以放心修改
+    """
+
+    def __init__(self, cache_dir=None, max_entries=None, ttl=None, disk_ttl=None):
+        self.cache_dir = cache_dir or Config.STAGE_CACHE_DIR
+        self.max_entries = max_entries or Config.STAGE_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else Config.STAGE_CACHE_TTL
+        self.disk_ttl = disk_ttl if disk_ttl is not None else Config.STAGE_CACHE_DISK_TTL
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'writes': 0,
+        }
+
+    @staticmethod
+    def make_key(stage, model, prompt_version, data):
+        """
+        计算阶段缓存键，data 可以是 str/bytes 或任意可 JSON 序列化的对象（含提供 to_dict 的对象）
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{stage}\0{model}\0{prompt_version}\0".encode('utf-8'))
+        if isinstance(data, bytes):
+            digest.update(data)
+        elif isinstance(data, str):
+            digest.update(data.encode('utf-8'))
+        else:
+            digest.update(json.dumps(
+                data, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=_json_default
+            ).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存，未命中返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, text = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return json.loads(text)
+                del self._memory[key]
+                self._stats['expirations'] += 1
+
+        text = self._read_disk(key, now)
+        with self._lock:
+            if text is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._put_memory(key, text, now)
+        return json.loads(text)
+
+    def set(self, key, value):
+        """
+        写入缓存（内存与磁盘两级）
+        """
+        text = json.dumps(value, ensure_ascii=False, default=_json_default)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, text, now)
+            self._stats['writes'] += 1
+        self._write_disk(key, text, now)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0
+        return stats
+
+    def _put_memory(self, key, text, now):
+        # 调用方需持有 self._lock
+        self._memory[key] = (now + self.ttl, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _disk_path(self, key):
+        # 按键前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read stage cache entry {key}: {e}")
+            return None
+        if record.get('expires_at', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._stats['expirations'] += 1
+            return None
+        return record.get('value')
+
+    def _write_disk(self, key, text, now):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': now + self.disk_ttl, 'value': text}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # 磁盘不可写（例如只读的无服务器环境）时退化为纯内存缓存
+            logger.warning(f"Failed to write stage cache entry {key}: {e}")
+
+
+class StageCacheMixin:
+    """
+    业务类使用的缓存辅助方法
+    需要子类提供 self.cache（可为 None，表示关闭缓存）
+    """
+
+    def _cache_key(self, stage, model, prompt_version, data):
+        if self.cache is None:
+            return None
+        return self.cache.make_key(stage, model, prompt_version, data)
+
+    def _cache_get(self, cache_key):
+        if cache_key is None:
+            return None
+        cached = self.cache.get(cache_key)
+        CACHE_LOOKUPS.inc(
+            cache='stage', component=type(self).__name__, outcome='hit' if cached is not None else 'miss'
+        )
+        if cached is not None:
+            print(f"命中阶段缓存: {cache_key[:12]}")
+        return cached
+
+    def _cache_set(self, cache_key, value):
+        # 空结果通常意味着识别或解析失败，不写入缓存
+        if cache_key is None or not value:
+            return
+        self.cache.set(cache_key, value)
+
+    async def _acache_get(self, cache_key):
+        # 异步业务类使用：磁盘层读写放到线程池，避免阻塞事件循环
+        if cache_key is None:
+            return None
+        return await asyncio.to_thread(self._cache_get, cache_key)
+
+    async def _acache_set(self, cache_key, value):
+        if cache_key is None or not value:
+            return
+        await asyncio.to_thread(self._cache_set, cache_key, value)
+
+
+_stage_cache = None
+_stage_cache_lock = threading.Lock()
+
+
+def get_stage_cache():
+    """
+    获取进程内共享的阶段缓存，配置关闭时返回 None
+    """
+    global _stage_cache
+    if not Config.STAGE_CACHE_ENABLED:
+        return None
+    if _stage_cache is None:
+        with _stage_cache_lock:
+            if _stage_cache is None:
+                _stage_cache = StageCache()
+    return _stage_cache
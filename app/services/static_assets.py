@@ -0,0 +1,156 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from config import Config
+
+# brotli 为可选依赖，未安装时只生成 gzip 版本
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 值得压缩的类型（图片、字体等已经是压缩格式）
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+# 太小的文件压缩后省不了几个字节，还要多一次解压
+_MIN_COMPRESS_SIZE = 256
+# 协商时的优先顺序：同等 q 值下优先 brotli
+_ENCODING_PREFERENCE = ('br', 'gzip')
+
+
+def _is_compressible(mimetype):
+    return mimetype.startswith(_COMPRESSIBLE_TYPES)
+
+
+def parse_accept_encoding(header):
+    """
+    解析 Accept-Encoding，返回 {编码: q 值}（q=0 表示明确拒绝）
+    """
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class StaticAsset:
+    """
+    一个静态文件的各个编码版本（identity/gzip/br），每个版本有自己的强 ETag
+    """
+
+    __slots__ = ('path', 'mimetype', 'cache_control', 'bodies', 'etags')
+
+    def __init__(self, path, data, mimetype, cache_control):
+        self.path = path
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.bodies = {'identity': data}
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        # 同一内容的不同编码是不同的表示，强 ETag 必须不同
+        self.etags = {'identity': f'"{digest}"'}
+
+        if _is_compressible(mimetype) and len(data) >= _MIN_COMPRESS_SIZE:
+            # mtime=0 使同一内容每次启动压缩出的字节完全相同
+            self._add('gzip', gzip.compress(data, compresslevel=9, mtime=0), digest)
+            if brotli is not None:
+                self._add('br', brotli.compress(data, quality=11), digest)
+
+    def _add(self, encoding, body, digest):
+        if len(body) < len(self.bodies['identity']):
+            self.bodies[encoding] = body
+            self.etags[encoding] = f'"{digest}-{encoding}"'
+
+    @property
+    def varies(self):
+        return len(self.bodies) > 1
+
+    def select(self, accept_encoding):
+        """
+        按 Accept-Encoding 选择返回的编码
+        """
+        if not self.varies:
+            return 'identity'
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        best, best_q = 'identity', 0.0
+        for encoding in _ENCODING_PREFERENCE:
+            if encoding not in self.bodies:
+                continue
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+
+class StaticAssets:
+    """
+    启动时把静态目录中的文件读入内存并预压缩，请求时只做查表和协商，不再读文件
+    """
+
+    def __init__(self, root, index='index.html', max_age=None):
+        self.root = root
+        self.index = index
+        self.max_age = Config.STATIC_MAX_AGE if max_age is None else max_age
+        self.assets = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                self.assets[name] = self._load(name, path)
+
+        total = sum(len(asset.bodies['identity']) for asset in self.assets.values())
+        compressed = sum(min(len(body) for body in asset.bodies.values()) for asset in self.assets.values())
+        logger.info(
+            f"Loaded {len(self.assets)} static assets from {root}: {total} bytes, {compressed} bytes compressed"
+            f"{'' if brotli is not None else ' (brotli not installed, gzip only)'}"
+        )
+
+    def _load(self, name, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype in ('application/javascript', 'application/json'):
+            mimetype += '; charset=utf-8'
+        # 入口页面不带版本号，每次都要验证（命中时只返回 304）；其余文件可缓存 max_age 秒
+        cache_control = 'no-cache' if name == self.index else f'public, max-age={self.max_age}'
+        return StaticAsset(name, data, mimetype, cache_control)
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def respond(self, asset, accept_encoding, if_none_match):
+        """
+        返回 (状态码, 响应头, 响应体)；If-None-Match 与所选编码的 ETag 相同时返回 304 和空响应体
+        """
+        encoding = asset.select(accept_encoding)
+        etag = asset.etags[encoding]
+        headers = {'ETag': etag, 'Cache-Control': asset.cache_control}
+        if asset.varies:
+            headers['Vary'] = 'Accept-Encoding'
+        if if_none_match and (if_none_match.strip() == '*' or etag in _parse_etags(if_none_match)):
+            return 304, headers, b''
+
+        headers['Content-Type'] = asset.mimetype
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return 200, headers, asset.bodies[encoding]
+
+
+def _parse_etags(header):
+    # 弱比较：If-None-Match 中带 W/ 前缀的 ETag 也视为匹配
+    return {tag.strip().removeprefix('W/') for tag in header.split(',')}
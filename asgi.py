@@ -0,0 +1,16 @@
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from app import create_app
+from app.async_routes import routes
+
+# 创建Flask应用实例，用于静态页面和其余同步路由
+flask_app = create_app()
+
+# ASGI入口：/api/process-menu 由异步实现处理，其余请求转交给Flask
+app = Starlette(routes=routes + [Mount('/', app=WsgiToAsgi(flask_app))])
+
+# 本地运行: uvicorn asgi:app --host 0.0.0.0 --port 5000
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
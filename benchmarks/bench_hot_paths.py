@@ -0,0 +1,301 @@
+"""
+纯 Python 热点路径的微基准测试
+
+在 10 ~ 10,000 道菜的合成菜单上测量以下函数的耗时和峰值内存：
+- parse_menu_text（菜单数据 / 大模型原始文本）
+- 各业务类的 JSON 提取：MenuRecognition / HealthAnalysis / RecommendationEngine / NutritionSummary
+- RecommendationEngine._process_recommendations
+- CostCalculator.calculate
+- NutritionKnowledgeBase 模糊匹配（不走结果缓存）
+
+结果以 JSON 保存（每个用例一条：中位耗时、最短耗时、轮数、参考耗时、峰值内存），
+用 --compare 与基线对比，超过阈值的回归会标出，--fail-on-regression 时以非零状态退出
+
+耗时与机器相关，benchmarks/results/ 不纳入版本库：在改动前用 --output 在本机生成基线，改动后再对比
+
+用法：
+    python benchmarks/bench_hot_paths.py                                   # 运行并打印
+    python benchmarks/bench_hot_paths.py --output benchmarks/results/hot_paths.json
+    python benchmarks/bench_hot_paths.py --compare benchmarks/results/hot_paths.json --fail-on-regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import tracemalloc
+import contextlib
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.business.pipeline import parse_menu_text
+from app.business.dish import dish_json_default
+from app.business.menu_recognition import MenuRecognition
+from app.business.health_analysis import HealthAnalysis
+from app.business.recommendation_engine import RecommendationEngine
+from app.business.nutrition_summary import NutritionSummary
+from app.business.cost_calculator import CostCalculator
+from app.services.nutrition_kb import NutritionKnowledgeBase
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+CATEGORIES = ['冷菜', '热菜', '汤羹', '主食', '甜品', '饮品']
+# 大模型实际返回过的价格写法
+PRICE_FORMATS = (lambda p: p, lambda p: f"¥{p}", lambda p: f"{p}元", lambda p: str(p))
+
+
+def make_menu(size, seed=0):
+    """
+    生成 size 道菜的菜单数据（分类 -> 菜品列表）
+    """
+    rng = random.Random(seed)
+    menu = {}
+    for i in range(size):
+        price = round(rng.uniform(8, 188), 1)
+        menu.setdefault(CATEGORIES[i % len(CATEGORIES)], []).append({
+            'name': f"菜品{i}",
+            'description': '选用新鲜食材，口味鲜香，' + '搭配时令蔬菜' * rng.randint(0, 3),
+            'price': PRICE_FORMATS[i % len(PRICE_FORMATS)](price),
+        })
+    return menu
+
+
+def make_nutrition(dishes, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            'name': dish.name,
+            'calories': rng.randint(50, 1200),
+            'protein': round(rng.uniform(1, 60), 1),
+            'carbs': round(rng.uniform(1, 150), 1),
+            'fat': round(rng.uniform(0, 80), 1),
+        }
+        for dish in dishes
+    ]
+
+
+def make_kb_names(kb, size, seed=0):
+    """
+    知识库菜名的变体：原名、加前缀/份量备注、易混字和未收录的菜名各占一部分
+    """
+    rng = random.Random(seed)
+    names = [entry['name'] for entry in kb.entries]
+    variants = (
+        lambda name: name,
+        lambda name: f"招牌{name}（大份）",
+        lambda name: name.replace('保', '爆').replace('腐', '付').replace('蛋', '旦'),
+        lambda name: f"{name[:-1]}{rng.choice('饼羹串卷')}",
+    )
+    return [variants[i % len(variants)](rng.choice(names)) for i in range(size)]
+
+
+def llm_response(data):
+    """
+    包装成 GLM 响应结构，内容为带 ```json 代码块和说明文字的输出
+    """
+    content = "以下是结果：\n```json\n" + json.dumps(data, ensure_ascii=False, indent=2, default=dish_json_default) + "\n```\n如需调整请告诉我。"
+    return {'choices': [{'message': {'content': content}}]}
+
+
+def build_cases(size):
+    """
+    返回 [(用例名, 无参函数)]，输入数据在计时前准备好
+    """
+    menu = make_menu(size)
+    menu_text = llm_response(menu)['choices'][0]['message']['content']
+    dishes = parse_menu_text(menu)
+    nutrition = make_nutrition(dishes)
+    with_nutrition = [dish.with_nutrition(item) for dish, item in zip(dishes, nutrition)]
+    summary = {'totalCalories': 1234, 'totalProtein': 56.7, 'totalCarbs': 89.0, 'totalFat': 12.3}
+
+    menu_recognition = MenuRecognition(None)
+    health_analysis = HealthAnalysis(None)
+    recommendation_engine = RecommendationEngine(None, mode='local')
+    nutrition_summary = NutritionSummary(None)
+    cost_calculator = CostCalculator()
+    knowledge_base = NutritionKnowledgeBase()
+    kb_keys = [knowledge_base.normalize(name) for name in make_kb_names(knowledge_base, size)]
+
+    menu_response = llm_response(menu)
+    health_response = llm_response(nutrition)
+    # 推荐只返回编号和评分，完整记录从菜品列表还原
+    recommend_response = llm_response([{'id': f"d{i + 1}", 'score': 0.5} for i in range(len(with_nutrition))])
+    summary_response = llm_response(summary)
+
+    return [
+        ('parse_menu_text[dict]', lambda: parse_menu_text(menu)),
+        ('parse_menu_text[text]', lambda: parse_menu_text(menu_text)),
+        ('MenuRecognition._parse_response', lambda: menu_recognition._parse_response(menu_response)),
+        # _merge_response 会就地修改解析结果，每次都重新解析，传入的菜品列表不受影响
+        ('HealthAnalysis._merge_response', lambda: health_analysis._merge_response(health_response, dishes)),
+        ('RecommendationEngine._parse_response', lambda: recommendation_engine._parse_response(recommend_response, with_nutrition)),
+        ('RecommendationEngine._process_recommendations',
+         lambda: recommendation_engine._process_recommendations(with_nutrition)),
+        ('NutritionSummary._parse_response', lambda: nutrition_summary._parse_response(summary_response)),
+        ('CostCalculator.calculate', lambda: cost_calculator.calculate(with_nutrition)),
+        ('NutritionKnowledgeBase.match', lambda: [knowledge_base._match_uncached(key) for key in kb_keys]),
+    ]
+
+
+def measure(func, min_time, max_rounds):
+    """
+    重复运行直到累计耗时超过 min_time（至少 3 轮），返回每轮耗时列表
+    """
+    timings = []
+    total = 0.0
+    while len(timings) < 3 or (total < min_time and len(timings) < max_rounds):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+    return timings
+
+
+def _reference_workload():
+    # 固定的纯 Python 工作量（字典构造 + 字符串格式化），用来衡量当前机器的速度
+    return [{'name': f"菜品{i}", 'price': i * 1.5} for i in range(2000)]
+
+
+def calibrate():
+    """
+    参考工作量的最短耗时；与用例耗时的比值可以抵消机器整体变快/变慢（CPU 降频、共享主机）
+    """
+    return min(measure(_reference_workload, 0.02, 50))
+
+
+def measure_peak_memory(func):
+    """
+    单次运行期间新分配内存的峰值（字节）
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - baseline)
+
+
+def run(sizes, min_time, max_rounds):
+    results = []
+    # 业务代码中的 print 属于真实开销，但输出到 /dev/null，避免终端成为瓶颈
+    with open(os.devnull, 'w') as devnull:
+        for size in sizes:
+            with contextlib.redirect_stdout(devnull):
+                cases = build_cases(size)
+            for name, func in cases:
+                with contextlib.redirect_stdout(devnull):
+                    # 预热一次（导入、正则编译等一次性开销不计入）
+                    func()
+                    calibration = calibrate()
+                    timings = measure(func, min_time, max_rounds)
+                    peak = measure_peak_memory(func)
+                results.append({
+                    'case': name,
+                    'size': size,
+                    'median': statistics.median(timings),
+                    'min': min(timings),
+                    'rounds': len(timings),
+                    'calibration': calibration,
+                    'peakBytes': peak,
+                })
+                print(f"{name:<46} {size:>6}  median {format_seconds(results[-1]['median']):>10}  "
+                      f"peak {peak / 1024:>10.1f} KiB  ({len(timings)} rounds)", flush=True)
+    return results
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+
+# 低于这些绝对差值的变化视为噪声（微秒级用例的耗时和分配器缓存造成的内存抖动）
+TIME_NOISE_FLOOR = 20e-6
+MEMORY_NOISE_FLOOR = 16 * 1024
+
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线逐项对比，返回回归的用例列表
+    耗时取最短一轮（受调度噪声影响最小），并除以同时测得的参考耗时，使不同时间/机器上的结果可比
+    """
+    base = {(item['case'], item['size']): item for item in baseline.get('results', [])}
+    regressions = []
+    print(f"\n与基线对比（阈值 {threshold:.0%}）")
+    meta = baseline.get('meta', {})
+    current = _environment()
+    differs = [key for key in ('machine', 'platform', 'python', 'numpy') if meta.get(key) != current[key]]
+    if differs:
+        print(f"注意：基线来自不同的环境（{', '.join(differs)}），对比结果仅供参考")
+    print(f"{'case':<46} {'size':>6} {'time':>8} {'memory':>8}")
+    for item in results:
+        old = base.get((item['case'], item['size']))
+        if old is None:
+            print(f"{item['case']:<46} {item['size']:>6} {'new':>8} {'new':>8}")
+            continue
+        time_ratio = (item['min'] / item['calibration']) / (old['min'] / old['calibration']) if old['min'] else 1.0
+        memory_ratio = item['peakBytes'] / old['peakBytes'] if old['peakBytes'] else 1.0
+        slower = time_ratio > 1 + threshold and item['min'] - old['min'] > TIME_NOISE_FLOOR
+        bigger = memory_ratio > 1 + threshold and item['peakBytes'] - old['peakBytes'] > MEMORY_NOISE_FLOOR
+        flag = ''
+        if slower or bigger:
+            flag = '  <-- regression'
+            regressions.append(item)
+        print(f"{item['case']:<46} {item['size']:>6} {time_ratio:>7.2f}x {memory_ratio:>7.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='纯 Python 热点路径微基准测试')
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=list(DEFAULT_SIZES),
+                        help='菜单菜品数，逗号分隔（默认 10,100,1000,10000）')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每个用例至少累计运行的秒数')
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--output', help='把结果以 JSON 写入文件')
+    parser.add_argument('--compare', help='基线结果文件')
+    parser.add_argument('--threshold', type=float, default=0.25, help='判定为回归的相对增幅')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.min_time, args.max_rounds)
+    report = {
+        'meta': {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), **_environment()},
+        'results': results,
+    }
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+大模型输出 JSON 解析的基准测试
+
+对比旧实现（各阶段各自用正则提取代码块，菜单识别结果先校验一次、parse_menu_text 再解析一次）
+与公共的 extract_json（只扫描一次、只解析一次，并修复常见缺陷）
+
+用法：python benchmarks/bench_json_extractor.py [--repeat 2000]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.business.json_extractor import extract_json
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_outputs.json')
+
+_FENCE_RE = re.compile(r'```json\s*([\s\S]*?)\s*```', re.DOTALL)
+
+
+def legacy_parse(stage, content):
+    """
+    旧实现的解析路径，解析失败返回 None
+    """
+    try:
+        if stage == 'menu':
+            # MenuRecognition._extract_valid_json 校验一次，parse_menu_text 再提取并解析一次
+            match = _FENCE_RE.search(content)
+            text = content
+            if match:
+                json.loads(match.group(1))
+                text = match.group(1)
+            match = _FENCE_RE.search(text)
+            return json.loads(match.group(1) if match else text)
+        match = _FENCE_RE.search(content)
+        if match:
+            return json.loads(match.group(1))
+        return json.loads(content) if stage == 'explain' else None
+    except json.JSONDecodeError:
+        return None
+
+
+def new_parse(stage, content):
+    expect = {'health': list, 'explain': list, 'summary': dict}.get(stage)
+    return extract_json(content, expect=expect)
+
+
+def bench(parse, samples, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sample in samples:
+            parse(sample['stage'], sample['content'])
+    return (time.perf_counter() - start) / (repeat * len(samples)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM 输出 JSON 解析基准测试')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(SAMPLES_PATH, encoding='utf-8') as f:
+        samples = json.load(f)
+
+    print(f"{'stage':<8} {'kind':<16} {'legacy':>8} {'extract_json':>13}")
+    for sample in samples:
+        legacy_ok = legacy_parse(sample['stage'], sample['content']) is not None
+        new_ok = new_parse(sample['stage'], sample['content']) is not None
+        print(f"{sample['stage']:<8} {sample['kind']:<16} {'ok' if legacy_ok else 'FAIL':>8} {'ok' if new_ok else 'FAIL':>13}")
+
+    # 只在两种实现都能解析的样本上比较耗时
+    comparable = [s for s in samples if legacy_parse(s['stage'], s['content']) is not None]
+    legacy_us = bench(legacy_parse, comparable, args.repeat)
+    new_us = bench(new_parse, comparable, args.repeat)
+    print(f"\n平均每条输出耗时（{len(comparable)} 条可比样本 x {args.repeat} 次）")
+    print(f"  legacy:       {legacy_us:8.2f} us")
+    print(f"  extract_json: {new_us:8.2f} us  ({legacy_us / new_us:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+/api/process-menu 端到端压测
+
+以固定并发持续发送菜单图片，统计吞吐量、延迟分位数（p50/p95/p99）和状态码分布
+默认每个请求使用不同的图片，避免命中阶段缓存；--same-image 用于测试缓存和请求合并
+
+用法（先启动模拟的 GLM 服务和应用）：
+    python benchmarks/mock_glm_server.py --port 8900 &
+    API_BASE_URL=http://127.0.0.1:8900/api/paas/v4/chat/completions python run.py &
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --concurrency 16 --requests 200
+"""
+import io
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+
+def make_image(seed, size=(640, 480)):
+    """
+    生成一张 JPEG 图片，不同 seed 得到内容不同的图片
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    # 加一些随机像素，保证图片哈希不同
+    for _ in range(32):
+        image.putpixel((rng.randrange(size[0]), rng.randrange(size[1])), (rng.randrange(256),) * 3)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.endpoint = args.url.rstrip('/') + ('/api/process-menu/stream' if args.stream else '/api/process-menu')
+        self.latencies = []
+        self.first_event = []
+        self.statuses = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._local = threading.local()
+        self._same_image = make_image(0) if args.same_image else None
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next(self, deadline):
+        with self._lock:
+            if self.args.requests and self._sent >= self.args.requests:
+                return None
+            if deadline and time.monotonic() >= deadline:
+                return None
+            self._sent += 1
+            return self._sent
+
+    def _record(self, status, latency, first_event=None, error=None):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200 and error is None:
+                self.latencies.append(latency)
+                if first_event is not None:
+                    self.first_event.append(first_event)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def _one(self, seq):
+        image = self._same_image or make_image(seq + self.args.seed * 1_000_000)
+        files = {'image': ('menu.jpg', image, 'image/jpeg')}
+        start = time.perf_counter()
+        try:
+            if self.args.stream:
+                self._one_stream(files, start)
+                return
+            response = self._session().post(self.endpoint, files=files, timeout=self.args.timeout)
+            latency = time.perf_counter() - start
+            error = None
+            if response.status_code != 200:
+                error = (response.json().get('error') if response.headers.get('Content-Type', '').startswith('application/json') else None) or f"HTTP {response.status_code}"
+            self._record(response.status_code, latency, error=error)
+        except requests.RequestException as e:
+            self._record('exception', time.perf_counter() - start, error=type(e).__name__)
+
+    def _one_stream(self, files, start):
+        first_event = None
+        error = None
+        with self._session().post(self.endpoint, files=files, timeout=self.args.timeout, stream=True) as response:
+            if response.status_code != 200:
+                self._record(response.status_code, time.perf_counter() - start, error=f"HTTP {response.status_code}")
+                return
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                    if first_event is None:
+                        first_event = time.perf_counter() - start
+                elif line.startswith('data:') and event == 'error':
+                    error = json.loads(line[5:]).get('error') or 'error event'
+        self._record(200, time.perf_counter() - start, first_event, error)
+
+    def _worker(self, deadline):
+        while True:
+            seq = self._next(deadline)
+            if seq is None:
+                return
+            self._one(seq)
+
+    def run(self):
+        deadline = time.monotonic() + self.args.duration if self.args.duration else None
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for _ in range(self.args.concurrency):
+                pool.submit(self._worker, deadline)
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = sum(self.statuses.values())
+        result = {
+            'endpoint': self.endpoint,
+            'concurrency': self.args.concurrency,
+            'requests': total,
+            'elapsed': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 3) if elapsed else 0,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            'errors': self.errors,
+            'latency': {
+                'mean': round(sum(latencies) / len(latencies), 4) if latencies else 0,
+                'p50': round(percentile(latencies, 50), 4),
+                'p95': round(percentile(latencies, 95), 4),
+                'p99': round(percentile(latencies, 99), 4),
+                'max': round(latencies[-1], 4) if latencies else 0,
+            },
+        }
+        if self.first_event:
+            first_event = sorted(self.first_event)
+            result['firstEvent'] = {
+                'p50': round(percentile(first_event, 50), 4),
+                'p95': round(percentile(first_event, 95), 4),
+            }
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/api/process-menu 端到端压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='应用地址')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='请求总数（0 表示只按 --duration 运行）')
+    parser.add_argument('--duration', type=float, default=0, help='最长运行秒数（0 表示不限）')
+    parser.add_argument('--stream', action='store_true', help='压测 SSE 接口 /api/process-menu/stream')
+    parser.add_argument('--same-image', action='store_true', help='所有请求使用同一张图片')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1, help='图片生成种子，换种子可避开上一轮的缓存')
+    parser.add_argument('--output', help='把结果以 JSON 写入文件')
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error('--requests 和 --duration 至少指定一个')
+
+    test = LoadTest(args)
+    elapsed = test.run()
+    result = test.report(elapsed)
+
+    latency = result['latency']
+    print(f"{result['endpoint']}  并发 {result['concurrency']}  请求 {result['requests']}  用时 {result['elapsed']}s")
+    print(f"吞吐量: {result['throughput']} req/s")
+    print(f"延迟(s): mean {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    if 'firstEvent' in result:
+        print(f"首个事件(s): p50 {result['firstEvent']['p50']}  p95 {result['firstEvent']['p95']}")
+    print(f"状态码: {result['statuses']}")
+    if result['errors']:
+        print(f"错误: {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
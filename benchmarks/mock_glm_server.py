@@ -0,0 +1,359 @@
+"""
+本地模拟的 GLM chat/completions 服务，用于压测和离线联调
+
+按提示词识别各类请求（菜单识别、健康分析、推荐/推荐理由、营养总结、合并分析），返回结构真实的模拟输出，
+并可配置延迟分布、错误率、429 限流和流式输出
+
+用法：
+    python benchmarks/mock_glm_server.py --port 8900 --latency lognormal --latency-ms 800 --error-rate 0.02
+    API_BASE_URL=http://127.0.0.1:8900/api/paas/v4/chat/completions python run.py
+"""
+import re
+import sys
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CATEGORIES = ['冷菜', '热菜', '汤羹', '主食', '甜品']
+DISHES = [
+    ('拍黄瓜', '清爽开胃，蒜香浓郁'),
+    ('凉拌木耳', '搭配香菜和小米辣，口感爽脆'),
+    ('宫保鸡丁', '经典川菜，酸甜微辣'),
+    ('鱼香肉丝', '酸甜可口，层次丰富'),
+    ('清蒸鲈鱼', '鲜嫩少油，原汁原味'),
+    ('麻婆豆腐', '麻辣鲜香，豆腐嫩滑'),
+    ('西兰花炒虾仁', '高蛋白低脂，清淡爽口'),
+    ('红烧肉', '肥而不腻，酱香浓郁'),
+    ('番茄蛋汤', '酸甜开胃，家常味道'),
+    ('玉米排骨汤', '慢火熬制，汤色清亮'),
+    ('扬州炒饭', '粒粒分明，配料丰富'),
+    ('手工水饺', '皮薄馅大，猪肉白菜馅'),
+    ('杨枝甘露', '芒果西柚，清甜顺滑'),
+    ('红豆双皮奶', '奶香浓郁，口感细腻'),
+]
+
+_HEALTH_RE = re.compile(r'营养成分:(.*?)请为每道菜', re.S)
+_JSON_LIST_RE = re.compile(r'(\[.*\])', re.S)
+# 推荐/营养总结提示词中的菜品营养表：表头行以 name 或 id|name 开头，之后每行一道菜
+_TABLE_RE = re.compile(r'^((?:id\|)?name\|[^\n]*)\n((?:[^\n]*\|[^\n]*(?:\n|$))*)', re.M)
+
+
+def _seed(text):
+    # 同一道菜每次返回相同的营养数据，便于对比
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def nutrition_of(name):
+    rng = random.Random(_seed(name))
+    return {
+        'name': name,
+        'calories': rng.randint(80, 900),
+        'protein': round(rng.uniform(2, 45), 1),
+        'carbs': round(rng.uniform(5, 120), 1),
+        'fat': round(rng.uniform(1, 60), 1),
+    }
+
+
+def build_menu(dish_count, variant=None):
+    menu = {}
+    for i in range(dish_count):
+        name, description = DISHES[i % len(DISHES)]
+        if i >= len(DISHES):
+            name = f"{name}{i // len(DISHES) + 1}号"
+        if variant is not None:
+            # 每张菜单的菜名都不同，避免命中菜品营养数据存储
+            name = f"{name}-{variant}"
+        category = CATEGORIES[i % len(CATEGORIES)]
+        menu.setdefault(category, []).append({
+            'name': name,
+            'description': description,
+            'price': float(10 + (i * 7) % 80),
+        })
+    return menu
+
+
+def _prompt_text(body):
+    parts = []
+    for message in body.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            parts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+            if any(isinstance(part, dict) and part.get('type') == 'image_url' for part in content):
+                parts.append('<image>')
+        elif isinstance(content, str):
+            parts.append(content)
+    return '\n'.join(parts)
+
+
+def _dishes_in_prompt(prompt):
+    match = _JSON_LIST_RE.search(prompt)
+    if not match:
+        return []
+    try:
+        dishes = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return []
+    return [dish for dish in dishes if isinstance(dish, dict)]
+
+
+def _table_in_prompt(prompt):
+    """
+    解析提示词中的营养表，返回字典列表（键为表头，- 表示缺失）
+    """
+    match = _TABLE_RE.search(prompt)
+    if not match:
+        return []
+    header = match.group(1).split('|')
+    rows = []
+    for line in match.group(2).splitlines():
+        cells = line.split('|')
+        if len(cells) != len(header):
+            break
+        row = {}
+        for key, cell in zip(header, cells):
+            try:
+                row[key] = None if cell == '-' else (cell if key in ('id', 'name') else float(cell))
+            except ValueError:
+                row[key] = cell
+        rows.append(row)
+    return rows
+
+
+def _fenced(data):
+    return "```json\n" + json.dumps(data, ensure_ascii=False, indent=2) + "\n```"
+
+
+def respond(body, menu_dishes, unique_dishes=False):
+    """
+    根据提示词返回 (操作名, 模拟输出)
+    """
+    prompt = _prompt_text(body)
+    if '<image>' in prompt:
+        variant = _seed(json.dumps(body.get('messages'))) if unique_dishes else None
+        return 'recognize_menu', _fenced(build_menu(menu_dishes, variant))
+
+    if 'nutrition：' in prompt and 'recommended：' in prompt:
+        # 合并分析：补全未知的营养值，推荐热量最低的 3 道菜，按需附上营养总结
+        rows = _table_in_prompt(prompt)
+        nutrition = []
+        for row in rows:
+            if row.get('kcal') is None:
+                item = nutrition_of(row.get('name'))
+                nutrition.append({'id': row.get('id'), **{key: item[key] for key in ('calories', 'protein', 'carbs', 'fat')}})
+                row.update(kcal=item['calories'], protein=item['protein'], carbs=item['carbs'], fat=item['fat'])
+        picks = sorted(rows, key=lambda row: (row.get('kcal') or 0, row.get('fat') or 0))[:3]
+        result = {
+            'nutrition': nutrition,
+            'recommended': [{'id': row.get('id'), 'score': round(1 - min((row.get('kcal') or 0) / 1000, 1), 2)} for row in picks],
+        }
+        if 'summary：' in prompt:
+            result['summary'] = {
+                'totalCalories': sum(row.get('kcal') or 0 for row in picks),
+                'totalProtein': round(sum(row.get('protein') or 0 for row in picks), 1),
+                'totalCarbs': round(sum(row.get('carbs') or 0 for row in picks), 1),
+                'totalFat': round(sum(row.get('fat') or 0 for row in picks), 1),
+            }
+        return 'analyze_menu', _fenced(result)
+
+    if '营养成分' in prompt and 'calories' in prompt and '请分析' in prompt:
+        match = _HEALTH_RE.search(prompt)
+        names = []
+        for line in (match.group(1) if match else '').replace('\\n', '\n').splitlines():
+            name = line.split(':', 1)[0].strip()
+            if name:
+                names.append(name)
+        return 'analyze_health', _fenced([nutrition_of(name) for name in names])
+
+    if '推荐理由' in prompt:
+        reasons = [{'name': dish.get('name'), 'reason': '低脂高蛋白，饱腹感强'} for dish in _dishes_in_prompt(prompt)]
+        return 'explain_recommendations', _fenced(reasons)
+
+    rows = _table_in_prompt(prompt)
+    if '综合营养总结' in prompt:
+        summary = {
+            'totalCalories': sum(row.get('kcal') or 0 for row in rows),
+            'totalProtein': round(sum(row.get('protein') or 0 for row in rows), 1),
+            'totalCarbs': round(sum(row.get('carbs') or 0 for row in rows), 1),
+            'totalFat': round(sum(row.get('fat') or 0 for row in rows), 1),
+        }
+        return 'generate_nutrition_summary', _fenced(summary)
+
+    if '推荐' in prompt:
+        # 只返回编号和评分，与真实提示词要求的格式一致
+        ranked = sorted(rows, key=lambda row: (row.get('kcal') or 0, row.get('fat') or 0))
+        picks = [{'id': row.get('id'), 'score': round(1 - min((row.get('kcal') or 0) / 1000, 1), 2)} for row in ranked[:3]]
+        return 'recommend_dishes', _fenced(picks)
+
+    return 'unknown', '无法识别的请求'
+
+
+class MockSettings:
+    def __init__(self, args):
+        self.latency = args.latency
+        self.latency_ms = args.latency_ms
+        self.jitter_ms = args.jitter_ms
+        self.sigma = args.sigma
+        self.error_rate = args.error_rate
+        self.error_status = args.error_status
+        self.throttle_rate = args.throttle_rate
+        self.retry_after = args.retry_after
+        self.chunk_size = args.chunk_size
+        self.menu_dishes = args.menu_dishes
+        self.unique_dishes = args.unique_dishes
+        self._rng = random.Random(args.seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def sample_latency(self):
+        with self._lock:
+            if self.latency == 'uniform':
+                ms = self._rng.uniform(max(0, self.latency_ms - self.jitter_ms), self.latency_ms + self.jitter_ms)
+            elif self.latency == 'lognormal':
+                # latency_ms 为中位数，sigma 控制长尾
+                ms = self.latency_ms * self._rng.lognormvariate(0, self.sigma)
+            else:
+                ms = self.latency_ms
+        return ms / 1000.0
+
+    def sample_failure(self):
+        """
+        返回需要模拟的错误状态码，不出错时返回 None
+        """
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return self.error_status
+        return None
+
+    def count(self, operation, status):
+        with self._lock:
+            key = f"{operation}:{status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class MockGLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = None
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            body = json.loads(raw)
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'invalid json'}})
+            return
+
+        operation, content = respond(body, self.settings.menu_dishes, self.settings.unique_dishes)
+        failure = self.settings.sample_failure()
+        latency = self.settings.sample_latency()
+
+        if failure is not None:
+            # 出错的请求也有一定延迟，但比正常请求短
+            time.sleep(latency * 0.2)
+            self.settings.count(operation, failure)
+            headers = {'Retry-After': str(self.settings.retry_after)} if failure in (429, 503) else {}
+            self._send_json(failure, {'error': {'code': str(failure), 'message': 'mock upstream error'}}, headers)
+            return
+
+        self.settings.count(operation, 200)
+        usage = {
+            'prompt_tokens': len(raw) // 4,
+            'completion_tokens': len(content) // 2,
+            'total_tokens': len(raw) // 4 + len(content) // 2,
+        }
+        if body.get('stream'):
+            self._stream(body, content, latency, usage)
+            return
+
+        time.sleep(latency)
+        self._send_json(200, {
+            'id': f"mock-{time.time_ns()}",
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage,
+        })
+
+    def _stream(self, body, content, latency, usage):
+        chunks = [content[i:i + self.settings.chunk_size] for i in range(0, len(content), self.settings.chunk_size)]
+        # 首个片段前等待约三分之一的延迟，其余均摊到每个片段
+        first_delay = latency / 3
+        chunk_delay = (latency - first_delay) / max(1, len(chunks))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(first_delay)
+        try:
+            for index, chunk in enumerate(chunks):
+                data = {'model': body.get('model'), 'choices': [{'index': 0, 'delta': {'content': chunk}}]}
+                if index == len(chunks) - 1:
+                    data['usage'] = usage
+                self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, data, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # GET /stats 查看各操作的请求数和状态码分布
+        if self.path == '/stats':
+            self._send_json(200, self.settings.counts)
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的 GLM chat/completions 服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--latency-ms', type=float, default=500, help='固定延迟/均匀分布中心/对数正态中位数（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=200, help='均匀分布的半宽（毫秒）')
+    parser.add_argument('--sigma', type=float, default=0.5, help='对数正态分布的 sigma，越大长尾越重')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 --error-status 的概率')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回 429（带 Retry-After）的概率')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=16, help='流式输出每个片段的字符数')
+    parser.add_argument('--menu-dishes', type=int, default=12, help='菜单识别返回的菜品数量')
+    parser.add_argument('--unique-dishes', action='store_true', help='每张图片返回不同的菜名（压测健康分析）')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    MockGLMHandler.settings = MockSettings(args)
+    server = ThreadingHTTPServer((args.host, args.port), MockGLMHandler)
+    server.daemon_threads = True
+    print(f"Mock GLM server listening on http://{args.host}:{args.port}/api/paas/v4/chat/completions", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
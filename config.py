@@ -1,5 +1,6 @@
 import os
 import logging
+import tempfile
 from dotenv import load_dotenv
 
 # 配置日志
@@ -14,8 +15,118 @@ class Config:
     GLM_4_1V_API_KEY = os.getenv('GLM_4_1V_API_KEY')
     GLM_4_5_AIR_API_KEY = os.getenv('GLM_4_5_AIR_API_KEY')
     
-    # API基础URL
-    API_BASE_URL = 'https://open.bigmodel.cn/api/paas/v4/chat/completions'
+    # API基础URL（压测/离线联调时可指向 benchmarks/mock_glm_server.py）
+    API_BASE_URL = os.getenv('API_BASE_URL', 'https://open.bigmodel.cn/api/paas/v4/chat/completions')
+
+    # HTTP连接池与超时配置（所有GLM服务共享）
+    GLM_HTTP_POOL_CONNECTIONS = int(os.getenv('GLM_HTTP_POOL_CONNECTIONS', '4'))
+    GLM_HTTP_POOL_MAXSIZE = int(os.getenv('GLM_HTTP_POOL_MAXSIZE', '32'))
+    GLM_HTTP_CONNECT_TIMEOUT = float(os.getenv('GLM_HTTP_CONNECT_TIMEOUT', '5'))
+    GLM_HTTP_READ_TIMEOUT = float(os.getenv('GLM_HTTP_READ_TIMEOUT', '60'))
+    GLM_HTTP_MAX_RETRIES = int(os.getenv('GLM_HTTP_MAX_RETRIES', '2'))
+    GLM_HTTP_BACKOFF_FACTOR = float(os.getenv('GLM_HTTP_BACKOFF_FACTOR', '0.5'))
+    GLM_HTTP_BACKOFF_JITTER = float(os.getenv('GLM_HTTP_BACKOFF_JITTER', '0.5'))
+    # 单个请求的总处理时限（秒，0 表示不限制）：各阶段和每次上游请求共享这一预算，超时的阶段返回部分结果
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '50'))
+    # 合并同时在途的相同上游请求（多人同时上传同一张菜单）
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', '1') == '1'
+
+    # 对冲请求（默认关闭）：请求超过最近延迟的第 HEDGE_PERCENTILE 百分位仍未返回时再发一个相同请求，取先返回的
+    # 按服务和调用名分别统计最近 HEDGE_WINDOW 秒的延迟，样本少于 HEDGE_MIN_SAMPLES 时不对冲；对冲比例不超过 HEDGE_MAX_RATE
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '0') == '1'
+    HEDGE_OPERATIONS = os.getenv('HEDGE_OPERATIONS', 'recognize_menu')
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.5'))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', '0.1'))
+    HEDGE_WINDOW = float(os.getenv('HEDGE_WINDOW', '300'))
+
+    # 静态文件（除入口页面外）的浏览器缓存时间（秒），入口页面每次都用 ETag 验证
+    STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '3600'))
+
+    # 上游限流（按模型/API密钥）：令牌桶速率、突发量、并发上限、等待队列长度和最长等待秒数
+    # 默认关闭：下面的数值只是占位，开启前按所用账号在 GLM 平台的实际配额设置（或用 GLM_RATE_LIMITS 按模型设置）
+    # 限额按进程计算（同一进程内同步和异步请求共用），多进程部署时每个进程各自限流，按进程数分摊账号配额
+    # 流式请求从发出到输出读完（或被关闭）都占用并发名额
+    GLM_RATE_LIMIT_ENABLED = os.getenv('GLM_RATE_LIMIT_ENABLED', '0') == '1'
+    GLM_RATE_QPS = float(os.getenv('GLM_RATE_QPS', '5'))
+    GLM_RATE_BURST = int(os.getenv('GLM_RATE_BURST', '10'))
+    GLM_MAX_CONCURRENCY = int(os.getenv('GLM_MAX_CONCURRENCY', '8'))
+    GLM_RATE_QUEUE_SIZE = int(os.getenv('GLM_RATE_QUEUE_SIZE', '64'))
+    GLM_RATE_MAX_WAIT = float(os.getenv('GLM_RATE_MAX_WAIT', '10'))
+    # 按模型覆盖速率和并发，如 "glm-4v-flash=2:4,glm-4-flash=10:16"
+    GLM_RATE_LIMITS = os.getenv('GLM_RATE_LIMITS', '')
+
+    # 是否记录运行指标（/metrics）
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+    # 阶段结果缓存配置（内存LRU + 本地磁盘）
+    STAGE_CACHE_ENABLED = os.getenv('STAGE_CACHE_ENABLED', '1') == '1'
+    STAGE_CACHE_DIR = os.getenv('STAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'menu_ocr_stage_cache'))
+    STAGE_CACHE_MAX_ENTRIES = int(os.getenv('STAGE_CACHE_MAX_ENTRIES', '1024'))
+    STAGE_CACHE_TTL = int(os.getenv('STAGE_CACHE_TTL', '3600'))
+    STAGE_CACHE_DISK_TTL = int(os.getenv('STAGE_CACHE_DISK_TTL', str(7 * 24 * 3600)))
+
+    # 菜品级营养数据存储（SQLite），健康分析只把未见过的菜品发给大模型
+    DISH_STORE_ENABLED = os.getenv('DISH_STORE_ENABLED', '1') == '1'
+    DISH_STORE_PATH = os.getenv('DISH_STORE_PATH', os.path.join(tempfile.gettempdir(), 'menu_ocr_dishes.sqlite3'))
+
+    # 本地菜品营养知识库：内置常见菜品，按菜名模糊匹配，命中的菜品不再交给大模型分析
+    NUTRITION_KB_ENABLED = os.getenv('NUTRITION_KB_ENABLED', '1') == '1'
+    # 追加的知识库 JSON 文件（格式同 app/data/dish_nutrition.json），多个用路径分隔符分隔，同名菜品后者覆盖前者
+    NUTRITION_KB_PATHS = os.getenv('NUTRITION_KB_PATHS', '')
+    # 模糊匹配的最低置信度（1 - 编辑距离/菜名长度，易混字替换按 0.25 计）
+    NUTRITION_KB_MIN_CONFIDENCE = float(os.getenv('NUTRITION_KB_MIN_CONFIDENCE', '0.8'))
+
+    # 图片预处理配置：最长边像素和重新编码的JPEG质量
+    IMAGE_PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS_ENABLED', '1') == '1'
+    IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '2048'))
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+
+    # 超大/多栏菜单分块识别：最长边超过阈值时切分为带重叠的分块并发识别
+    TILING_ENABLED = os.getenv('TILING_ENABLED', '1') == '1'
+    TILE_TRIGGER_SIDE = int(os.getenv('TILE_TRIGGER_SIDE', '4096'))
+    TILE_SIZE = int(os.getenv('TILE_SIZE', '2048'))
+    TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', '0.1'))
+    TILE_MAX = int(os.getenv('TILE_MAX', '6'))
+
+    # 批量任务后台线程池配置
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    # 排队中的图片原始字节保存在内存中，按总字节数（默认 256MB）而不是图片张数限制
+    JOB_MAX_PENDING_BYTES = int(os.getenv('JOB_MAX_PENDING_BYTES', str(256 * 1024 * 1024)))
+    JOB_MAX_RETAINED = int(os.getenv('JOB_MAX_RETAINED', '100'))
+
+    # 健康分析分批并发配置
+    HEALTH_BATCH_SIZE = int(os.getenv('HEALTH_BATCH_SIZE', '15'))
+    HEALTH_BATCH_MAX_CHARS = int(os.getenv('HEALTH_BATCH_MAX_CHARS', '600'))
+    HEALTH_MAX_CONCURRENCY = int(os.getenv('HEALTH_MAX_CONCURRENCY', '4'))
+
+    # 流式菜单识别：边识别边把已完成的菜品按小批次送去健康分析（分块识别时不使用）
+    MENU_STREAM_ENABLED = os.getenv('MENU_STREAM_ENABLED', '1') == '1'
+    HEALTH_STREAM_BATCH_SIZE = int(os.getenv('HEALTH_STREAM_BATCH_SIZE', '5'))
+
+    # 文本分析模式：staged 健康分析/推荐/营养总结分别调用；fused 推荐交给大模型时合并为一次调用
+    # fused 只在 RECOMMENDATION_MODE=llm 时生效（推荐为本地排序时，分阶段调用本来就只有健康分析一次大模型调用），否则仍分阶段调用
+    ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'staged')
+    # 超过该菜品数时合并调用的输出过长，退回分阶段调用（健康分析可分批并发）
+    FUSED_MAX_DISHES = int(os.getenv('FUSED_MAX_DISHES', '40'))
+
+    # 推荐/营养总结提示词中菜品表的 token 预算（估算值），超出的菜品不发送
+    PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+
+    # 营养总结模式：local 本地聚合计算，llm 交给大模型
+    NUTRITION_SUMMARY_MODE = os.getenv('NUTRITION_SUMMARY_MODE', 'local')
+    # 本地模式下菜品缺少营养字段时退回大模型（默认关闭，缺失字段按0计）
+    NUTRITION_SUMMARY_LLM_FALLBACK = os.getenv('NUTRITION_SUMMARY_LLM_FALLBACK', '0') == '1'
+
+    # 菜品推荐模式：local 本地评分排序，llm 交给大模型排序
+    RECOMMENDATION_MODE = os.getenv('RECOMMENDATION_MODE', 'local')
+    RECOMMENDATION_TOP_N = int(os.getenv('RECOMMENDATION_TOP_N', '3'))
+    RECOMMENDATION_WEIGHT_CALORIES = float(os.getenv('RECOMMENDATION_WEIGHT_CALORIES', '0.4'))
+    RECOMMENDATION_WEIGHT_FAT = float(os.getenv('RECOMMENDATION_WEIGHT_FAT', '0.3'))
+    RECOMMENDATION_WEIGHT_PROTEIN = float(os.getenv('RECOMMENDATION_WEIGHT_PROTEIN', '0.3'))
+    # 本地排序后是否调用大模型生成推荐理由
+    RECOMMENDATION_LLM_REASONS = os.getenv('RECOMMENDATION_LLM_REASONS', '0') == '1'
     
     # 验证配置
     @classmethod
@@ -0,0 +1,8 @@
+import os
+
+# 服务类在初始化时检查 API 密钥；测试不访问真实的 GLM 服务
+os.environ.setdefault('GLM_4_1V_API_KEY', 'test-key')
+os.environ.setdefault('GLM_4_5_AIR_API_KEY', 'test-key')
+# 不读写本机的阶段缓存和菜品营养库
+os.environ.setdefault('STAGE_CACHE_ENABLED', '0')
+os.environ.setdefault('DISH_STORE_ENABLED', '0')
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from app.business.batch_jobs import JobManager, JobQueueFullError, JobTooLargeError
+
+
+def _wait_until(condition, timeout=2):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.01)
+
+
+def _wait_finished(job):
+    _wait_until(lambda: job.finished_at is not None)
+
+
+def test_jobs_run_every_image():
+    manager = JobManager(lambda data: {'size': len(data)}, max_workers=2, max_pending_bytes=1024)
+    job = manager.submit([('a.jpg', b'x' * 10), ('b.jpg', b'y' * 20)])
+    _wait_finished(job)
+
+    data = job.to_dict(include_results=True)
+    assert data['status'] == 'completed'
+    assert [item['result'] for item in data['items']] == [{'size': 10}, {'size': 20}]
+    assert data['progress']['completed'] == 2
+
+
+def test_backpressure_counts_bytes_not_images():
+    release = threading.Event()
+    manager = JobManager(lambda data: release.wait(2), max_workers=1, max_pending_bytes=100)
+    try:
+        # 很多张小图片可以排队
+        manager.submit([(f'{i}.jpg', b'x') for i in range(50)])
+        with pytest.raises(JobQueueFullError):
+            manager.submit([('big.jpg', b'x' * 60)])
+        with pytest.raises(JobTooLargeError):
+            manager.submit([('huge.jpg', b'x' * 101)])
+    finally:
+        release.set()
+
+
+def test_pending_bytes_are_released_after_processing():
+    manager = JobManager(lambda data: None, max_workers=1, max_pending_bytes=100)
+    job = manager.submit([('a.jpg', b'x' * 80)])
+    _wait_finished(job)
+    _wait_until(lambda: manager._pending_bytes == 0)
+    manager.submit([('b.jpg', b'x' * 80)])
+
+
+def test_failed_items_are_reported():
+    def runner(data):
+        if data == b'bad':
+            raise ValueError('unreadable image')
+        return {}
+
+    manager = JobManager(runner, max_workers=1, max_pending_bytes=100)
+    job = manager.submit([('good.jpg', b'ok'), ('bad.jpg', b'bad')])
+    _wait_finished(job)
+
+    data = job.to_dict()
+    assert data['status'] == 'partial'
+    assert data['items'][1]['error'] == 'unreadable image'
+    assert 'result' not in data['items'][0]
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from app.services.deadline import (
+    Deadline, DeadlineExceeded, find_deadline_error, is_degraded, mark_degraded, remaining, stage_status,
+)
+
+
+def test_start_without_budget_returns_none():
+    assert Deadline.start(0) is None
+    assert isinstance(Deadline.start(5), Deadline)
+
+
+def test_check_raises_once_expired():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check('recognize_menu')
+
+
+def test_bound_caps_timeouts_to_remaining_budget():
+    deadline = Deadline(1)
+    assert deadline.bound(30) <= 1
+    assert deadline.bound(0.2) == 0.2
+    assert deadline.bound(None) <= 1
+
+
+def test_mark_degraded_accepts_missing_deadline():
+    # 批量任务等没有时限的调用方
+    mark_degraded(None, 'summary')
+    assert not is_degraded(None, 'summary')
+    assert remaining(None) is None
+
+    deadline = Deadline(5)
+    mark_degraded(deadline, 'summary')
+    assert is_degraded(deadline, 'summary')
+
+
+def test_stage_status_reports_degraded_stages():
+    deadline = Deadline(5)
+    mark_degraded(deadline, 'nutrition')
+    status = stage_status(deadline)
+    assert status['nutrition'] != status['menu']
+
+
+def test_find_deadline_error_follows_exception_chain():
+    try:
+        try:
+            raise DeadlineExceeded('budget')
+        except DeadlineExceeded as e:
+            raise RuntimeError('wrapped') from e
+    except RuntimeError as e:
+        assert isinstance(find_deadline_error(e), DeadlineExceeded)
+    assert find_deadline_error(ValueError('x')) is None
@@ -0,0 +1,37 @@
+import json
+import math
+
+import pytest
+
+from app.business.dish import Dish
+from app.business.nutrition_columns import to_number
+
+
+@pytest.mark.parametrize('value', [float('inf'), float('-inf'), float('nan'), 10 ** 400, 'Infinity', None, 'n/a'])
+def test_non_finite_numbers_are_treated_as_missing(value):
+    dish = Dish.from_dict({'name': '宫保鸡丁', 'calories': value, 'price': value})
+    assert dish.calories is None
+    assert dish.price == 0.0
+
+
+def test_infinity_from_model_json_does_not_reach_the_response():
+    # json.loads 接受 Infinity 和 1e999
+    data = json.loads('{"name": "宫保鸡丁", "calories": Infinity, "protein": 1e999, "fat": "12g"}')
+    dish = Dish.from_dict(data)
+    assert dish.to_dict() == {'name': '宫保鸡丁', 'description': '', 'price': 0.0, 'fat': 12.0}
+    json.dumps(dish.to_dict(), allow_nan=False)
+
+
+@pytest.mark.parametrize('value, expected', [(350, 350.0), ('约12.5g', 12.5), ('350kcal', 350.0), (True, None)])
+def test_to_number(value, expected):
+    result = to_number(value)
+    assert (math.isnan(result) and expected is None) or result == expected
+
+
+def test_with_nutrition_keeps_menu_fields():
+    dish = Dish('宫保鸡丁', '花生', 38)
+    merged = dish.with_nutrition({'name': 'x', 'price': 1, 'calories': '520', 'healthDescription': 'y', 'extra': 1})
+    assert (merged.name, merged.price, merged.calories) == ('宫保鸡丁', 38, 520.0)
+    assert merged.health_description is None
+    assert merged.extra == {'extra': 1}
+    assert dish.calories is None
@@ -0,0 +1,49 @@
+from app.business.dish import Dish
+from app.services.dish_store import DishNutritionStore
+
+
+def _analyzed(name, calories, description=''):
+    dish = Dish(name, description)
+    return dish, dish.with_nutrition({'calories': calories, 'protein': 10, 'carbs': 20, 'fat': 5})
+
+
+def _put(store, name, calories, prompt_version):
+    dish, analyzed = _analyzed(name, calories)
+    return store.put_many([dish], [analyzed], prompt_version)
+
+
+def test_put_then_get_by_normalized_name(tmp_path):
+    store = DishNutritionStore(str(tmp_path / 'dishes.db'))
+    dish, analyzed = _analyzed('宫保鸡丁', 520, '微辣')
+
+    assert store.put_many([dish], [analyzed], 'v1') == 1
+    # 全角、大小写、空白和标点不影响命中
+    found = store.get_many([Dish('其他菜'), Dish(' 宫保鸡丁！', '微辣')], 'v1')
+
+    assert found == {1: {'calories': 520.0, 'protein': 10.0, 'carbs': 20.0, 'fat': 5.0}}
+
+
+def test_other_prompt_version_misses(tmp_path):
+    store = DishNutritionStore(str(tmp_path / 'dishes.db'))
+    _put(store, '宫保鸡丁', 520, 'v1')
+
+    # 提示词升级后旧结果不再使用
+    assert store.get_many([Dish('宫保鸡丁')], 'v2') == {}
+    assert 0 in store.get_many([Dish('宫保鸡丁')], 'v1')
+
+
+def test_incomplete_nutrition_is_not_written(tmp_path):
+    store = DishNutritionStore(str(tmp_path / 'dishes.db'))
+    dish = Dish('清炒时蔬')
+    partial = dish.with_nutrition({'calories': 120})
+
+    assert store.put_many([dish], [partial], 'v1') == 0
+    assert store.get_many([dish], 'v1') == {}
+
+
+def test_rewrite_replaces_the_previous_row(tmp_path):
+    store = DishNutritionStore(str(tmp_path / 'dishes.db'))
+    _put(store, '宫保鸡丁', 520, 'v1')
+    _put(store, '宫保鸡丁', 480, 'v1')
+
+    assert store.get_many([Dish('宫保鸡丁')], 'v1')[0]['calories'] == 480.0
@@ -0,0 +1,98 @@
+import io
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from app import create_app, routes
+from benchmarks import mock_glm_server
+from config import Config
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def upstream_latency_ms():
+    return 0
+
+
+@pytest.fixture
+def client(monkeypatch, upstream_latency_ms):
+    """
+    指向本地模拟 GLM 服务的 Flask 测试客户端（不消耗真实配额）
+    """
+    options = SimpleNamespace(
+        latency='fixed', latency_ms=upstream_latency_ms, jitter_ms=0, sigma=0, error_rate=0, error_status=503,
+        throttle_rate=0, retry_after=1, chunk_size=32, menu_dishes=6, unique_dishes=True, seed=1,
+    )
+    monkeypatch.setattr(mock_glm_server.MockGLMHandler, 'settings', mock_glm_server.MockSettings(options))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), mock_glm_server.MockGLMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(Config, 'API_BASE_URL', f'http://127.0.0.1:{server.server_port}/api/paas/v4/chat/completions')
+    # 让路由按新的上游地址重新创建服务
+    monkeypatch.setattr(routes, 'glm41v_service', None)
+    try:
+        yield create_app().test_client()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _upload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), 'white').save(buffer, 'JPEG')
+    return {'image': (io.BytesIO(buffer.getvalue()), 'menu.jpg')}
+
+
+@pytest.mark.parametrize('streamed', [False, True])
+def test_process_menu_against_mock_upstream(client, monkeypatch, streamed):
+    monkeypatch.setattr(Config, 'MENU_STREAM_ENABLED', streamed)
+    response = client.post('/api/process-menu', data=_upload(), content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert len(result['dishList']) == 6
+    assert all('calories' in dish for dish in result['dishList'])
+    assert 1 <= len(result['recommendedDishes']) <= len(result['dishList'])
+    assert result['partial'] is False
+    assert set(result['stageStatus']) == {'menu', 'nutrition', 'recommendations', 'summary'}
+
+
+def test_stream_endpoint_emits_every_stage(client):
+    response = client.post('/api/process-menu/stream', data=_upload(), content_type='multipart/form-data')
+
+    events = [line.split(': ', 1)[1] for line in response.get_data(as_text=True).splitlines()
+              if line.startswith('event: ')]
+    assert events == ['menu', 'nutrition', 'recommendations', 'summary', 'done']
+
+
+@pytest.mark.parametrize('upstream_latency_ms', [400])
+def test_stream_endpoint_sends_menu_before_health_analysis_finishes(client, monkeypatch, upstream_latency_ms):
+    # 流式识别与健康分析重叠时，menu 事件应在识别完成时立即发出，而不是和 nutrition 一起到达
+    monkeypatch.setattr(Config, 'MENU_STREAM_ENABLED', True)
+    start = time.perf_counter()
+    response = client.post('/api/process-menu/stream', data=_upload(), content_type='multipart/form-data',
+                           buffered=False)
+
+    arrivals = {}
+    for chunk in response.response:
+        text = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        for line in text.splitlines():
+            if line.startswith('event: '):
+                arrivals.setdefault(line.split(': ', 1)[1], time.perf_counter() - start)
+    response.close()
+
+    assert list(arrivals) == ['menu', 'nutrition', 'recommendations', 'summary', 'done']
+    # 健康分析的上游调用还需要一个完整的延迟
+    assert arrivals['nutrition'] - arrivals['menu'] >= upstream_latency_ms / 1000 * 0.5
+
+
+def test_missing_image_is_rejected(client):
+    response = client.post('/api/process-menu', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert json.loads(response.get_data(as_text=True)) == {'error': '没有找到图片文件'}
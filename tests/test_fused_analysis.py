@@ -0,0 +1,73 @@
+import json
+
+from app.business.dish import Dish
+from app.business.fused_analysis import FusedAnalysis
+from app.business.health_analysis import HealthAnalysis
+from app.business.nutrition_summary import NutritionSummary
+from app.business.recommendation_engine import RecommendationEngine
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.stage_cache import StageCache
+
+
+class _Service:
+    """
+    合并分析返回营养信息和推荐编号但没有总结，单独的营养总结调用超时
+    """
+    MODEL = 'glm-test'
+    FUSED_PROMPT_VERSION = 'v-test'
+    SUMMARY_PROMPT_VERSION = 'v-test'
+
+    def analyze_menu(self, dish_list, summarize=True, deadline=None):
+        content = json.dumps({
+            'nutrition': [{'id': f'd{i + 1}', 'calories': 300, 'protein': 20, 'carbs': 10, 'fat': 5}
+                          for i in range(len(dish_list))],
+            'recommended': ['d1'],
+        })
+        return {'choices': [{'message': {'content': content}}]}
+
+    def generate_nutrition_summary(self, dishes, deadline=None):
+        raise DeadlineExceeded('summary')
+
+
+def _fused(service, cache=None, recommendation_mode='llm'):
+    return FusedAnalysis(
+        service, HealthAnalysis(service), RecommendationEngine(service, mode=recommendation_mode, llm_reasons=False),
+        NutritionSummary(service, mode='llm'), cache=cache, mode='fused',
+    )
+
+
+def test_fused_mode_with_local_ranking_warns_and_stays_staged(capsys):
+    fused = _fused(_Service(), recommendation_mode='local')
+
+    assert 'RECOMMENDATION_MODE=llm' in capsys.readouterr().out
+    assert fused.applies_to() is False
+
+
+def test_degraded_result_is_not_cached(tmp_path):
+    cache = StageCache(cache_dir=str(tmp_path), max_entries=10, ttl=60, disk_ttl=60)
+    fused = _fused(_Service(), cache=cache)
+    dishes = [Dish('宫保鸡丁', price=38), Dish('清炒时蔬', price=22)]
+    deadline = Deadline(30)
+
+    dish_list, recommended, summary = fused.analyze(dishes, deadline)
+
+    assert [dish.calories for dish in dish_list] == [300.0, 300.0]
+    assert [dish.name for dish in recommended] == ['宫保鸡丁']
+    # 营养总结超时后使用本地聚合，标为 partial
+    assert summary['source'] == 'local'
+    assert deadline.degraded == {'summary'}
+    assert cache.get(fused._stage_cache_key(dishes)) is None
+
+
+def test_complete_result_is_cached(tmp_path):
+    class _CompleteService(_Service):
+        def generate_nutrition_summary(self, dishes, deadline=None):
+            return {'choices': [{'message': {'content': '{"totalCalories": 300}'}}]}
+
+    cache = StageCache(cache_dir=str(tmp_path), max_entries=10, ttl=60, disk_ttl=60)
+    fused = _fused(_CompleteService(), cache=cache)
+    dishes = [Dish('宫保鸡丁', price=38)]
+
+    fused.analyze(dishes, Deadline(30))
+
+    assert cache.get(fused._stage_cache_key(dishes))['nutritionSummary'] == {'totalCalories': 300}
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import threading
+
+from app.business.dish import Dish
+from app.business.health_analysis import AsyncHealthAnalysis, HealthAnalysis
+from config import Config
+
+
+class _HealthService:
+    """
+    按菜名返回营养信息的 GLM-4.5-Air 替身，记录每次调用的菜品
+    """
+    MODEL = 'glm-test'
+    HEALTH_PROMPT_VERSION = 'v-test'
+
+    def __init__(self, reply=None, release=None):
+        self.calls = []
+        self.reply = reply or (lambda batch: [{'name': dish.name, 'calories': 100 + len(dish.name)} for dish in batch])
+        # 设置后调用会阻塞到 release 被 set，用于观察与其他阶段的重叠
+        self.release = release
+        self._lock = threading.Lock()
+
+    def analyze_health(self, batch, deadline=None):
+        with self._lock:
+            self.calls.append([dish.name for dish in batch])
+        if self.release is not None:
+            assert self.release.wait(5)
+        content = json.dumps(self.reply(batch), ensure_ascii=False)
+        return {'choices': [{'message': {'content': content}}]}
+
+
+class _AsyncHealthService(_HealthService):
+    async def analyze_health(self, batch, deadline=None):
+        return _HealthService.analyze_health(self, batch, deadline)
+
+
+def _dishes():
+    return [Dish('宫保鸡丁', price=38), Dish('清炒时蔬', price=22)]
+
+
+def test_merge_by_id_does_not_leak_dish_ids():
+    analysis = HealthAnalysis(glm45_air_service=None)
+    items = [{'id': 'd2', 'calories': 120, 'protein': 4}, {'id': 'd1', 'calories': 520, 'protein': 30}]
+
+    merged, misses, results = analysis.merge_by_id(items, _dishes(), known={})
+
+    assert [dish.calories for dish in merged] == [520.0, 120.0]
+    assert all('id' not in dish.to_dict() for dish in merged)
+    assert [dish.name for dish in misses] == ['清炒时蔬', '宫保鸡丁']
+    assert all('id' not in dish.to_dict() for dish in results)
+
+
+def test_merge_by_id_keeps_known_nutrition():
+    analysis = HealthAnalysis(glm45_air_service=None)
+    items = [{'id': 'd1', 'calories': 999}, {'id': 'd9', 'calories': 1}]
+
+    merged, misses, _ = analysis.merge_by_id(items, _dishes(), known={0: {'calories': 500}})
+
+    assert merged[0].calories == 500.0
+    assert merged[1].calories is None
+    assert misses == []
+
+
+def test_analyze_stream_submits_batches_while_dishes_are_still_arriving(monkeypatch):
+    monkeypatch.setattr(Config, 'HEALTH_STREAM_BATCH_SIZE', 2)
+    service = _HealthService()
+    analysis = HealthAnalysis(service)
+    first_batch_sent = threading.Event()
+    original = service.analyze_health
+
+    def analyze_health(batch, deadline=None):
+        first_batch_sent.set()
+        return original(batch, deadline)
+    service.analyze_health = analyze_health
+
+    def dishes():
+        yield Dish('宫保鸡丁')
+        yield Dish('清炒时蔬')
+        # 第一个批次在识别仍在进行时就已经提交
+        assert first_batch_sent.wait(5)
+        yield Dish('麻婆豆腐')
+
+    stages = list(analysis.analyze_stream(dishes()))
+
+    assert [stage for stage, _ in stages] == ['menu', 'nutrition']
+    assert [dish.name for dish in stages[0][1]] == ['宫保鸡丁', '清炒时蔬', '麻婆豆腐']
+    assert [dish.calories for dish in stages[1][1]] == [104.0, 104.0, 104.0]
+    assert service.calls == [['宫保鸡丁', '清炒时蔬'], ['麻婆豆腐']]
+
+
+def test_analyze_stream_yields_menu_before_analysis_finishes():
+    release = threading.Event()
+    analysis = HealthAnalysis(_HealthService(release=release))
+
+    stream = analysis.analyze_stream(iter([Dish('宫保鸡丁')]))
+    stage, dish_list = next(stream)
+    # 此时健康分析仍阻塞在上游调用中
+    assert (stage, [dish.name for dish in dish_list]) == ('menu', ['宫保鸡丁'])
+
+    release.set()
+    stage, nutrition = next(stream)
+    assert (stage, nutrition[0].calories) == ('nutrition', 104.0)
+
+
+def test_async_analyze_stream_yields_menu_before_analysis_finishes():
+    async def run():
+        analysis = AsyncHealthAnalysis(_AsyncHealthService())
+        gate = asyncio.Event()
+        original = analysis.glm45_air_service.analyze_health
+
+        async def analyze_health(batch, deadline=None):
+            await gate.wait()
+            return await original(batch, deadline)
+        analysis.glm45_air_service.analyze_health = analyze_health
+
+        async def dishes():
+            yield Dish('宫保鸡丁')
+
+        stream = analysis.analyze_stream(dishes())
+        stage, dish_list = await stream.__anext__()
+        assert (stage, [dish.name for dish in dish_list]) == ('menu', ['宫保鸡丁'])
+
+        gate.set()
+        stage, nutrition = await stream.__anext__()
+        assert (stage, nutrition[0].calories) == ('nutrition', 104.0)
+
+    asyncio.run(run())
+
+
+class _RecordingStore:
+    def __init__(self):
+        self.saved = []
+        # 记录每次读写所在的线程
+        self.threads = []
+
+    def get_many(self, dish_list, prompt_version):
+        self.threads.append(threading.get_ident())
+        return {}
+
+    def put_many(self, dish_list, nutrition_list, prompt_version):
+        self.threads.append(threading.get_ident())
+        self.saved.extend((dish.name, nutrition.calories) for dish, nutrition in zip(dish_list, nutrition_list))
+
+
+def _reply(*items):
+    return lambda batch: list(items)
+
+
+def test_reordered_items_are_matched_by_name():
+    service = _HealthService(reply=_reply({'name': '清炒时蔬', 'calories': 120}, {'name': '宫保鸡丁', 'calories': 520}))
+    store = _RecordingStore()
+    analysis = HealthAnalysis(service, dish_store=store)
+
+    result = analysis.analyze(_dishes())
+
+    assert [dish.calories for dish in result] == [520.0, 120.0]
+    assert sorted(store.saved) == [('宫保鸡丁', 520.0), ('清炒时蔬', 120.0)]
+
+
+def test_missing_item_does_not_shift_neighbours_and_is_not_persisted():
+    dishes = [Dish('宫保鸡丁'), Dish('清炒时蔬'), Dish('麻婆豆腐')]
+    # 大模型漏掉了第二道菜
+    service = _HealthService(reply=_reply({'name': '宫保鸡丁', 'calories': 520}, {'name': '麻婆豆腐', 'calories': 300}))
+    store = _RecordingStore()
+    analysis = HealthAnalysis(service, dish_store=store)
+
+    result = analysis.analyze(dishes)
+
+    assert [dish.calories for dish in result] == [520.0, None, 300.0]
+    assert sorted(store.saved) == [('宫保鸡丁', 520.0), ('麻婆豆腐', 300.0)]
+
+
+def test_items_with_unknown_names_are_discarded():
+    service = _HealthService(reply=_reply({'name': '水煮鱼', 'calories': 800}, {'calories': 100}))
+    store = _RecordingStore()
+    analysis = HealthAnalysis(service, dish_store=store)
+
+    result = analysis.analyze(_dishes())
+
+    assert [dish.calories for dish in result] == [None, None]
+    assert store.saved == []
+
+
+def test_names_are_compared_after_normalization():
+    service = _HealthService(reply=_reply({'name': ' 宫保鸡丁 ', 'calories': 520}, {'name': '清炒时蔬。', 'calories': 120}))
+    analysis = HealthAnalysis(service)
+
+    assert [dish.calories for dish in analysis.analyze(_dishes())] == [520.0, 120.0]
+
+
+def _menu(count):
+    return [Dish(f'菜品{i}', '家常做法') for i in range(count)]
+
+
+def test_split_batches_by_dish_count():
+    analysis = HealthAnalysis(None, batch_size=2, batch_max_chars=10000)
+
+    batches = analysis._split_batches(_menu(5))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_split_batches_by_prompt_chars():
+    # 每道菜 3 + 4 + 2 = 9 个字符，上限 20 时每批最多两道
+    analysis = HealthAnalysis(None, batch_size=10, batch_max_chars=20)
+
+    batches = analysis._split_batches(_menu(5))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [dish.name for batch in batches for dish in batch] == [dish.name for dish in _menu(5)]
+
+
+def test_oversized_dish_gets_its_own_batch():
+    analysis = HealthAnalysis(None, batch_size=10, batch_max_chars=20)
+    dishes = [Dish('菜品0'), Dish('超长菜名' * 10), Dish('菜品2')]
+
+    assert [len(batch) for batch in analysis._split_batches(dishes)] == [1, 1, 1]
+
+
+def test_batches_run_concurrently():
+    # 三个批次必须同时在途才能通过栅栏
+    barrier = threading.Barrier(3, timeout=5)
+
+    def reply(batch):
+        barrier.wait()
+        return [{'name': dish.name, 'calories': 100} for dish in batch]
+
+    service = _HealthService(reply=reply)
+    analysis = HealthAnalysis(service, batch_size=1, max_concurrency=3)
+
+    result = analysis.analyze(_menu(3))
+
+    assert len(service.calls) == 3
+    assert [dish.calories for dish in result] == [100.0, 100.0, 100.0]
+
+
+def test_batch_results_merge_back_in_menu_order():
+    release_first = threading.Event()
+
+    def reply(batch):
+        if batch[0].name == '菜品0':
+            # 第一个批次最后返回
+            assert release_first.wait(5)
+        else:
+            release_first.set()
+        # 每个批次只返回第一道菜
+        return [{'name': batch[0].name, 'calories': 100 + int(batch[0].name[-1])}]
+
+    analysis = HealthAnalysis(_HealthService(reply=reply), batch_size=2, max_concurrency=2)
+
+    result = analysis.analyze(_menu(4))
+
+    assert [dish.name for dish in result] == ['菜品0', '菜品1', '菜品2', '菜品3']
+    assert [dish.calories for dish in result] == [100.0, None, 102.0, None]
+
+
+def test_async_batches_merge_back_in_menu_order():
+    analysis = AsyncHealthAnalysis(
+        _AsyncHealthService(reply=lambda batch: [{'name': batch[-1].name, 'calories': 50}]),
+        batch_size=2, max_concurrency=2,
+    )
+
+    result = asyncio.run(analysis.analyze(_menu(3)))
+
+    assert [dish.name for dish in result] == ['菜品0', '菜品1', '菜品2']
+    assert [dish.calories for dish in result] == [None, 50.0, 50.0]
+
+
+def test_async_store_io_runs_off_the_event_loop():
+    store = _RecordingStore()
+    analysis = AsyncHealthAnalysis(_AsyncHealthService(), dish_store=store)
+
+    async def run():
+        result = await analysis.analyze(_dishes())
+        return threading.get_ident(), result
+
+    loop_thread, result = asyncio.run(run())
+
+    assert [dish.calories for dish in result] == [104.0, 104.0]
+    assert len(store.threads) == 2
+    assert loop_thread not in store.threads
+
+
+def test_async_stream_store_io_runs_off_the_event_loop():
+    store = _RecordingStore()
+    analysis = AsyncHealthAnalysis(_AsyncHealthService(), dish_store=store)
+
+    async def dishes():
+        for dish in _dishes():
+            yield dish
+
+    async def run():
+        stages = [stage async for stage in analysis.analyze_stream(dishes())]
+        return threading.get_ident(), stages
+
+    loop_thread, stages = asyncio.run(run())
+
+    assert [stage for stage, _ in stages] == ['menu', 'nutrition']
+    assert store.threads and loop_thread not in store.threads
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from app.services.hedging import HedgePolicy, LatencyHistogram, RequestHedger
+
+
+def _policy(**kwargs):
+    options = dict(percentile=95, min_delay=0.02, min_samples=5, max_rate=1.0, window=60)
+    options.update(kwargs)
+    policy = HedgePolicy('test-model', 'recognize_menu', **options)
+    for _ in range(5):
+        policy.latency.observe(0.01)
+    return policy
+
+
+def test_histogram_percentile_is_bucket_upper_bound():
+    histogram = LatencyHistogram(60)
+    assert histogram.percentile(95) is None
+    for seconds in (0.1,) * 19 + (2.0,):
+        histogram.observe(seconds)
+    assert 0.1 <= histogram.percentile(90) < 0.11
+    assert 2.0 <= histogram.percentile(100) < 2.2
+
+
+def test_no_hedging_without_enough_samples():
+    policy = HedgePolicy('test-model', 'recognize_menu', min_samples=5, max_rate=1.0, window=60)
+    assert policy.delay() is None
+    assert policy.call(lambda cancelled: 'ok') == 'ok'
+    assert policy.hedged == 0
+
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    policy = _policy()
+    legs = []
+    release_primary = threading.Event()
+
+    def attempt(cancelled):
+        legs.append(cancelled)
+        if len(legs) == 1:
+            release_primary.wait(1)
+            return 'primary'
+        return 'hedge'
+
+    try:
+        assert policy.call(attempt) == 'hedge'
+    finally:
+        release_primary.set()
+    assert (policy.hedged, policy.won) == (1, 1)
+    # 另一路已返回，原请求不再重试
+    assert legs[0].is_set()
+
+
+def test_hedge_rate_is_capped():
+    policy = _policy(max_rate=0.0)
+    assert policy.call(lambda cancelled: time.sleep(0.05) or 'primary') == 'primary'
+    assert (policy.hedged, policy.capped) == (0, 1)
+
+
+def test_each_service_has_its_own_executor():
+    vision = RequestHedger('glm-4v', enabled=True, operations=['recognize_menu'], max_workers=2)
+    text = RequestHedger('glm-4', enabled=True, operations=['recognize_menu'], max_workers=2)
+
+    assert vision.policy('recognize_menu').executor is vision.executor
+    assert vision.policy('recognize_menu', stream=True).executor is vision.executor
+    assert vision.executor is not text.executor
+    assert RequestHedger('glm-4', enabled=False).policy('recognize_menu') is None
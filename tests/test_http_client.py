@@ -0,0 +1,344 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from app.business.pipeline import error_response
+from app.services import rate_limiter
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.http_client import AsyncGLMHttpClient, GLMHttpClient, get_shared_session
+from app.services.rate_limiter import UpstreamOverloadedError
+from config import Config
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    """
+    按顺序返回预先设定的响应：(状态码, 响应头, 响应体[, 响应前等待的秒数])；响应体为列表时按 SSE 逐段输出
+    """
+    protocol_version = 'HTTP/1.1'
+    script = []
+    requests = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        type(self).requests.append(self.path)
+        status, headers, body, *delay = type(self).script.pop(0) if type(self).script else (200, {}, {'choices': []})
+        if delay:
+            time.sleep(delay[0])
+        if isinstance(body, list):
+            self.send_response(status)
+            # 与真实上游一样使用分块传输，每个数据块到达后客户端即可读到
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in body:
+                if callable(chunk):
+                    # 在两段之间等待测试观察客户端状态
+                    chunk()
+                    continue
+                data = {'choices': [{'delta': {'content': chunk}}]}
+                self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+            return
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    本地脚本化的上游服务，返回其 chat/completions 地址
+    """
+    monkeypatch.setattr(_ScriptedHandler, 'script', [])
+    monkeypatch.setattr(_ScriptedHandler, 'requests', [])
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ScriptedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}/api/paas/v4/chat/completions'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    # 每个测试使用独立的限流器（并发上限 1）
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMITS', 'glm-test=100:1')
+    monkeypatch.setattr(rate_limiter, '_limiters', {})
+    monkeypatch.setattr(rate_limiter, '_async_limiters', {})
+
+
+def _payload():
+    return {'model': 'glm-test', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def test_stream_holds_the_concurrency_slot_until_consumed(upstream, limited):
+    limiter = rate_limiter.get_rate_limiter('glm-test', 'key')
+    paused = threading.Event()
+    _ScriptedHandler.script.append((200, {}, ['宫保', lambda: paused.wait(5), '鸡丁']))
+
+    chunks = GLMHttpClient('key', base_url=upstream).stream(_payload())
+    assert next(chunks) == '宫保'
+    # 上游还在生成，名额仍被占用
+    assert limiter.active == 1
+    paused.set()
+    assert list(chunks) == ['鸡丁']
+    assert limiter.active == 0
+
+
+def test_closing_a_stream_early_releases_the_slot(upstream, limited):
+    limiter = rate_limiter.get_rate_limiter('glm-test', 'key')
+    _ScriptedHandler.script.append((200, {}, ['宫保', '鸡丁']))
+
+    chunks = GLMHttpClient('key', base_url=upstream).stream(_payload())
+    next(chunks)
+    chunks.close()
+    assert limiter.active == 0
+
+
+def test_async_stream_holds_the_concurrency_slot_until_consumed(upstream, limited):
+    pytest.importorskip('httpx')
+    paused = threading.Event()
+    _ScriptedHandler.script.append((200, {}, ['宫保', lambda: paused.wait(5), '鸡丁']))
+
+    async def scenario():
+        limiter = rate_limiter.get_rate_limiter('glm-test', 'key')
+        client = AsyncGLMHttpClient('key', base_url=upstream)
+        chunks = client.stream(_payload())
+        first = await chunks.__anext__()
+        active = limiter.active
+        paused.set()
+        rest = [delta async for delta in chunks]
+        await client.aclose()
+        return first, active, rest, limiter.active
+
+    assert asyncio.run(scenario()) == ('宫保', 1, ['鸡丁'], 0)
+
+
+def test_sustained_429_becomes_an_overload_error(upstream, monkeypatch):
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', False)
+    for _ in range(Config.GLM_HTTP_MAX_RETRIES + 1):
+        _ScriptedHandler.script.append((429, {'Retry-After': '0'}, {'error': 'busy'}))
+
+    with pytest.raises(UpstreamOverloadedError) as info:
+        GLMHttpClient('key', base_url=upstream).post(_payload())
+
+    assert len(_ScriptedHandler.requests) == Config.GLM_HTTP_MAX_RETRIES + 1
+    assert info.value.retry_after == 1
+
+
+def test_exhausted_429_is_served_as_503_with_retry_after(upstream, monkeypatch):
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(Config, 'GLM_HTTP_MAX_RETRIES', 0)
+    _ScriptedHandler.script.append((429, {'Retry-After': '7'}, {'error': 'busy'}))
+
+    try:
+        # 服务层会把底层异常包装为普通 Exception
+        try:
+            GLMHttpClient('key', base_url=upstream).post(_payload())
+        except Exception as e:
+            raise Exception(f"GLM-4.1V API 调用失败: {str(e)}")
+    except Exception as e:
+        status, _, headers = error_response(e)
+
+    assert (status, headers) == (503, {'Retry-After': '7'})
+
+
+def test_async_sustained_429_becomes_an_overload_error(upstream, monkeypatch):
+    pytest.importorskip('httpx')
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(Config, 'GLM_HTTP_MAX_RETRIES', 0)
+    _ScriptedHandler.script.append((429, {'Retry-After': '3'}, {'error': 'busy'}))
+
+    async def scenario():
+        client = AsyncGLMHttpClient('key', base_url=upstream)
+        try:
+            await client.post(_payload())
+        finally:
+            await client.aclose()
+
+    with pytest.raises(UpstreamOverloadedError) as info:
+        asyncio.run(scenario())
+    assert info.value.retry_after == 3
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(Config, 'GLM_HTTP_BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(Config, 'GLM_HTTP_BACKOFF_JITTER', 0)
+
+
+def test_503_retry_after_does_not_stall_the_retry(upstream, fast_backoff):
+    _ScriptedHandler.script.append((503, {'Retry-After': '30'}, {'error': 'unavailable'}))
+    _ScriptedHandler.script.append((200, {}, {'choices': [{'message': {'content': 'ok'}}]}))
+
+    begin = time.monotonic()
+    result = GLMHttpClient('key', base_url=upstream).post(_payload())
+
+    assert result['choices'][0]['message']['content'] == 'ok'
+    assert len(_ScriptedHandler.requests) == 2
+    assert time.monotonic() - begin < 5
+
+
+def test_status_retries_stop_at_the_request_deadline(upstream, fast_backoff, monkeypatch):
+    # 退避时间远大于请求预算：重试前的等待被截短，预算用完后不再发出请求
+    monkeypatch.setattr(Config, 'GLM_HTTP_BACKOFF_FACTOR', 10)
+    for _ in range(3):
+        _ScriptedHandler.script.append((503, {}, {'error': 'unavailable'}))
+
+    begin = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        GLMHttpClient('key', base_url=upstream).post(_payload(), deadline=Deadline(0.3))
+
+    assert time.monotonic() - begin < 2
+    assert len(_ScriptedHandler.requests) == 1
+
+
+def test_async_status_retries_stop_at_the_request_deadline(upstream, fast_backoff, monkeypatch):
+    pytest.importorskip('httpx')
+    monkeypatch.setattr(Config, 'GLM_HTTP_BACKOFF_FACTOR', 10)
+    for _ in range(3):
+        _ScriptedHandler.script.append((503, {}, {'error': 'unavailable'}))
+
+    async def scenario():
+        client = AsyncGLMHttpClient('key', base_url=upstream)
+        try:
+            await client.post(_payload(), deadline=Deadline(0.3))
+        finally:
+            await client.aclose()
+
+    begin = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+    assert time.monotonic() - begin < 2
+
+
+def _closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f'http://127.0.0.1:{port}/api/paas/v4/chat/completions'
+
+
+def test_per_call_timeout_overrides_the_default_and_is_bounded_by_the_deadline():
+    client = GLMHttpClient('key', base_url='http://127.0.0.1:1/', connect_timeout=5, read_timeout=60)
+
+    assert client._timeout(None, None) == (5, 60)
+    assert client._timeout((2, 10), None) == (2, 10)
+    connect, read = client._timeout((2, 10), Deadline(1))
+    assert connect <= 1 and read <= 1
+
+
+def test_502_and_504_are_retried(upstream, fast_backoff):
+    _ScriptedHandler.script.extend([
+        (502, {}, {'error': 'bad gateway'}),
+        (504, {}, {'error': 'gateway timeout'}),
+        (200, {}, {'choices': []}),
+    ])
+
+    GLMHttpClient('key', base_url=upstream).post(_payload())
+
+    assert len(_ScriptedHandler.requests) == 3
+
+
+def test_other_errors_are_not_retried(upstream, fast_backoff):
+    _ScriptedHandler.script.append((500, {}, {'error': 'internal'}))
+
+    with pytest.raises(requests.HTTPError):
+        GLMHttpClient('key', base_url=upstream).post(_payload())
+    assert len(_ScriptedHandler.requests) == 1
+
+
+def test_read_timeout_is_not_retried(upstream, fast_backoff):
+    _ScriptedHandler.script.append((200, {}, {'choices': []}, 0.5))
+
+    # read=0 时 urllib3 以 MaxRetryError 结束，requests 将其包装为 ConnectionError
+    with pytest.raises(requests.exceptions.RequestException, match='Read timed out'):
+        GLMHttpClient('key', base_url=upstream).post(_payload(), timeout=(1, 0.1))
+    time.sleep(0.5)
+    assert len(_ScriptedHandler.requests) == 1
+
+
+def test_shared_adapter_only_retries_connection_failures():
+    retry = get_shared_session().get_adapter('https://open.bigmodel.cn').max_retries
+
+    assert retry.connect == Config.GLM_HTTP_MAX_RETRIES
+    assert retry.read == 0
+    assert retry.status == 0
+    assert retry.respect_retry_after_header is False
+
+
+def test_async_connect_errors_are_retried(fast_backoff):
+    httpx = pytest.importorskip('httpx')
+
+    async def scenario():
+        client = AsyncGLMHttpClient('key', base_url=_closed_port_url())
+        attempts = []
+        original = client.client.post
+
+        async def post(*args, **kwargs):
+            attempts.append(1)
+            return await original(*args, **kwargs)
+        client.client.post = post
+        try:
+            with pytest.raises(httpx.ConnectError):
+                await client.post(_payload())
+        finally:
+            await client.aclose()
+        return len(attempts)
+
+    assert asyncio.run(scenario()) == Config.GLM_HTTP_MAX_RETRIES + 1
+
+
+def test_async_read_timeout_is_not_retried(upstream, fast_backoff):
+    httpx = pytest.importorskip('httpx')
+    _ScriptedHandler.script.append((200, {}, {'choices': []}, 0.5))
+
+    async def scenario():
+        client = AsyncGLMHttpClient('key', base_url=upstream)
+        try:
+            with pytest.raises(httpx.ReadTimeout):
+                await client.post(_payload(), timeout=httpx.Timeout(0.1, connect=1))
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    time.sleep(0.5)
+    assert len(_ScriptedHandler.requests) == 1
+
+
+def test_async_services_do_not_build_a_sync_client(monkeypatch):
+    from app.services.glm41v_service import AsyncGLM41VService
+    from app.services.glm45_air_service import AsyncGLM45AirService
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("异步服务不应创建同步客户端")
+    monkeypatch.setattr(GLMHttpClient, '__init__', refuse)
+    monkeypatch.setattr(Config, 'GLM_4_1V_API_KEY', 'test-key')
+
+    for service_class in (AsyncGLM41VService, AsyncGLM45AirService):
+        service = service_class()
+        assert isinstance(service.http_client, AsyncGLMHttpClient)
+        assert service.hedger is not None
@@ -0,0 +1,78 @@
+import io
+import pytest
+from config import Config
+from app.business.image_preprocessing import ImagePreprocessor
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _jpeg(width, height, orientation=None):
+    image = Image.new('RGB', (width, height), 'white')
+    exif = image.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def small_tiles(monkeypatch):
+    # 按比例缩小的分块配置，保持测试图片较小
+    monkeypatch.setattr(Config, 'TILE_TRIGGER_SIDE', 600)
+    monkeypatch.setattr(Config, 'TILE_SIZE', 300)
+    monkeypatch.setattr(Config, 'TILE_MAX', 6)
+    monkeypatch.setattr(Config, 'TILE_OVERLAP', 0.1)
+
+
+def test_rotated_photo_tiles_like_upright_photo(small_tiles):
+    preprocessor = ImagePreprocessor(max_side=300, tiling=True)
+    rotated = preprocessor.process(_jpeg(900, 600, orientation=6))
+    upright = preprocessor.process(_jpeg(600, 900))
+
+    assert (rotated.width, rotated.height) == (upright.width, upright.height) == (200, 300)
+    assert len(rotated.tiles) == len(upright.tiles) == 6
+    assert [(t.width, t.height) for t in rotated.tiles] == [(t.width, t.height) for t in upright.tiles]
+    assert all(max(t.width, t.height) == 300 for t in rotated.tiles)
+
+
+def test_small_image_is_not_tiled(small_tiles):
+    result = ImagePreprocessor(max_side=300, tiling=True).process(_jpeg(400, 300, orientation=6))
+    assert result.tiles == []
+    assert (result.width, result.height) == (225, 300)
+
+
+def test_unknown_bytes_are_passed_through():
+    data = b'not an image'
+    result = ImagePreprocessor().process(data)
+    assert result.data == data
+    assert result.mime_type == 'image/jpeg'
+
+
+def test_huge_image_is_split_into_at_most_tile_max_tiles(small_tiles):
+    result = ImagePreprocessor(max_side=300, tiling=True).process(_jpeg(3000, 1200))
+
+    assert 1 < len(result.tiles) <= Config.TILE_MAX
+    assert all(max(tile.width, tile.height) <= 300 for tile in result.tiles)
+    assert max(result.width, result.height) == 300
+
+
+def test_tiling_disabled(small_tiles):
+    result = ImagePreprocessor(max_side=300, tiling=False).process(_jpeg(900, 600))
+    assert result.tiles == []
+
+
+def test_overlapping_tiles_are_merged_without_duplicates():
+    from app.business.menu_recognition import MenuRecognition
+
+    recognition = MenuRecognition(glm41v_service=None)
+    merged = recognition._merge_tile_menus([
+        {'热菜': [{'name': '宫保鸡丁', 'price': ''}, {'name': '麻婆豆腐', 'price': 18}]},
+        None,
+        {'热菜': [{'name': '宫保鸡丁 ', 'price': 38}], '汤': [{'name': '番茄蛋汤', 'price': 12}]},
+    ])
+
+    assert merged == {
+        '热菜': [{'name': '宫保鸡丁', 'price': 38}, {'name': '麻婆豆腐', 'price': 18}],
+        '汤': [{'name': '番茄蛋汤', 'price': 12}],
+    }
@@ -0,0 +1,55 @@
+import pytest
+
+from app.business.json_extractor import IncrementalDishParser, extract_json
+
+
+def test_prefers_json_code_fence():
+    content = '说明 {"ignored": true}\n```json\n[{"name": "宫保鸡丁"}]\n```'
+    assert extract_json(content) == [{'name': '宫保鸡丁'}]
+
+
+def test_bare_json_with_trailing_text():
+    assert extract_json('结果如下：{"totalCalories": 800} 以上为估算') == {'totalCalories': 800}
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('[{"name": "a", "calories": 100,},]', [{'name': 'a', 'calories': 100}]),
+    ('{"name": "a", "price": ¥12}', {'name': 'a', 'price': 12}),
+    ('{"name": "a", "价格": 12元}', {'name': 'a', '价格': 12}),
+])
+def test_repairs_common_defects(content, expected):
+    assert extract_json(content) == expected
+
+
+def test_expect_list_unwraps_single_list_field():
+    assert extract_json('{"dishes": [{"name": "a"}]}', expect=list) == [{'name': 'a'}]
+    assert extract_json('{"name": "a"}', expect=list) is None
+
+
+def test_truncated_array_drops_the_cut_off_element():
+    content = '```json\n[{"name": "a", "calories": 100}, {"name": "b", "calor'
+    assert extract_json(content, expect=list) == [{'name': 'a', 'calories': 100}]
+
+
+def test_truncated_nested_element_is_dropped_whole():
+    content = '{"热菜": [{"name": "a"}], "凉菜": [{"name": "b"}, {"name": "c", "tags": ["x", "y'
+    assert extract_json(content) == {'热菜': [{'name': 'a'}], '凉菜': [{'name': 'b'}]}
+
+
+def test_truncated_first_element_gives_empty_list():
+    assert extract_json('[{"name": "b", "calor', expect=list) == []
+
+
+def test_unparseable_content():
+    assert extract_json('没有JSON') is None
+    assert extract_json(None) is None
+
+
+def test_incremental_parser_yields_dishes_as_they_close():
+    parser = IncrementalDishParser()
+    chunks = ['```json\n{"热菜": [{"name": "宫保', '鸡丁", "price": 38}, {"na', 'me": "麻婆豆腐"}]}\n```']
+    fed = [parser.feed(chunk) for chunk in chunks]
+
+    assert fed[0] == []
+    assert fed[1] == [('热菜', {'name': '宫保鸡丁', 'price': 38})]
+    assert fed[2] == [('热菜', {'name': '麻婆豆腐'})]
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app import create_app
+from app.services.metrics import STAGE_DURATION, Counter, Histogram, timed_stage
+from config import Config
+
+
+@pytest.fixture(autouse=True)
+def metrics_enabled(monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', True)
+
+
+def test_counter_renders_prometheus_text():
+    counter = Counter('test_total', 'Test counter.', ('stage',))
+    counter.inc(stage='health')
+    counter.inc(2, stage='health')
+    counter.inc(stage='say "hi"\n')
+
+    assert counter.render() == [
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{stage="health"} 3',
+        'test_total{stage="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', 'Test histogram.', ('stage',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage='menu')
+
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{stage="menu",le="0.1"} 1',
+        'test_seconds_bucket{stage="menu",le="1"} 2',
+        'test_seconds_bucket{stage="menu",le="+Inf"} 3',
+        'test_seconds_sum{stage="menu"} 5.55',
+        'test_seconds_count{stage="menu"} 3',
+    ]
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', False)
+    counter = Counter('test_total', 'Test counter.')
+    counter.inc()
+
+    assert counter.render() == ['# HELP test_total Test counter.', '# TYPE test_total counter']
+
+
+def _count(component, outcome, stage='test'):
+    state = STAGE_DURATION._values.get((stage, component, outcome))
+    return state[2] if state else 0
+
+
+class _TimedFunction:
+    @timed_stage('test')
+    def run(self, fail=False):
+        if fail:
+            raise ValueError('boom')
+        return 'done'
+
+
+class _TimedGenerator:
+    @timed_stage('test')
+    def run(self):
+        yield 1
+        yield 2
+
+
+class _TimedCoroutine:
+    @timed_stage('test')
+    async def run(self):
+        return 'done'
+
+
+def test_timed_stage_records_outcomes_by_component():
+    before_ok, before_error = _count('_TimedFunction', 'ok'), _count('_TimedFunction', 'error')
+    component = _TimedFunction()
+
+    assert component.run() == 'done'
+    with pytest.raises(ValueError):
+        component.run(fail=True)
+
+    assert _count('_TimedFunction', 'ok') == before_ok + 1
+    assert _count('_TimedFunction', 'error') == before_error + 1
+
+
+def test_timed_stage_times_generators_until_exhausted_or_closed():
+    before_ok, before_cancelled = _count('_TimedGenerator', 'ok'), _count('_TimedGenerator', 'cancelled')
+
+    assert list(_TimedGenerator().run()) == [1, 2]
+    stream = _TimedGenerator().run()
+    next(stream)
+    # 尚未迭代结束的生成器不记录耗时
+    assert _count('_TimedGenerator', 'ok') == before_ok + 1
+    stream.close()
+
+    assert _count('_TimedGenerator', 'cancelled') == before_cancelled + 1
+
+
+def test_timed_stage_wraps_coroutines():
+    before = _count('_TimedCoroutine', 'ok')
+
+    assert asyncio.run(_TimedCoroutine().run()) == 'done'
+    assert _count('_TimedCoroutine', 'ok') == before + 1
+
+
+def test_metrics_endpoint_exposes_the_registry():
+    _TimedFunction().run()
+    response = create_app().test_client().get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE menu_ocr_stage_duration_seconds histogram' in text
+    assert 'menu_ocr_stage_duration_seconds_count{stage="test",component="_TimedFunction",outcome="ok"}' in text
+    assert '# TYPE menu_ocr_upstream_duration_seconds histogram' in text
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from app.business.dish import Dish
+from app.services.nutrition_kb import NutritionKnowledgeBase
+
+
+def _entry(name, calories, aliases=()):
+    return {'name': name, 'aliases': list(aliases), 'calories': calories, 'protein': 10, 'carbs': 20, 'fat': 5}
+
+
+@pytest.fixture
+def kb(tmp_path):
+    path = tmp_path / 'dishes.json'
+    path.write_text(json.dumps({'dishes': [
+        _entry('宫保鸡丁', 520),
+        _entry('麻婆豆腐', 380),
+        _entry('土豆丝', 210, aliases=['酸辣土豆丝']),
+        _entry('西红柿炒鸡蛋', 300, aliases=['番茄炒蛋']),
+        _entry('红烧肉', 650),
+    ]}, ensure_ascii=False), encoding='utf-8')
+    return NutritionKnowledgeBase(paths=[str(path)], min_confidence=0.8)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('宫保鸡丁', '宫保鸡丁'),
+    ('招牌宫保鸡丁（小份）', '宫保鸡丁'),
+    ('番茄炒蛋', '西红柿炒鸡蛋'),
+    # 易混字
+    ('宫爆鸡丁', '宫保鸡丁'),
+    ('麻婆豆付', '麻婆豆腐'),
+    ('西红柿炒鸡旦', '西红柿炒鸡蛋'),
+])
+def test_matches_variants_of_known_dishes(kb, name, expected):
+    entry, confidence = kb.lookup(name)
+    assert entry['name'] == expected
+    assert confidence >= 0.8
+
+
+@pytest.mark.parametrize('name', [
+    # 只差一个字但不是易混字：是另一道菜
+    '酸辣土鸡丝',
+    '麻婆鱼腐',
+    # 短菜名多了主料
+    '红烧牛肉',
+    '宫保虾丁',
+    '',
+])
+def test_does_not_match_different_dishes(kb, name):
+    assert kb.lookup(name) is None
+
+
+def test_get_many_reports_source_and_confidence(kb):
+    known = kb.get_many([Dish('宫爆鸡丁'), Dish('酸辣土鸡丝'), Dish('红烧肉')])
+
+    assert sorted(known) == [0, 2]
+    assert known[0]['nutritionSource'] == 'knowledge_base'
+    assert known[0]['nutritionConfidence'] < 1.0
+    assert known[2]['nutritionConfidence'] == 1.0
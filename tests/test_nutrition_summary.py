@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from app.business.dish import Dish
+from app.business.nutrition_columns import pack_columns
+from app.business.nutrition_summary import NutritionSummary, summarize_matrix
+
+
+def _dish(name, calories=None, protein=None, carbs=None, fat=None):
+    data = {'calories': calories, 'protein': protein, 'carbs': carbs, 'fat': fat}
+    return Dish(name).with_nutrition({key: value for key, value in data.items() if value is not None})
+
+
+def _summarize(dishes):
+    return summarize_matrix(pack_columns(dishes), [dish.name for dish in dishes])
+
+
+def test_totals_and_dish_shares():
+    summary = _summarize([_dish('宫保鸡丁', 300, 20, 10, 15), _dish('米饭', 100, 5, 30, 1)])
+
+    assert (summary['totalCalories'], summary['totalProtein'], summary['totalCarbs'], summary['totalFat']) == \
+        (400.0, 25.0, 40.0, 16.0)
+    assert summary['dishShares'] == [
+        {'name': '宫保鸡丁', 'calories': 0.75, 'protein': 0.8, 'carbs': 0.25, 'fat': 0.9375},
+        {'name': '米饭', 'calories': 0.25, 'protein': 0.2, 'carbs': 0.75, 'fat': 0.0625},
+    ]
+    assert summary['source'] == 'local'
+
+
+def test_macro_ratios_use_energy_per_gram():
+    # 蛋白质 10g=40kcal，碳水 20g=80kcal，脂肪 10g=90kcal
+    summary = _summarize([_dish('清蒸鱼', 200, 10, 20, 10)])
+
+    assert summary['macroRatios'] == {'protein': 0.1905, 'carbs': 0.381, 'fat': 0.4286}
+    assert sum(summary['macroRatios'].values()) == pytest.approx(1, abs=1e-3)
+
+
+def test_missing_fields_count_as_zero():
+    summary = _summarize([_dish('宫保鸡丁', 300, protein=20), _dish('未知菜品')])
+
+    assert summary['totalCalories'] == 300.0
+    assert summary['totalFat'] == 0.0
+    # 只有蛋白质有值，供能全部来自蛋白质
+    assert summary['macroRatios'] == {'protein': 1.0, 'carbs': 0.0, 'fat': 0.0}
+    # 总量为 0 的列占比记为 0，而不是 NaN
+    assert summary['dishShares'][1] == {'name': '未知菜品', 'calories': 0.0, 'protein': 0.0, 'carbs': 0.0, 'fat': 0.0}
+    assert summary['dishShares'][0]['fat'] == 0.0
+
+
+def test_no_nutrition_at_all_gives_zero_ratios():
+    summary = _summarize([_dish('未知菜品')])
+
+    assert summary['macroRatios'] == {'protein': 0.0, 'carbs': 0.0, 'fat': 0.0}
+    assert not any(np.isnan(value) for value in summary['dishShares'][0].values() if isinstance(value, float))
+
+
+def test_empty_selection():
+    summary = summarize_matrix(pack_columns([]), [])
+
+    assert summary['totalCalories'] == 0.0
+    assert summary['dishShares'] == []
+
+
+class _SummaryService:
+    MODEL = 'glm-test'
+    SUMMARY_PROMPT_VERSION = 'v-test'
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_nutrition_summary(self, dishes, deadline=None):
+        self.calls += 1
+        return {'choices': [{'message': {'content': '{"totalCalories": 999}'}}]}
+
+
+def test_local_mode_does_not_call_the_llm():
+    service = _SummaryService()
+    summary = NutritionSummary(service, mode='local', llm_fallback=False).generate([_dish('米饭', 100)])
+
+    assert summary['totalCalories'] == 100.0
+    assert service.calls == 0
+
+
+def test_missing_fields_fall_back_to_the_llm_when_enabled():
+    service = _SummaryService()
+    summary = NutritionSummary(service, mode='local', llm_fallback=True).generate([_dish('米饭', 100)])
+
+    assert summary == {'totalCalories': 999}
+    assert service.calls == 1
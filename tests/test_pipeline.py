@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from app.business.cost_calculator import CostCalculator
+from app.business.pipeline import AsyncMenuPipeline, MenuPipeline, error_response
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.rate_limiter import UpstreamOverloadedError
+from config import Config
+
+MENU = {'热菜': [{'name': '宫保鸡丁', 'price': '¥38'}, {'name': '清炒时蔬', 'price': 22}, {'price': 5}]}
+
+
+class _Image:
+    base64 = 'aW1n'
+    mime_type = 'image/jpeg'
+    tiles = None
+
+    def info(self):
+        return {'width': 100, 'height': 100}
+
+
+class _Recognition:
+    def recognize(self, image_base64, mime_type, deadline=None):
+        return MENU
+
+
+class _Health:
+    def analyze(self, dish_list, deadline=None):
+        analyzed = [dish.copy() for dish in dish_list]
+        for dish in analyzed:
+            dish.calories = 300.0
+        return analyzed
+
+
+class _Recommend:
+    def recommend(self, dish_list, deadline=None):
+        return dish_list[:1]
+
+
+class _Summary:
+    def generate(self, recommended, deadline=None):
+        return {'totalCalories': sum(dish.calories for dish in recommended)}
+
+
+class _NoFused:
+    def applies_to(self, dish_count=None):
+        return False
+
+
+def _async(component):
+    # 把同步替身的方法包装为协程，验证两种入口得到相同的结果
+    class Wrapper:
+        def __getattr__(self, name):
+            method = getattr(component, name)
+            if name == 'applies_to':
+                return method
+
+            async def call(*args, **kwargs):
+                return method(*args, **kwargs)
+            return call
+    return Wrapper()
+
+
+def _components():
+    return _Recognition(), _Health(), _Recommend(), _Summary(), _NoFused()
+
+
+@pytest.fixture(autouse=True)
+def no_menu_stream(monkeypatch):
+    monkeypatch.setattr(Config, 'MENU_STREAM_ENABLED', False)
+
+
+def test_run_yields_stages_in_order():
+    pipeline = MenuPipeline(*_components(), CostCalculator())
+
+    stages = [stage for stage, _ in pipeline.run(_Image())]
+
+    assert stages == ['menu', 'nutrition', 'recommendations', 'summary']
+
+
+def test_sync_and_async_pipelines_return_the_same_result():
+    sync_result = MenuPipeline(*_components(), CostCalculator()).collect(_Image(), Deadline(30))
+    async_pipeline = AsyncMenuPipeline(*[_async(c) for c in _components()], CostCalculator())
+    async_result = asyncio.run(async_pipeline.collect(_Image(), Deadline(30)))
+
+    def plain(result):
+        return {key: [dish.to_dict() for dish in value] if isinstance(value, list) else value
+                for key, value in result.items()}
+
+    assert plain(sync_result) == plain(async_result)
+    assert [dish.name for dish in sync_result['dishList']] == ['宫保鸡丁', '清炒时蔬']
+    assert sync_result['dishList'][0].price == 38.0
+    assert sync_result['partial'] is False
+
+
+def test_error_response_maps_overload_and_timeout():
+    try:
+        raise Exception('菜单识别失败') from UpstreamOverloadedError('busy', 7)
+    except Exception as e:
+        status, body, headers = error_response(e)
+    assert (status, headers) == (503, {'Retry-After': '7'})
+
+    status, body, _ = error_response(DeadlineExceeded('budget'))
+    assert status == 504
+    assert body['stageStatus'] == {'menu': 'timeout'}
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.rate_limiter import (
+    RateLimiter, UpstreamOverloadedError, get_async_rate_limiter, get_rate_limiter, parse_retry_after,
+)
+from app.services import rate_limiter
+from config import Config
+
+
+@pytest.mark.skipif('GLM_RATE_LIMIT_ENABLED' in os.environ, reason='由环境变量显式配置')
+def test_rate_limiting_is_off_by_default():
+    assert Config.GLM_RATE_LIMIT_ENABLED is False
+
+
+def test_disabled_limiter_is_none(monkeypatch):
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', False)
+    assert get_rate_limiter('glm-4-flash', 'key') is None
+
+
+def test_burst_then_waits_for_tokens():
+    limiter = RateLimiter('test', qps=20, max_concurrency=10, burst=2, max_queue=10, max_wait=1)
+    begin = time.monotonic()
+    for _ in range(3):
+        with limiter.slot():
+            pass
+    # 第三个请求要等一个令牌（1/20 秒）
+    assert time.monotonic() - begin >= 0.04
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    limiter = RateLimiter('test', qps=10, max_concurrency=1, burst=5, max_queue=1, max_wait=1)
+    with limiter.slot():
+        # 一个请求在排队，队列已满
+        waiter = threading.Thread(target=limiter.acquire, daemon=True)
+        waiter.start()
+        while limiter.waiting == 0:
+            time.sleep(0.001)
+        with pytest.raises(UpstreamOverloadedError) as info:
+            limiter.acquire()
+    assert info.value.retry_after >= 1
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_waiting_past_the_request_deadline_is_a_timeout_not_a_rejection():
+    limiter = RateLimiter('test', qps=1, max_concurrency=1, burst=1, max_queue=5, max_wait=5)
+    with limiter.slot():
+        with pytest.raises(DeadlineExceeded):
+            limiter.acquire(Deadline(0.05))
+    assert limiter.stats()['rejected'] == 0
+
+
+def test_sync_and_async_limiters_share_one_bucket(monkeypatch):
+    # ASGI 入口下同一进程内既有异步请求也有经 WsgiToAsgi 的同步请求，两者合计不能超过配额
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(Config, 'GLM_RATE_LIMITS', 'glm-shared=100:1')
+    monkeypatch.setattr(rate_limiter, '_limiters', {})
+    monkeypatch.setattr(rate_limiter, '_async_limiters', {})
+    sync_limiter = get_rate_limiter('glm-shared', 'key')
+    async_limiter = get_async_rate_limiter('glm-shared', 'key')
+
+    async def scenario():
+        sync_limiter.acquire()
+        # 同步请求在另一个线程中稍后释放名额，异步等待者应被唤醒
+        threading.Timer(0.05, sync_limiter.release).start()
+        begin = time.monotonic()
+        async with async_limiter.slot():
+            waited = time.monotonic() - begin
+            assert sync_limiter.active == 1
+        return waited
+
+    waited = asyncio.run(scenario())
+    assert 0.04 <= waited < 1
+    assert sync_limiter.active == 0
+    assert list(rate_limiter.rate_limiter_stats()) == [sync_limiter.name]
+
+
+def test_throttling_halves_rate_and_recovers():
+    limiter = RateLimiter('test', qps=10, max_concurrency=4, burst=4, max_queue=5, max_wait=1)
+    limiter.penalize(0.01)
+    assert limiter.rate == 5
+    for _ in range(5):
+        limiter.record_success()
+    assert limiter.rate == 10
+
+
+@pytest.mark.parametrize('value, expected', [('3', 3.0), ('-1', 0.0), ('soon', None), (None, None)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
@@ -0,0 +1,120 @@
+import json
+import math
+
+import pytest
+
+from app.business.dish import Dish
+from app.business.recommendation_engine import RecommendationEngine
+from config import Config
+
+
+class _RecordingService:
+    """
+    记录发给大模型的候选菜品，并推荐其中的第一道
+    """
+    MODEL = 'test-model'
+    RECOMMEND_PROMPT_VERSION = 'test'
+
+    def __init__(self):
+        self.sent = None
+
+    def recommend_dishes(self, dishes, deadline=None):
+        self.sent = dishes
+        content = json.dumps([{'id': 'd1', 'score': 0.9}])
+        return {'choices': [{'message': {'content': content}}]}
+
+
+def _dish(name, calories, protein, fat):
+    dish = Dish(name, price=30)
+    dish.calories, dish.protein, dish.carbs, dish.fat = float(calories), float(protein), 20.0, float(fat)
+    return dish
+
+
+def test_large_menu_is_preselected_by_health_score(monkeypatch):
+    monkeypatch.setattr(Config, 'PROMPT_TOKEN_BUDGET', 120)
+    # 菜单前面都是高热量菜品，最健康的菜在最后
+    menu = [_dish(f'油炸拼盘{i}', 1200, 10, 60) for i in range(20)] + [_dish('白灼虾', 150, 30, 2)]
+    service = _RecordingService()
+    engine = RecommendationEngine(service, mode='llm', llm_reasons=False)
+
+    recommended = engine.recommend(menu)
+
+    assert len(service.sent) < len(menu)
+    assert service.sent[-1].name == '白灼虾'
+    # 编号对应候选列表
+    assert recommended[0].name == service.sent[0].name
+
+
+def test_small_menu_is_sent_whole():
+    menu = [_dish('白灼虾', 150, 30, 2), _dish('红烧肉', 650, 20, 45)]
+    service = _RecordingService()
+    engine = RecommendationEngine(service, mode='llm', llm_reasons=False)
+
+    engine.recommend(menu)
+
+    assert service.sent is menu
+
+
+def _baseline_scores(calories, protein, fat, price):
+    """
+    本地评分改为向量化之前的逐道菜公式，用于对比
+    """
+    protein_density = math.ceil((protein / calories) * 1000) / 1000 if calories > 0 else 0
+    protein_value = math.ceil((protein / price) * 100) / 100 if price > 0 else 0
+    health_score = 0
+    if calories > 0:
+        calorie_score = math.ceil((1 - min(calories / 1000, 1)) * 100) / 100
+        fat_score = math.ceil((1 - min(fat / 50, 1)) * 100) / 100
+        protein_score = math.ceil(min(protein / 50, 1) * 100) / 100
+        health_score = math.ceil((calorie_score * 0.4 + fat_score * 0.3 + protein_score * 0.3) * 100) / 100
+    return protein_density, protein_value, health_score
+
+
+@pytest.mark.parametrize('calories, protein, fat, price', [
+    (150, 30, 2, 58),
+    (650, 20.5, 45, 42),
+    (1200, 10, 60, 30),
+    (333, 7.7, 12.3, 19.9),
+    (0, 12, 3, 20),
+    (420, 0, 0, 0),
+    (999.9, 49.9, 49.9, 1),
+])
+def test_scores_match_the_original_formulas(calories, protein, fat, price):
+    dish = _dish('菜品', calories, protein, fat)
+    dish.price = float(price)
+    engine = RecommendationEngine(None, mode='local', llm_reasons=False, weights={
+        'calories': 0.4, 'fat': 0.3, 'protein': 0.3,
+    })
+
+    protein_density, protein_value, health_score = engine._score([dish])
+
+    expected = _baseline_scores(calories, protein, fat, price)
+    assert (float(protein_density[0]), float(protein_value[0]), float(health_score[0])) == \
+        pytest.approx(expected, abs=1e-9)
+
+
+def test_rank_keeps_the_top_n_by_health_score():
+    menu = [_dish('红烧肉', 650, 20, 45), _dish('白灼虾', 150, 30, 2), _dish('油炸拼盘', 1200, 10, 60),
+            _dish('清蒸鱼', 250, 28, 6)]
+    engine = RecommendationEngine(None, mode='local', top_n=2, llm_reasons=False)
+
+    recommended = engine.recommend(menu)
+
+    assert [dish.name for dish in recommended] == ['白灼虾', '清蒸鱼']
+    assert recommended[0].health_score >= recommended[1].health_score
+    # 推荐结果是副本，健康分析的菜品列表不带评分
+    assert menu[1].health_score is None
+
+
+def test_rank_keeps_menu_order_for_ties():
+    menu = [_dish(f'同分菜品{i}', 300, 20, 10) for i in range(5)]
+    engine = RecommendationEngine(None, mode='local', top_n=3, llm_reasons=False)
+
+    assert [dish.name for dish in engine.recommend(menu)] == ['同分菜品0', '同分菜品1', '同分菜品2']
+
+
+def test_top_n_larger_than_menu_returns_everything():
+    menu = [_dish('白灼虾', 150, 30, 2), _dish('红烧肉', 650, 20, 45)]
+    engine = RecommendationEngine(None, mode='local', top_n=10, llm_reasons=False)
+
+    assert [dish.name for dish in engine.recommend(menu)] == ['白灼虾', '红烧肉']
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def _start_leader(flight, fn, started):
+    result = {}
+
+    def run():
+        try:
+            result['value'] = flight.do('key', fn)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(1)
+    return thread, result
+
+
+def test_concurrent_calls_share_one_upstream_request():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return {'dishes': ['宫保鸡丁']}
+
+    thread, leader = _start_leader(flight, fn, started)
+    follower = {}
+    follower_thread = threading.Thread(target=lambda: follower.update(value=flight.do('key', fn)))
+    follower_thread.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join(1)
+    follower_thread.join(1)
+
+    assert len(calls) == 1
+    assert follower['value'] == leader['value']
+    # 跟随者拿到的是副本
+    assert follower['value'] is not leader['value']
+    assert flight.coalesced == 1
+
+
+def test_follower_wait_is_bounded_by_its_own_deadline():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+        return 'late'
+
+    thread, _ = _start_leader(flight, slow, started)
+    begin = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        flight.do('key', slow, Deadline(0.1))
+    assert time.monotonic() - begin < 1
+    release.set()
+    thread.join(1)
+
+
+def test_follower_retries_when_leader_ran_out_of_time():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(1)
+        raise DeadlineExceeded('leader budget')
+
+    thread, leader = _start_leader(flight, leader_fn, started)
+    follower = {}
+    follower_thread = threading.Thread(
+        target=lambda: follower.update(value=flight.do('key', lambda: 'fresh', Deadline(5)))
+    )
+    follower_thread.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join(1)
+    follower_thread.join(1)
+
+    assert isinstance(leader['error'], DeadlineExceeded)
+    assert follower['value'] == 'fresh'
+
+
+def test_stream_follower_retries_when_leader_timed_out_before_first_chunk():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(1)
+        raise DeadlineExceeded('leader budget')
+        yield  # pragma: no cover
+
+    leader = {}
+
+    def run_leader():
+        try:
+            list(flight.stream('key', leader_fn))
+        except Exception as e:
+            leader['error'] = e
+
+    thread = threading.Thread(target=run_leader)
+    thread.start()
+    assert started.wait(1)
+    follower = {}
+    follower_thread = threading.Thread(
+        target=lambda: follower.update(chunks=list(flight.stream('key', lambda: iter(['a', 'b']), Deadline(5))))
+    )
+    follower_thread.start()
+    time.sleep(0.05)
+    release.set()
+    thread.join(1)
+    follower_thread.join(1)
+
+    assert isinstance(leader['error'], DeadlineExceeded)
+    assert follower['chunks'] == ['a', 'b']
+
+
+def test_async_follower_deadline_and_retry():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def leader_fn():
+            await release.wait()
+            raise DeadlineExceeded('leader budget')
+
+        async def fresh():
+            return 'fresh'
+
+        leader = asyncio.create_task(flight.do('key', leader_fn))
+        await asyncio.sleep(0)
+        # 等待超过自己的时限
+        with pytest.raises(DeadlineExceeded):
+            await flight.do('key', fresh, Deadline(0.05))
+        follower = asyncio.create_task(flight.do('key', fresh, Deadline(5)))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(DeadlineExceeded):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == 'fresh'
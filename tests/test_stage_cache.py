@@ -0,0 +1,100 @@
+import time
+
+from app.business.dish import Dish
+from app.services.stage_cache import StageCache, StageCacheMixin
+from config import Config
+
+
+def test_key_depends_on_stage_model_prompt_and_input():
+    key = StageCache.make_key('health', 'glm-4', 'v1', [Dish('宫保鸡丁')])
+    assert key == StageCache.make_key('health', 'glm-4', 'v1', [Dish('宫保鸡丁')])
+    assert key != StageCache.make_key('health', 'glm-4', 'v2', [Dish('宫保鸡丁')])
+    assert key != StageCache.make_key('recommend', 'glm-4', 'v1', [Dish('宫保鸡丁')])
+    assert key != StageCache.make_key('health', 'glm-4', 'v1', [Dish('麻婆豆腐')])
+
+
+def test_reads_return_fresh_copies(tmp_path):
+    cache = StageCache(cache_dir=str(tmp_path), max_entries=10, ttl=60, disk_ttl=60)
+    cache.set('k', {'dishes': [Dish('宫保鸡丁', price=38)]})
+
+    first = cache.get('k')
+    first['dishes'].append('changed')
+    assert cache.get('k') == {'dishes': [{'name': '宫保鸡丁', 'description': '', 'price': 38}]}
+    assert cache.stats()['memory_hits'] == 2
+
+
+def test_lru_eviction_falls_back_to_disk(tmp_path):
+    cache = StageCache(cache_dir=str(tmp_path), max_entries=2, ttl=60, disk_ttl=60)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, {'key': key})
+
+    assert cache.stats()['evictions'] == 1
+    assert cache.get('a') == {'key': 'a'}
+    stats = cache.stats()
+    assert stats['disk_hits'] == 1
+    assert stats['memory_entries'] == 2
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = StageCache(cache_dir=str(tmp_path), max_entries=10, ttl=0.01, disk_ttl=0.01)
+    cache.set('k', [1])
+    time.sleep(0.02)
+
+    assert cache.get('k') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_memory_only_cache_without_directory(monkeypatch):
+    monkeypatch.setattr(Config, 'STAGE_CACHE_DIR', '')
+    cache = StageCache(max_entries=1, ttl=60, disk_ttl=60)
+    cache.set('a', [1])
+    cache.set('b', [2])
+    assert cache.get('a') is None
+    assert cache.get('b') == [2]
+
+
+def test_mixin_skips_empty_results_and_disabled_cache(tmp_path):
+    class Stage(StageCacheMixin):
+        def __init__(self, cache):
+            self.cache = cache
+
+    stage = Stage(StageCache(cache_dir=str(tmp_path), max_entries=10, ttl=60, disk_ttl=60))
+    key = stage._cache_key('health', 'glm-4', 'v1', 'input')
+    stage._cache_set(key, [])
+    assert stage._cache_get(key) is None
+    stage._cache_set(key, [{'name': 'a'}])
+    assert stage._cache_get(key) == [{'name': 'a'}]
+
+    assert Stage(None)._cache_key('health', 'glm-4', 'v1', 'input') is None
+
+
+def test_async_helpers_keep_cache_io_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+
+    class _Cache(StageCache):
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            return super().get(key)
+
+        def set(self, key, value):
+            self.threads.append(threading.get_ident())
+            super().set(key, value)
+
+    class Stage(StageCacheMixin):
+        def __init__(self, cache):
+            self.cache = cache
+
+    async def run():
+        stage = Stage(_Cache(cache_dir=str(tmp_path), max_entries=10, ttl=60, disk_ttl=60))
+        key = stage._cache_key('health', 'glm-4', 'v1', 'input')
+        await stage._acache_set(key, [{'name': 'a'}])
+        assert await stage._acache_get(key) == [{'name': 'a'}]
+        assert await Stage(None)._acache_get(None) is None
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(_Cache.threads) == 2
+    assert loop_thread not in _Cache.threads
@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+
+from app.services import static_assets as module
+from app.services.static_assets import StaticAssets, parse_accept_encoding
+
+SCRIPT = ('console.log("菜单");\n' * 100).encode('utf-8')
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'index.html').write_text('<html>' + '<p>菜单</p>' * 100 + '</html>', encoding='utf-8')
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'app.js').write_bytes(SCRIPT)
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' + b'\x00' * 1000)
+    return StaticAssets(str(tmp_path), max_age=600)
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, br;q=0.5, identity;q=0') == {'gzip': 1.0, 'br': 0.5, 'identity': 0.0}
+    assert parse_accept_encoding(None) == {}
+
+
+def test_gzip_is_served_when_accepted(assets):
+    asset = assets.get('js/app.js')
+    status, headers, body = assets.respond(asset, 'gzip, deflate', None)
+
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert headers['Cache-Control'] == 'public, max-age=600'
+    assert gzip.decompress(body) == SCRIPT
+
+
+@pytest.mark.parametrize('accept', [None, 'identity', 'gzip;q=0', 'deflate'])
+def test_identity_when_compression_not_accepted(assets, accept):
+    status, headers, body = assets.respond(assets.get('js/app.js'), accept, None)
+    assert 'Content-Encoding' not in headers
+    assert body == SCRIPT
+
+
+def test_brotli_preferred_when_available(assets):
+    if module.brotli is None:
+        pytest.skip('brotli 未安装')
+    _, headers, _ = assets.respond(assets.get('js/app.js'), 'gzip, br', None)
+    assert headers['Content-Encoding'] == 'br'
+
+
+def test_each_encoding_has_its_own_etag_and_revalidates(assets):
+    asset = assets.get('js/app.js')
+    _, gzip_headers, _ = assets.respond(asset, 'gzip', None)
+    _, plain_headers, _ = assets.respond(asset, None, None)
+    assert gzip_headers['ETag'] != plain_headers['ETag']
+
+    status, headers, body = assets.respond(asset, 'gzip', f'W/{gzip_headers["ETag"]}, "other"')
+    assert (status, body) == (304, b'')
+    assert headers['ETag'] == gzip_headers['ETag']
+    # 换了编码的 ETag 不匹配，返回完整内容
+    status, _, _ = assets.respond(asset, None, gzip_headers['ETag'])
+    assert status == 200
+
+
+def test_index_is_revalidated_and_binaries_are_not_compressed(assets):
+    assert assets.get('index.html').cache_control == 'no-cache'
+    png = assets.get('logo.png')
+    assert not png.varies
+    _, headers, _ = assets.respond(png, 'gzip', None)
+    assert 'Content-Encoding' not in headers and 'Vary' not in headers
+
+
+def test_flask_routes_fast_404_and_spa_fallback():
+    from app import create_app
+
+    client = create_app().test_client()
+    assert client.get('/missing.js').status_code == 404
+    assert client.get('/api/missing').get_json() == {'error': '接口不存在'}
+    page = client.get('/some/front-end/route')
+    assert page.status_code == 200
+    assert page.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/', headers={'If-None-Match': page.headers['ETag']}).status_code == 304